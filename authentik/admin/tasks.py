@@ -6,12 +6,13 @@ from django.core.cache import cache
 from django.core.validators import URLValidator
 from packaging.version import parse
 from prometheus_client import Info
-from requests import RequestException, get
+from requests import RequestException
 from structlog.stdlib import get_logger
 
 from authentik import ENV_GIT_HASH_KEY, __version__
 from authentik.events.models import Event, EventAction
 from authentik.events.monitored_tasks import MonitoredTask, TaskResult, TaskResultStatus
+from authentik.lib.utils.http import get_http_session
 from authentik.root.celery import CELERY_APP
 
 LOGGER = get_logger()
@@ -37,7 +38,7 @@ def _set_prom_info():
 def update_latest_version(self: MonitoredTask):
     """Update latest version info"""
     try:
-        response = get(
+        response = get_http_session().get(
             "https://api.github.com/repos/goauthentik/authentik/releases/latest"
         )
         response.raise_for_status()
@@ -34,6 +34,7 @@ from authentik.outposts.api.outpost_service_connections import (
     ServiceConnectionViewSet,
 )
 from authentik.outposts.api.outposts import OutpostViewSet
+from authentik.policies.api.access import BatchAccessView
 from authentik.policies.api.bindings import PolicyBindingViewSet
 from authentik.policies.api.policies import PolicyViewSet
 from authentik.policies.dummy.api import DummyPolicyViewSet
@@ -230,6 +231,11 @@ urlpatterns = (
         path("admin/workers/", WorkerView.as_view(), name="admin_workers"),
         path("admin/system/", SystemView.as_view(), name="admin_system"),
         path("root/config/", ConfigView.as_view(), name="config"),
+        path(
+            "policies/access/batch/",
+            BatchAccessView.as_view(),
+            name="policies_access_batch",
+        ),
         path(
             "flows/executor/<slug:flow_slug>/",
             FlowExecutorView.as_view(),
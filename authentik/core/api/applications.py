@@ -31,17 +31,30 @@ from authentik.api.decorators import permission_required
 from authentik.core.api.providers import ProviderSerializer
 from authentik.core.models import Application, User
 from authentik.events.models import EventAction
-from authentik.policies.api.exec import PolicyTestResultSerializer
-from authentik.policies.engine import PolicyEngine
+from authentik.lib.utils.cache import incr_version
+from authentik.policies.api.exec import (
+    PolicyExplainResultSerializer,
+    PolicyTestResultSerializer,
+)
+from authentik.policies.engine import BatchPolicyEngine, PolicyEngine
 from authentik.policies.types import PolicyResult
 from authentik.stages.user_login.stage import USER_LOGIN_AUTHENTICATED
 
 LOGGER = get_logger()
 
 
+USER_APP_CACHE_VERSION = "user_app_cache_version"
+
+
 def user_app_cache_key(user_pk: str) -> str:
-    """Cache key where application list for user is saved"""
-    return f"user_app_cache_{user_pk}"
+    """Cache key where application list for user is saved. The key contains a version,
+    which is incremented to invalidate the application list of all users."""
+    return f"user_app_cache_{cache.get(USER_APP_CACHE_VERSION, 0)}_{user_pk}"
+
+
+def invalidate_user_app_cache():
+    """Invalidate cached application lists of all users"""
+    incr_version(USER_APP_CACHE_VERSION)
 
 
 class ApplicationSerializer(ModelSerializer):
@@ -97,13 +110,10 @@ class ApplicationViewSet(ModelViewSet):
         return queryset
 
     def _get_allowed_applications(self, queryset: QuerySet) -> list[Application]:
-        applications = []
-        for application in queryset:
-            engine = PolicyEngine(application, self.request.user, self.request)
-            engine.build()
-            if engine.passing:
-                applications.append(application)
-        return applications
+        applications = list(queryset)
+        engine = BatchPolicyEngine(applications, self.request.user, self.request)
+        engine.build()
+        return [app for app in applications if engine.results[app.pbm_uuid].passing]
 
     @extend_schema(
         request=inline_serializer(
@@ -135,6 +145,38 @@ class ApplicationViewSet(ModelViewSet):
             response = PolicyTestResultSerializer(result)
         return Response(response.data)
 
+    @permission_required(None, ["authentik_policies.view_policy"])
+    @extend_schema(
+        request=inline_serializer(
+            "ExplainAccessRequest", fields={"for_user": IntegerField(required=False)}
+        ),
+        responses={
+            200: PolicyExplainResultSerializer(),
+            404: OpenApiResponse(description="for_user user not found"),
+        },
+    )
+    @action(detail=True, methods=["POST"])
+    # pylint: disable=unused-argument
+    def explain(self, request: Request, slug: str) -> Response:
+        """Check access to a single application by slug, and return the cost
+        of each binding"""
+        application = get_object_or_404(Application, slug=slug)
+        for_user = self.request.user
+        if self.request.user.is_superuser and "for_user" in request.data:
+            for_user = get_object_or_404(User, pk=request.data.get("for_user"))
+        engine = PolicyEngine(application, for_user, self.request)
+        engine.request.profile = True
+        engine.build()
+        result = engine.result
+        response = PolicyExplainResultSerializer(
+            {
+                "passing": result.passing,
+                "messages": result.messages,
+                "profile": engine.profile,
+            }
+        )
+        return Response(response.data)
+
     @extend_schema(
         parameters=[
             OpenApiParameter(
@@ -164,11 +206,12 @@ class ApplicationViewSet(ModelViewSet):
             allowed_applications = self._get_allowed_applications(queryset)
         if should_cache:
             LOGGER.debug("Caching allowed application list")
-            allowed_applications = cache.get(user_app_cache_key(self.request.user.pk))
+            key = user_app_cache_key(self.request.user.pk)
+            allowed_applications = cache.get(key)
             if not allowed_applications:
                 allowed_applications = self._get_allowed_applications(queryset)
                 cache.set(
-                    user_app_cache_key(self.request.user.pk),
+                    key,
                     allowed_applications,
                     timeout=86400,
                 )
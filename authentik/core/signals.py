@@ -2,7 +2,6 @@
 from typing import TYPE_CHECKING
 
 from django.contrib.auth.signals import user_logged_in, user_logged_out
-from django.core.cache import cache
 from django.core.signals import Signal
 from django.db.models import Model
 from django.db.models.signals import post_save
@@ -25,7 +24,7 @@ if TYPE_CHECKING:
 # pylint: disable=unused-argument
 def post_save_application(sender: type[Model], instance, created: bool, **_):
     """Clear user's application cache upon application creation"""
-    from authentik.core.api.applications import user_app_cache_key
+    from authentik.core.api.applications import invalidate_user_app_cache
     from authentik.core.models import Application
 
     GAUGE_MODELS.labels(
@@ -38,8 +37,7 @@ def post_save_application(sender: type[Model], instance, created: bool, **_):
     if not created:  # pragma: no cover
         return
     # Also delete user application cache
-    keys = cache.keys(user_app_cache_key("*"))
-    cache.delete_many(keys)
+    invalidate_user_app_cache()
 
 
 @receiver(user_logged_in)
@@ -47,6 +47,21 @@ class TestApplicationsAPI(APITestCase):
             force_str(response.content), {"messages": ["dummy"], "passing": False}
         )
 
+    def test_explain(self):
+        """Test explain operation"""
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse(
+                "authentik_api:application-explain",
+                kwargs={"slug": self.denied.slug},
+            )
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertFalse(body["passing"])
+        self.assertEqual(len(body["profile"]), 1)
+        self.assertEqual(body["profile"][0]["passing"], False)
+
     def test_list(self):
         """Test list operation without superuser_full_list"""
         self.client.force_login(self.user)
@@ -0,0 +1,312 @@
+"""Buffered event ingestion
+
+Events created on the request path, like logins, are passed to the event buffer, and
+written in batches by a background thread. Requests don't wait for GeoIP lookups,
+database writes and notification dispatch."""
+from atexit import register
+from os import getpid
+from pickle import dumps, loads  # nosec
+from queue import Empty, Full, Queue
+from socket import gethostname
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import TYPE_CHECKING
+
+from django.db import close_old_connections
+from django_redis import get_redis_connection
+from prometheus_client import Counter, Histogram
+from redis import Redis
+from redis.exceptions import ResponseError
+from structlog.stdlib import get_logger
+
+from authentik.lib.config import CONFIG
+
+if TYPE_CHECKING:
+    from authentik.events.models import Event
+
+LOGGER = get_logger()
+
+MODE_SYNC = "sync"
+MODE_MEMORY = "memory"
+MODE_REDIS = "redis"
+OVERFLOW_SYNC = "sync"
+OVERFLOW_DROP = "drop"
+
+STREAM_KEY = "authentik_events_buffer"
+STREAM_GROUP = "authentik"
+# Entries which can't be read or written are moved to this stream, so they don't block
+# the buffer. They can be inspected with XRANGE.
+STREAM_DEAD_KEY = "authentik_events_buffer_dead"
+# Entries which have been read, but not acknowledged for this long (in milliseconds),
+# are taken over from their consumer, which probably died
+STREAM_CLAIM_IDLE = 60_000
+# Entries which have been delivered this often without being written are moved to the
+# dead-letter stream
+STREAM_MAX_DELIVERIES = 5
+
+COUNTER_EVENTS_BUFFER = Counter(
+    "authentik_events_buffer",
+    "Events passed to the event buffer",
+    ["result"],
+)
+HIST_EVENTS_BUFFER_WRITE = Histogram(
+    "authentik_events_buffer_write",
+    "Duration of writing a batch of buffered events",
+)
+
+
+def write_events(events: list["Event"]):
+    """Apply GeoIP data to `events`, write them with a single query and check the
+    notification rules for all of them with a single task. Events which already exist,
+    because they've been written before they could be acknowledged, are skipped, so
+    their notifications aren't sent again."""
+    from authentik.events.models import Event
+    from authentik.events.tasks import event_notification_batch_handler
+
+    with HIST_EVENTS_BUFFER_WRITE.time():
+        existing = set(
+            Event.objects.filter(
+                event_uuid__in=[event.event_uuid for event in events]
+            ).values_list("event_uuid", flat=True)
+        )
+        events = [event for event in events if event.event_uuid not in existing]
+        for event in events:
+            event.with_geoip()
+            LOGGER.debug(
+                "Created Event",
+                action=event.action,
+                context=event.context,
+                client_ip=event.client_ip,
+                user=event.user,
+            )
+        Event.objects.bulk_create(events, ignore_conflicts=True)
+    if not events:
+        return
+    for event in events:
+        event._set_prom_metrics()
+    event_notification_batch_handler.delay([event.event_uuid.hex for event in events])
+
+
+class EventBuffer:
+    """Buffer of events which haven't been written yet, either in memory or in a redis
+    stream, depending on `events.buffer.mode`:
+
+    - sync: Events are written immediately, without buffering
+    - memory: Events are buffered in memory, and lost when the process is killed or
+      they can't be written
+    - redis: Events are buffered in a redis stream, and written by any process. Events
+      which couldn't be written are retried, and moved to a dead-letter stream after
+      `STREAM_MAX_DELIVERIES` attempts.
+
+    When the buffer is full, events are either written immediately or dropped,
+    depending on `events.buffer.overflow`."""
+
+    _queue: Queue
+    _size: int
+    _lock: Lock
+    _pid: int
+    _consumer: str
+    _group_created: bool
+    _last_claim: float
+
+    def __init__(self):
+        self._queue = Queue()
+        self._size = 0
+        self._lock = Lock()
+        self._pid = 0
+        self._consumer = ""
+        self._group_created = False
+        self._last_claim = 0
+
+    @property
+    def mode(self) -> str:
+        """Configured buffer mode"""
+        return CONFIG.y("events.buffer.mode", MODE_SYNC)
+
+    def _ensure_started(self):
+        """Start the flusher thread on first use. The buffer is process-local, so when
+        we've been forked (for example into a gunicorn worker) we start our own."""
+        if self._pid == getpid():
+            return
+        with self._lock:
+            if self._pid == getpid():
+                return
+            self._size = int(CONFIG.y("events.buffer.size", 10000))
+            self._queue = Queue(maxsize=self._size)
+            self._consumer = f"{gethostname()}-{getpid()}"
+            Thread(target=self._run, daemon=True).start()
+            register(self.flush)
+            self._pid = getpid()
+
+    def put(self, event: "Event"):
+        """Add `event` to the buffer"""
+        if self.mode == MODE_SYNC:
+            event.with_geoip()
+            event.save()
+            return
+        self._ensure_started()
+        if self._put(event):
+            COUNTER_EVENTS_BUFFER.labels(result="buffered").inc()
+            return
+        if CONFIG.y("events.buffer.overflow", OVERFLOW_SYNC) == OVERFLOW_DROP:
+            COUNTER_EVENTS_BUFFER.labels(result="dropped").inc()
+            LOGGER.warning("Event buffer is full, dropping event", action=event.action)
+            return
+        COUNTER_EVENTS_BUFFER.labels(result="overflow").inc()
+        event.with_geoip()
+        event.save()
+
+    def _put(self, event: "Event") -> bool:
+        if self.mode == MODE_REDIS:
+            client = get_redis_connection()
+            if client.xlen(STREAM_KEY) >= self._size:
+                return False
+            client.xadd(STREAM_KEY, {"event": dumps(event)})
+            return True
+        try:
+            self._queue.put_nowait(event)
+        except Full:
+            return False
+        return True
+
+    def _collect(self) -> list["Event"]:
+        """Wait for an event, and collect all further events within the flush interval,
+        up to the batch size"""
+        batch_size = int(CONFIG.y("events.buffer.batch_size", 500))
+        batch = [self._queue.get()]
+        deadline = monotonic() + float(CONFIG.y("events.buffer.flush_interval", 1))
+        while len(batch) < batch_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _dead_letter(self, client: Redis, entries: list[tuple[bytes, dict]]):
+        """Move `entries` from the buffer to the dead-letter stream"""
+        for _, fields in entries:
+            if fields:
+                client.xadd(
+                    STREAM_DEAD_KEY, fields, maxlen=self._size, approximate=True
+                )
+        ids = [entry_id for entry_id, _ in entries]
+        client.xack(STREAM_KEY, STREAM_GROUP, *ids)
+        client.xdel(STREAM_KEY, *ids)
+        COUNTER_EVENTS_BUFFER.labels(result="dead_lettered").inc(len(ids))
+        LOGGER.warning(
+            "Moved events to dead-letter stream", count=len(ids), stream=STREAM_DEAD_KEY
+        )
+
+    def _claim_stale(self, client: Redis, batch_size: int) -> list[tuple[bytes, dict]]:
+        """Take over entries which have been read, but not acknowledged for a while.
+        Entries which have been delivered too often are moved to the dead-letter
+        stream instead."""
+        stale = []
+        dead = []
+        for pending in client.xpending_range(
+            STREAM_KEY, STREAM_GROUP, "-", "+", batch_size
+        ):
+            if pending["time_since_delivered"] < STREAM_CLAIM_IDLE:
+                continue
+            if pending["times_delivered"] >= STREAM_MAX_DELIVERIES:
+                entry_id = pending["message_id"]
+                entry = client.xrange(STREAM_KEY, min=entry_id, max=entry_id, count=1)
+                dead.append(entry[0] if entry else (entry_id, None))
+            else:
+                stale.append(pending["message_id"])
+        if dead:
+            self._dead_letter(client, dead)
+        if not stale:
+            return []
+        return client.xclaim(
+            STREAM_KEY, STREAM_GROUP, self._consumer, STREAM_CLAIM_IDLE, stale
+        )
+
+    def _write_entries(self, client: Redis, entries: list[tuple[bytes, dict]]):
+        """Write and acknowledge `entries`. Entries which can't be unpickled are moved
+        to the dead-letter stream."""
+        events = []
+        ids = []
+        poison = []
+        for entry_id, fields in entries:
+            try:
+                events.append(loads(fields[b"event"]))  # nosec
+                ids.append(entry_id)
+            except Exception:  # pylint: disable=broad-except
+                poison.append((entry_id, fields))
+        if poison:
+            self._dead_letter(client, poison)
+        if not ids:
+            return
+        write_events(events)
+        client.xack(STREAM_KEY, STREAM_GROUP, *ids)
+        client.xdel(STREAM_KEY, *ids)
+
+    def _flush_redis(self):
+        """Read a batch of events from the stream, write and acknowledge them"""
+        client = get_redis_connection()
+        if not self._group_created:
+            try:
+                client.xgroup_create(STREAM_KEY, STREAM_GROUP, id="0", mkstream=True)
+            except ResponseError:
+                # Group already exists
+                pass
+            self._group_created = True
+        batch_size = int(CONFIG.y("events.buffer.batch_size", 500))
+        if monotonic() - self._last_claim >= STREAM_CLAIM_IDLE / 1000:
+            self._last_claim = monotonic()
+            # Entries which have been delivered before are written one by one, so a
+            # single entry which can't be written doesn't hold back the others
+            for entry in self._claim_stale(client, batch_size):
+                if entry[1] is None:
+                    # Entry has been deleted in the meantime
+                    client.xack(STREAM_KEY, STREAM_GROUP, entry[0])
+                    continue
+                try:
+                    self._write_entries(client, [entry])
+                except Exception as exc:  # pylint: disable=broad-except
+                    LOGGER.warning("Failed to write buffered event", exc=exc)
+        entries = []
+        streams = client.xreadgroup(
+            STREAM_GROUP,
+            self._consumer,
+            {STREAM_KEY: ">"},
+            count=batch_size,
+            block=int(float(CONFIG.y("events.buffer.flush_interval", 1)) * 1000),
+        )
+        for _, stream_entries in streams:
+            entries.extend(stream_entries)
+        if entries:
+            self._write_entries(client, entries)
+
+    def _run(self):  # pragma: no cover
+        """Main loop of the flusher thread"""
+        while True:
+            try:
+                if self.mode == MODE_REDIS:
+                    close_old_connections()
+                    self._flush_redis()
+                    continue
+                batch = self._collect()
+                close_old_connections()
+                write_events(batch)
+            except Exception as exc:  # pylint: disable=broad-except
+                LOGGER.warning("Failed to write buffered events", exc=exc)
+                sleep(1)
+
+    def flush(self):
+        """Write all events buffered in memory, called when the process exits"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        if batch:
+            write_events(batch)
+
+
+EVENT_BUFFER = EventBuffer()
@@ -1,18 +1,36 @@
 """events GeoIP Reader"""
-from datetime import datetime
+from collections import OrderedDict
 from os import stat
-from time import time
+from threading import Lock
+from time import monotonic
 from typing import Optional, TypedDict
 
 from geoip2.database import Reader
 from geoip2.errors import GeoIP2Error
 from geoip2.models import City
+from maxminddb import MODE_MMAP, MODE_MMAP_EXT
+from prometheus_client import Counter, Histogram
 from structlog.stdlib import get_logger
 
 from authentik.lib.config import CONFIG
 
 LOGGER = get_logger()
 
+# How often the database file is checked for changes, in seconds
+CHECK_INTERVAL = 60
+# How many lookups are kept in memory
+CACHE_SIZE = 10_000
+
+HIST_GEOIP_LOOKUP = Histogram(
+    "authentik_events_geoip_lookup",
+    "Duration of GeoIP database lookups, excluding cached lookups",
+)
+COUNTER_GEOIP_CACHE = Counter(
+    "authentik_events_geoip_cache",
+    "GeoIP lookups, by whether they were cached",
+    ["result"],
+)
+
 
 class GeoIPDict(TypedDict):
     """GeoIP Details"""
@@ -25,51 +43,94 @@ class GeoIPDict(TypedDict):
 
 
 class GeoIPReader:
-    """Slim wrapper around GeoIP API"""
+    """Slim wrapper around GeoIP API, shared by all threads of a process.
 
-    __reader: Optional[Reader] = None
-    __last_mtime: float = 0.0
+    The database is memory-mapped, and re-opened when its file has been modified, which
+    is checked at most every `CHECK_INTERVAL` seconds. The results of the last
+    `CACHE_SIZE` lookups are kept in memory."""
 
-    def __init__(self):
-        self.__open()
+    _reader: Optional[Reader]
+    _last_mtime: float
+    _last_check: float
+    _cache: OrderedDict[str, Optional[City]]
+    _lock: Lock
 
-    def __open(self):
+    def __init__(self):
+        self._reader = None
+        self._last_mtime = 0.0
+        self._last_check = 0.0
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        self._open()
+
+    def _open(self):
         """Get GeoIP Reader, if configured, otherwise none"""
         path = CONFIG.y("authentik.geoip")
         if path == "" or not path:
             return
         try:
-            reader = Reader(path)
-            LOGGER.info("Loaded GeoIP database")
-            self.__reader = reader
-            self.__last_mtime = stat(path).st_mtime
+            mtime = stat(path).st_mtime
+            try:
+                reader = Reader(path, mode=MODE_MMAP_EXT)
+            except ValueError:
+                # C extension isn't available
+                reader = Reader(path, mode=MODE_MMAP)
         except OSError as exc:
             LOGGER.warning("Failed to load GeoIP database", exc=exc)
-
-    def __check_expired(self):
-        """Check if the geoip database has been opened longer than 8 hours,
-        and re-open it, as it will probably will have been re-downloaded"""
-        now = time()
-        diff = datetime.fromtimestamp(now) - datetime.fromtimestamp(self.__last_mtime)
-        diff_hours = diff.total_seconds() // 3600
-        if diff_hours >= 8:
-            LOGGER.info("GeoIP databased loaded too long, re-opening", diff=diff)
-            self.__open()
+            return
+        LOGGER.info("Loaded GeoIP database")
+        # The previous reader isn't closed, as other threads might still be using it.
+        # It's closed when it's garbage collected.
+        with self._lock:
+            self._reader = reader
+            self._last_mtime = mtime
+            self._cache.clear()
+
+    def _check_expired(self):
+        """Re-open the geoip database when its file has been modified, for example
+        because it has been re-downloaded"""
+        now = monotonic()
+        if now - self._last_check < CHECK_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            mtime = stat(CONFIG.y("authentik.geoip")).st_mtime
+        except OSError:
+            # Keep using the database we've already loaded
+            return
+        if mtime != self._last_mtime:
+            LOGGER.info("GeoIP database has been modified, re-opening")
+            self._open()
 
     @property
     def enabled(self) -> bool:
         """Check if GeoIP is enabled"""
-        return bool(self.__reader)
+        return bool(self._reader)
 
     def city(self, ip_address: str) -> Optional[City]:
         """Wrapper for Reader.city"""
         if not self.enabled:
             return None
-        self.__check_expired()
-        try:
-            return self.__reader.city(ip_address)
-        except (GeoIP2Error, ValueError):
-            return None
+        self._check_expired()
+        with self._lock:
+            if ip_address in self._cache:
+                self._cache.move_to_end(ip_address)
+                COUNTER_GEOIP_CACHE.labels(result="hit").inc()
+                return self._cache[ip_address]
+            reader = self._reader
+        COUNTER_GEOIP_CACHE.labels(result="miss").inc()
+        with HIST_GEOIP_LOOKUP.time():
+            try:
+                city = reader.city(ip_address)
+            except (GeoIP2Error, ValueError):
+                city = None
+        with self._lock:
+            # Don't cache results of a reader which has been replaced in the meantime
+            if reader is self._reader:
+                self._cache[ip_address] = city
+                if len(self._cache) > CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return city
 
     def city_dict(self, ip_address: str) -> Optional[GeoIPDict]:
         """Wrapper for self.city that returns a dict"""
@@ -0,0 +1,97 @@
+"""authentik event construction benchmark command"""
+from inspect import getmodule, stack
+from timeit import repeat
+from typing import Any, Callable
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand
+from django.db.models import Model
+
+from authentik.core.models import Group, User
+from authentik.events.models import Event, EventAction
+from authentik.events.utils import cleanse_dict, model_to_dict, sanitize_dict
+
+
+def legacy_model_to_dict(model: Model) -> dict[str, Any]:
+    """model_to_dict before the serializers were built per model class"""
+    name = str(model)
+    if hasattr(model, "name"):
+        name = model.name
+    return {
+        "app": model._meta.app_label,
+        "model_name": model._meta.model_name,
+        "pk": model.pk,
+        "name": name,
+    }
+
+
+def legacy_new(action: str, **kwargs) -> Event:
+    """Event.new before the caller was resolved with sys._getframe, and the context was
+    sanitized and cleansed in a single pass. Must be called while
+    `legacy_model_to_dict` is patched in."""
+    app = getmodule(stack()[1][0]).__name__
+    context = cleanse_dict(sanitize_dict(kwargs))
+    return Event(action=EventAction.CUSTOM_PREFIX + action, app=app, context=context)
+
+
+def at_depth(depth: int, func: Callable[[], Any]) -> Callable[[], Any]:
+    """Call `func` from `depth` nested frames, as events are usually created deep
+    within a request"""
+
+    def nested(remaining: int):
+        if remaining <= 0:
+            return func()
+        return nested(remaining - 1)
+
+    return lambda: nested(depth)
+
+
+class Command(BaseCommand):  # pragma: no cover
+    """Benchmark the per-event overhead of creating events and serializing models, with
+    the previous and the current implementation. No database is required."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--number",
+            default=1000,
+            type=int,
+            help="How many events are created per measurement.",
+        )
+        parser.add_argument(
+            "--depth",
+            default=40,
+            type=int,
+            help="Depth of the stack events are created in.",
+        )
+
+    def measure(self, name: str, func: Callable[[], Any], number: int):
+        """Print the best per-call duration of `func` in microseconds"""
+        best = min(repeat(func, number=number, repeat=5))
+        self.stdout.write(f"{name:<24}{best / number * 1_000_000:>10.1f}us")
+
+    def handle(self, *args, **options):
+        number = options["number"]
+        user = User(username="benchmark", email="benchmark@goauthentik.io")
+        group = Group(name="benchmark")
+        kwargs = {
+            "model": group,
+            "user": user,
+            "password": "benchmark",
+            "nested": {"token": "benchmark", "group": group},
+        }
+        with patch("authentik.events.utils.model_to_dict", legacy_model_to_dict):
+            self.measure(
+                "Event.new (before)",
+                at_depth(options["depth"], lambda: legacy_new("benchmark", **kwargs)),
+                number,
+            )
+        self.measure(
+            "Event.new (after)",
+            at_depth(options["depth"], lambda: Event.new("benchmark", **kwargs)),
+            number,
+        )
+        self.measure(
+            "model_to_dict (before)", lambda: legacy_model_to_dict(group), number
+        )
+        self.measure("model_to_dict (after)", lambda: model_to_dict(group), number)
@@ -0,0 +1,174 @@
+"""Process-local index of notification rules"""
+from threading import Lock
+from typing import Iterator, Optional
+from uuid import UUID
+
+from celery.exceptions import SoftTimeLimitExceeded
+from django.core.cache import cache
+from prometheus_client import Counter
+from structlog.stdlib import get_logger
+
+from authentik.events.models import Event, NotificationRule
+from authentik.lib.utils.cache import incr_version
+from authentik.policies.event_matcher.models import EventMatcherPolicy
+from authentik.policies.index import BINDING_INDEX
+from authentik.policies.index import CACHE_KEY_VERSION as BINDING_INDEX_VERSION
+from authentik.policies.models import PolicyBinding
+from authentik.policies.process import PolicyProcess
+from authentik.policies.types import PolicyRequest
+
+LOGGER = get_logger()
+CACHE_KEY_VERSION = "rule_matcher_version"
+COUNTER_RULE_MATCHER = Counter(
+    "authentik_events_rule_matcher",
+    "Notification rules checked against events",
+    ["result"],
+)
+
+EVENT_MATCHER_FIELDS = ("action", "app", "client_ip")
+
+
+def _indexable(binding: PolicyBinding) -> bool:
+    """Check if the result of `binding` only depends on the fields of the event, in
+    which case it can only pass for events matching one of these fields"""
+    return (
+        isinstance(binding.policy, EventMatcherPolicy)
+        and not binding.negate
+        and not binding.policy.execution_logging
+    )
+
+
+class CompiledRules:
+    """Notification rules indexed by the fields of their EventMatcherPolicy bindings.
+
+    An EventMatcherPolicy passes when any of its fields equals the event's field, so
+    only rules which have a matcher with one of the event's values are candidates.
+    Rules with any other binding are candidates for all events."""
+
+    rules: dict[UUID, NotificationRule]
+    bindings: dict[UUID, list[PolicyBinding]]
+    index: dict[str, dict[str, set[UUID]]]
+    generic: set[UUID]
+    bound_policies: set[str]
+
+    def __init__(self):
+        self.rules = {}
+        self.bindings = {}
+        self.index = {field: {} for field in EVENT_MATCHER_FIELDS}
+        self.generic = set()
+        self.bound_policies = set()
+
+    @staticmethod
+    def compile() -> "CompiledRules":
+        """Load all rules and their bindings"""
+        compiled = CompiledRules()
+        rules = list(NotificationRule.objects.select_related("group"))
+        # Includes disabled bindings, see `causes_loop`
+        compiled.bound_policies = {
+            policy.hex
+            for policy in PolicyBinding.objects.filter(
+                target__in=[rule.pbm_uuid for rule in rules], policy__isnull=False
+            ).values_list("policy", flat=True)
+        }
+        # Rules without a group never create notifications
+        rules = [rule for rule in rules if rule.group]
+        bindings = BINDING_INDEX.get_many(rules)
+        for rule in rules:
+            compiled.rules[rule.pbm_uuid] = rule
+            compiled.bindings[rule.pbm_uuid] = bindings[rule.pbm_uuid]
+            for binding in bindings[rule.pbm_uuid]:
+                if not _indexable(binding):
+                    compiled.generic.add(rule.pbm_uuid)
+                    continue
+                for field in EVENT_MATCHER_FIELDS:
+                    compiled.index[field].setdefault(
+                        getattr(binding.policy, field), set()
+                    ).add(rule.pbm_uuid)
+        return compiled
+
+    def causes_loop(self, event: Event) -> bool:
+        """Check if `event` has been created by a policy attached to *any* rule. Checking
+        it against the rules might create the same event again, causing an infinite
+        loop."""
+        return event.context.get("policy_uuid") in self.bound_policies
+
+    def candidates(self, event: Event) -> Iterator[NotificationRule]:
+        """Rules which might match `event`, in no particular order"""
+        candidates = set(self.generic)
+        for field in EVENT_MATCHER_FIELDS:
+            candidates.update(self.index[field].get(getattr(event, field), ()))
+        COUNTER_RULE_MATCHER.labels(result="skipped").inc(
+            len(self.rules) - len(candidates)
+        )
+        COUNTER_RULE_MATCHER.labels(result="checked").inc(len(candidates))
+        for pbm_uuid in candidates:
+            yield self.rules[pbm_uuid]
+
+    def passes(self, rule: NotificationRule, request: PolicyRequest) -> bool:
+        """Evaluate the bindings of `rule` in-process, passing when any binding passes.
+        Matchers which can't pass for the event are skipped, and bindings which raise an
+        exception don't pass.
+
+        The bindings' timeouts are not enforced, as celery workers are daemonic and
+        can't fork; a hanging policy is only stopped by the task's time limit."""
+        event: Event = request.context["event"]
+        for binding in self.bindings[rule.pbm_uuid]:
+            if _indexable(binding) and not any(
+                getattr(binding.policy, field) == getattr(event, field)
+                for field in EVENT_MATCHER_FIELDS
+            ):
+                continue
+            try:
+                if PolicyProcess(binding, request, None).execute().passing:
+                    return True
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception as exc:  # pylint: disable=broad-except
+                LOGGER.warning(
+                    "Failed to evaluate notification rule binding",
+                    rule=rule,
+                    binding=binding,
+                    exc=exc,
+                )
+        return False
+
+
+class RuleMatcher:
+    """Compiled notification rules, so the rules matching an event can be found without
+    a task or policy engine per rule.
+
+    Each process keeps its own copy, which is discarded when the version in the cache
+    has changed. The version is incremented whenever a NotificationRule is saved or
+    deleted, and the copy is also discarded when the binding index is invalidated."""
+
+    _compiled: Optional[CompiledRules]
+    _version: Optional[tuple[int, int]]
+    _lock: Lock
+
+    def __init__(self):
+        self._compiled = None
+        self._version = None
+        self._lock = Lock()
+
+    def get(self) -> CompiledRules:
+        """Get the compiled rules, compiling them when they've changed"""
+        versions = cache.get_many([CACHE_KEY_VERSION, BINDING_INDEX_VERSION])
+        version = (
+            versions.get(CACHE_KEY_VERSION, 0),
+            versions.get(BINDING_INDEX_VERSION, 0),
+        )
+        with self._lock:
+            if version == self._version and self._compiled:
+                return self._compiled
+        compiled = CompiledRules.compile()
+        with self._lock:
+            self._compiled = compiled
+            self._version = version
+        return compiled
+
+    def invalidate(self):
+        """Increment the version, invalidating the compiled rules of all processes"""
+        incr_version(CACHE_KEY_VERSION)
+
+
+RULE_MATCHER = RuleMatcher()
@@ -1,8 +1,8 @@
 """authentik events models"""
 from datetime import timedelta
-from inspect import getmodule, stack
 from smtplib import SMTPException
-from typing import Optional, Union
+from sys import _getframe
+from typing import Iterator, Optional, Union
 from uuid import uuid4
 
 from django.conf import settings
@@ -10,8 +10,7 @@ from django.db import models
 from django.http import HttpRequest
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
-from prometheus_client import Gauge
-from requests import RequestException, post
+from requests import RequestException
 from structlog.stdlib import get_logger
 
 from authentik import __version__
@@ -20,18 +19,20 @@ from authentik.core.middleware import (
     SESSION_IMPERSONATE_USER,
 )
 from authentik.core.models import ExpiringModel, Group, User
+from authentik.events.buffer import EVENT_BUFFER
 from authentik.events.geo import GEOIP_READER
-from authentik.events.utils import cleanse_dict, get_user, sanitize_dict
+from authentik.events.utils import get_user, sanitize_cleanse_dict
+from authentik.lib.instrumentation import LABEL_ACTION, LABEL_APP, gauge
 from authentik.lib.sentry import SentryIgnoredException
-from authentik.lib.utils.http import get_client_ip
+from authentik.lib.utils.http import get_client_ip, get_http_session
 from authentik.policies.models import PolicyBindingModel
 from authentik.stages.email.utils import TemplateEmailMessage
 
 LOGGER = get_logger("authentik.events")
-GAUGE_EVENTS = Gauge(
+GAUGE_EVENTS = gauge(
     "authentik_events",
     "Events in authentik",
-    ["action", "user_username", "app", "client_ip"],
+    (LABEL_ACTION, LABEL_APP),
 )
 
 
@@ -92,7 +93,8 @@ class Event(ExpiringModel):
     app = models.TextField()
     context = models.JSONField(default=dict, blank=True)
     client_ip = models.GenericIPAddressField(null=True)
-    created = models.DateTimeField(auto_now_add=True)
+    # Set when the event is created, not when it's written, as it might be buffered
+    created = models.DateTimeField(default=now, editable=False)
 
     # Shadow the expires attribute from ExpiringModel to override the default duration
     expires = models.DateTimeField(default=default_event_duration)
@@ -114,8 +116,9 @@ class Event(ExpiringModel):
         if not isinstance(action, EventAction):
             action = EventAction.CUSTOM_PREFIX + action
         if not app:
-            app = getmodule(stack()[_inspect_offset][0]).__name__
-        cleaned_kwargs = cleanse_dict(sanitize_dict(kwargs))
+            # Module of the caller, without inspecting the whole stack
+            app = _getframe(_inspect_offset).f_globals.get("__name__", "")
+        cleaned_kwargs = sanitize_cleanse_dict(kwargs)
         event = Event(action=action, app=app, context=cleaned_kwargs)
         return event
 
@@ -126,11 +129,16 @@ class Event(ExpiringModel):
         return self
 
     def from_http(
-        self, request: HttpRequest, user: Optional[settings.AUTH_USER_MODEL] = None
+        self,
+        request: HttpRequest,
+        user: Optional[settings.AUTH_USER_MODEL] = None,
+        buffered: bool = False,
     ) -> "Event":
         """Add data from a Django-HttpRequest, allowing the creation of
         Events independently from requests.
-        `user` arguments optionally overrides user from requests."""
+        `user` arguments optionally overrides user from requests.
+        When `buffered` is set, the event is passed to the event buffer and written
+        in the background, otherwise it's saved immediately."""
         if hasattr(request, "user"):
             original_user = None
             if hasattr(request, "session"):
@@ -149,11 +157,14 @@ class Event(ExpiringModel):
                 )
         # User 255.255.255.255 as fallback if IP cannot be determined
         self.client_ip = get_client_ip(request)
-        # Apply GeoIP Data, when enabled
-        self.with_geoip()
         # If there's no app set, we get it from the requests too
         if not self.app:
             self.app = Event._get_app_from_request(request)
+        if buffered:
+            EVENT_BUFFER.put(self)
+            return self
+        # Apply GeoIP Data, when enabled
+        self.with_geoip()
         self.save()
         return self
 
@@ -165,12 +176,9 @@ class Event(ExpiringModel):
         self.context["geo"] = city
 
     def _set_prom_metrics(self):
-        GAUGE_EVENTS.labels(
-            action=self.action,
-            user_username=self.user.get("username"),
-            app=self.app,
-            client_ip=self.client_ip,
-        ).set(self.created.timestamp())
+        GAUGE_EVENTS.labels(action=self.action, app=self.app).set(
+            self.created.timestamp()
+        )
 
     def save(self, *args, **kwargs):
         if self._state.adding:
@@ -237,7 +245,7 @@ class NotificationTransport(models.Model):
     def send_webhook(self, notification: "Notification") -> list[str]:
         """Send notification to generic webhook"""
         try:
-            response = post(
+            response = get_http_session().post(
                 self.webhook_url,
                 json={
                     "body": notification.body,
@@ -248,7 +256,8 @@ class NotificationTransport(models.Model):
             )
             response.raise_for_status()
         except RequestException as exc:
-            raise NotificationTransportError(exc.response.text) from exc
+            text = exc.response.text if exc.response is not None else str(exc)
+            raise NotificationTransportError(text) from exc
         return [
             response.status_code,
             response.text,
@@ -294,17 +303,17 @@ class NotificationTransport(models.Model):
         if notification.event:
             body["attachments"][0]["title"] = notification.event.action
         try:
-            response = post(self.webhook_url, json=body)
+            response = get_http_session().post(self.webhook_url, json=body)
             response.raise_for_status()
         except RequestException as exc:
-            raise NotificationTransportError(exc.response.text) from exc
+            text = exc.response.text if exc.response is not None else str(exc)
+            raise NotificationTransportError(text) from exc
         return [
             response.status_code,
             response.text,
         ]
 
-    def send_email(self, notification: "Notification") -> list[str]:
-        """Send notification via global email configuration"""
+    def _email_message(self, notification: "Notification") -> TemplateEmailMessage:
         subject = "authentik Notification: "
         key_value = {}
         if notification.event:
@@ -315,7 +324,7 @@ class NotificationTransport(models.Model):
                 key_value[key] = value
         else:
             subject += notification.body[:75]
-        mail = TemplateEmailMessage(
+        return TemplateEmailMessage(
             subject=subject,
             template_name="email/generic.html",
             to=[notification.user.email],
@@ -325,14 +334,37 @@ class NotificationTransport(models.Model):
                 "key_value": key_value,
             },
         )
+
+    def send_email(self, notification: "Notification") -> list[str]:
+        """Send notification via global email configuration"""
+        for _ in self.send_emails([notification]):
+            pass
+        return []
+
+    def send_emails(
+        self, notifications: list["Notification"]
+    ) -> Iterator["Notification"]:
+        """Send notifications via global email configuration, over a single connection.
+        Each notification is yielded once its email has been sent, so callers know which
+        have been delivered when sending fails."""
+        from authentik.stages.email.models import EmailStage
+
+        try:
+            backend = EmailStage(use_global_settings=True).backend
+        except ValueError as exc:
+            # Invalid global email settings
+            raise NotificationTransportError from exc
         # Email is sent directly here, as the call to send() should have been from a task.
         try:
-            from authentik.stages.email.tasks import send_mail
-
-            # pyright: reportGeneralTypeIssues=false
-            return send_mail(mail.__dict__)  # pylint: disable=no-value-for-parameter
-        except (SMTPException, ConnectionError, OSError) as exc:
+            # As the connection is already open, send_messages doesn't close it
+            backend.open()
+            for notification in notifications:
+                backend.send_messages([self._email_message(notification)])
+                yield notification
+        except (SMTPException, ConnectionError, OSError, ValueError) as exc:
             raise NotificationTransportError from exc
+        finally:
+            backend.close()
 
     def __str__(self) -> str:
         return f"Notification Transport {self.name}"
@@ -11,12 +11,14 @@ from django.core.cache import cache
 from prometheus_client import Gauge
 
 from authentik.events.models import Event, EventAction
+from authentik.lib.utils.cache import KeyIndex
 
 GAUGE_TASKS = Gauge(
     "authentik_system_tasks",
     "System tasks and their status",
     ["task_name", "task_uid", "status"],
 )
+TASK_INDEX = KeyIndex("tasks")
 
 
 class TaskResultStatus(Enum):
@@ -72,7 +74,7 @@ class TaskInfo:
     @staticmethod
     def all() -> dict[str, "TaskInfo"]:
         """Get all TaskInfo objects"""
-        return cache.get_many(cache.keys("task_*"))
+        return TASK_INDEX.get_many()
 
     @staticmethod
     def by_name(name: str) -> Optional["TaskInfo"]:
@@ -81,6 +83,7 @@ class TaskInfo:
 
     def delete(self):
         """Delete task info from cache"""
+        TASK_INDEX.remove(f"task_{self.task_name}")
         return cache.delete(f"task_{self.task_name}")
 
     def set_prom_metrics(self):
@@ -106,6 +109,7 @@ class TaskInfo:
             self.task_name += f"_{self.result.uid}"
         self.set_prom_metrics()
         cache.set(key, self, timeout=timeout_hours * 60 * 60)
+        TASK_INDEX.add(key)
 
 
 class MonitoredTask(Task):
@@ -7,13 +7,15 @@ from django.contrib.auth.signals import (
     user_logged_out,
     user_login_failed,
 )
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.http import HttpRequest
 
 from authentik.core.models import User
 from authentik.core.signals import password_changed
-from authentik.events.models import Event, EventAction
+from authentik.events.matcher import RULE_MATCHER
+from authentik.events.models import Event, EventAction, NotificationRule
 from authentik.events.tasks import event_notification_handler
 from authentik.flows.planner import PLAN_CONTEXT_SOURCE, FlowPlan
 from authentik.flows.views import SESSION_KEY_PLAN
@@ -23,7 +25,8 @@ from authentik.stages.user_write.signals import user_write
 
 
 class EventNewThread(Thread):
-    """Create Event in background thread"""
+    """Create Event from a request, which is written in the background by the
+    event buffer"""
 
     action: str
     request: HttpRequest
@@ -40,7 +43,9 @@ class EventNewThread(Thread):
         self.kwargs = kwargs
 
     def run(self):
-        Event.new(self.action, **self.kwargs).from_http(self.request, user=self.user)
+        Event.new(self.action, **self.kwargs).from_http(
+            self.request, user=self.user, buffered=True
+        )
 
 
 @receiver(user_logged_in)
@@ -111,3 +116,12 @@ def on_password_changed(sender, user: User, password: str, **_):
 def event_post_save_notification(sender, instance: Event, **_):
     """Start task to check if any policies trigger an notification on this event"""
     event_notification_handler.delay(instance.event_uuid.hex)
+
+
+@receiver(post_save, sender=NotificationRule)
+@receiver(post_delete, sender=NotificationRule)
+# pylint: disable=unused-argument
+def invalidate_rule_matcher(sender, instance: NotificationRule, **_):
+    """Invalidate the compiled notification rules of all processes"""
+    RULE_MATCHER.invalidate()
+    transaction.on_commit(RULE_MATCHER.invalidate)
@@ -1,18 +1,20 @@
 """Event notification tasks"""
+from celery.utils.time import get_exponential_backoff_interval
 from guardian.shortcuts import get_anonymous_user
 from structlog.stdlib import get_logger
 
 from authentik.core.models import User
+from authentik.events.matcher import RULE_MATCHER
 from authentik.events.models import (
     Event,
     Notification,
     NotificationRule,
     NotificationTransport,
     NotificationTransportError,
+    TransportMode,
 )
 from authentik.events.monitored_tasks import MonitoredTask, TaskResult, TaskResultStatus
-from authentik.policies.engine import PolicyEngine
-from authentik.policies.models import PolicyBinding, PolicyEngineMode
+from authentik.policies.types import PolicyRequest
 from authentik.root.celery import CELERY_APP
 
 LOGGER = get_logger()
@@ -20,97 +22,117 @@ LOGGER = get_logger()
 
 @CELERY_APP.task()
 def event_notification_handler(event_uuid: str):
-    """Start task for each trigger definition"""
-    for trigger in NotificationRule.objects.all():
-        event_trigger_handler.apply_async(
-            args=[event_uuid, trigger.name], queue="authentik_events"
-        )
+    """Check if any notification rules match event"""
+    event_notification_batch_handler([event_uuid])
 
 
 @CELERY_APP.task()
-def event_trigger_handler(event_uuid: str, trigger_name: str):
-    """Check if policies attached to NotificationRule match event"""
-    events = Event.objects.filter(event_uuid=event_uuid)
-    if not events.exists():
-        LOGGER.warning("event doesn't exist yet or anymore", event_uuid=event_uuid)
-        return
-    event: Event = events.first()
-    triggers: NotificationRule = NotificationRule.objects.filter(name=trigger_name)
-    if not triggers.exists():
+def event_notification_batch_handler(event_uuids: list[str]):
+    """Check if any notification rules match a batch of events. Only rules which might
+    match an event are evaluated, in this task."""
+    compiled = RULE_MATCHER.get()
+    if not compiled.rules:
         return
-    trigger = triggers.first()
-
-    if "policy_uuid" in event.context:
-        policy_uuid = event.context["policy_uuid"]
-        if PolicyBinding.objects.filter(
-            target__in=NotificationRule.objects.all().values_list(
-                "pbm_uuid", flat=True
-            ),
-            policy=policy_uuid,
-        ).exists():
+    events = list(Event.objects.filter(event_uuid__in=event_uuids))
+    if len(events) < len(event_uuids):
+        LOGGER.warning(
+            "event doesn't exist yet or anymore",
+            event_uuids=set(event_uuids) - {event.event_uuid.hex for event in events},
+        )
+    users = User.objects.in_bulk(
+        {event.user.get("pk") for event in events if event.user.get("pk")}
+    )
+    for event in events:
+        if compiled.causes_loop(event):
             # If policy that caused this event to be created is attached
             # to *any* NotificationRule, we return early.
             # This is the most effective way to prevent infinite loops.
-            LOGGER.debug(
-                "e(trigger): attempting to prevent infinite loop", trigger=trigger
-            )
-            return
+            LOGGER.debug("e(trigger): attempting to prevent infinite loop", event=event)
+            continue
+        user = users.get(event.user.get("pk")) or get_anonymous_user()
+        for trigger in compiled.candidates(event):
+            LOGGER.debug("e(trigger): checking if trigger applies", trigger=trigger)
+            request = PolicyRequest(user)
+            request.obj = trigger
+            request.context["event"] = event
+            if not compiled.passes(trigger, request):
+                continue
+            LOGGER.debug("e(trigger): event trigger matched", trigger=trigger)
+            notify(trigger, event)
 
-    if not trigger.group:
-        LOGGER.debug("e(trigger): trigger has no group", trigger=trigger)
-        return
 
-    LOGGER.debug("e(trigger): checking if trigger applies", trigger=trigger)
-    try:
-        user = (
-            User.objects.filter(pk=event.user.get("pk")).first() or get_anonymous_user()
-        )
-    except User.DoesNotExist:
-        LOGGER.warning("e(trigger): failed to get user", trigger=trigger)
-        return
-    policy_engine = PolicyEngine(trigger, user)
-    policy_engine.mode = PolicyEngineMode.MODE_ANY
-    policy_engine.empty_result = False
-    policy_engine.use_cache = False
-    policy_engine.request.context["event"] = event
-    policy_engine.build()
-    result = policy_engine.result
-    if not result.passing:
+def notify(trigger: NotificationRule, event: Event):
+    """Create notifications for `event` for all members of `trigger`'s group with a
+    single query, and send them with one task per transport"""
+    transports = list(trigger.transports.all())
+    users = list(trigger.group.users.all())
+    if not transports or not users:
         return
-
-    LOGGER.debug("e(trigger): event trigger matched", trigger=trigger)
-    # Create the notification objects
-    for transport in trigger.transports.all():
-        for user in trigger.group.users.all():
-            LOGGER.debug("created notification")
-            notification = Notification.objects.create(
-                severity=trigger.severity, body=event.summary, event=event, user=user
-            )
-            notification_transport.apply_async(
-                args=[notification.pk, transport.pk], queue="authentik_events"
+    batches: list[tuple[NotificationTransport, list[Notification]]] = []
+    for transport in transports:
+        recipients = users[:1] if transport.send_once else users
+        batches.append(
+            (
+                transport,
+                [
+                    Notification(
+                        severity=trigger.severity,
+                        body=event.summary,
+                        event=event,
+                        user=user,
+                    )
+                    for user in recipients
+                ],
             )
-            if transport.send_once:
-                break
+        )
+    Notification.objects.bulk_create(
+        [notification for _, notifications in batches for notification in notifications]
+    )
+    LOGGER.debug("created notifications", trigger=trigger, batches=len(batches))
+    for transport, notifications in batches:
+        notification_transport.apply_async(
+            args=[[notification.pk for notification in notifications], transport.pk],
+            queue="authentik_events",
+        )
 
 
-@CELERY_APP.task(
-    bind=True,
-    autoretry_for=(NotificationTransportError,),
-    retry_backoff=True,
-    base=MonitoredTask,
-)
+@CELERY_APP.task(bind=True, base=MonitoredTask)
 def notification_transport(
-    self: MonitoredTask, notification_pk: int, transport_pk: int
+    self: MonitoredTask, notification_pks: list[str], transport_pk: str
 ):
-    """Send notification over specified transport"""
+    """Send notifications over specified transport. Emails are sent over a single
+    connection, webhooks one after another. When sending fails, only the notifications
+    which haven't been sent yet are retried."""
     self.save_on_success = False
-    try:
-        notification: Notification = Notification.objects.get(pk=notification_pk)
-        transport: NotificationTransport = NotificationTransport.objects.get(
-            pk=transport_pk
+    transport: NotificationTransport = NotificationTransport.objects.filter(
+        pk=transport_pk
+    ).first()
+    if not transport:
+        return
+    notifications: list[Notification] = list(
+        Notification.objects.filter(pk__in=notification_pks).select_related(
+            "user", "event"
         )
-        transport.send(notification)
+    )
+    sent = 0
+    try:
+        if transport.mode == TransportMode.EMAIL:
+            for _ in transport.send_emails(notifications):
+                sent += 1
+        else:
+            for notification in notifications:
+                transport.send(notification)
+                sent += 1
         self.set_status(TaskResult(TaskResultStatus.SUCCESSFUL))
     except NotificationTransportError as exc:
         self.set_status(TaskResult(TaskResultStatus.ERROR).with_error(exc))
-        raise exc
+        raise self.retry(
+            args=[
+                [notification.pk for notification in notifications[sent:]],
+                transport_pk,
+            ],
+            exc=exc,
+            countdown=get_exponential_backoff_interval(
+                factor=1, retries=self.request.retries, maximum=600, full_jitter=True
+            ),
+        ) from exc
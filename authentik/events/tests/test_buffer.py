@@ -0,0 +1,143 @@
+"""event buffer tests"""
+from queue import Queue
+from unittest.mock import MagicMock, patch
+
+from django.test import RequestFactory, TestCase
+from django_redis import get_redis_connection
+from guardian.shortcuts import get_anonymous_user
+
+from authentik.events.buffer import (
+    MODE_MEMORY,
+    MODE_REDIS,
+    MODE_SYNC,
+    OVERFLOW_DROP,
+    OVERFLOW_SYNC,
+    STREAM_DEAD_KEY,
+    STREAM_GROUP,
+    STREAM_KEY,
+    EventBuffer,
+    write_events,
+)
+from authentik.events.models import Event
+from authentik.lib.config import CONFIG
+
+
+def new_event(index: int = 0) -> Event:
+    """Create an unsaved event"""
+    return Event.new("unittest", index=index).set_user(get_anonymous_user())
+
+
+class TestEventBuffer(TestCase):
+    """Test event buffer"""
+
+    def setUp(self):
+        self.buffer = EventBuffer()
+        self.buffer._size = 1
+        self.buffer._queue = Queue(maxsize=1)
+        self.buffer._consumer = "test"
+        # Don't start the flusher thread, events are written by the tests
+        self.patch_start = patch.object(self.buffer, "_ensure_started")
+        self.patch_start.start()
+        get_redis_connection().delete(STREAM_KEY, STREAM_DEAD_KEY)
+
+    def tearDown(self):
+        self.patch_start.stop()
+        get_redis_connection().delete(STREAM_KEY, STREAM_DEAD_KEY)
+
+    def test_write_events(self):
+        """Test events are written with their creation time"""
+        events = [new_event(idx) for idx in range(3)]
+        created = [event.created for event in events]
+        write_events(events)
+        written = Event.objects.filter(action="custom_unittest").order_by(
+            "context__index"
+        )
+        self.assertEqual(len(written), 3)
+        self.assertEqual([event.created for event in written], created)
+
+    def test_write_events_existing(self):
+        """Test notifications aren't sent again for events which already exist"""
+        events = [new_event()]
+        delay = MagicMock()
+        with patch(
+            "authentik.events.tasks.event_notification_batch_handler.delay", delay
+        ):
+            write_events(events)
+            write_events(events)
+        self.assertEqual(delay.call_count, 1)
+
+    def test_sync(self):
+        """Test buffered events are saved immediately in sync mode"""
+        request = RequestFactory().get("/")
+        request.user = get_anonymous_user()
+        with CONFIG.patch("events.buffer.mode", MODE_SYNC):
+            event = Event.new("unittest").from_http(request, buffered=True)
+        self.assertTrue(Event.objects.filter(pk=event.pk).exists())
+
+    def test_memory_overflow_sync(self):
+        """Test events are written immediately when the memory buffer is full"""
+        buffered, overflow = new_event(0), new_event(1)
+        with CONFIG.patch("events.buffer.mode", MODE_MEMORY), CONFIG.patch(
+            "events.buffer.overflow", OVERFLOW_SYNC
+        ):
+            self.buffer.put(buffered)
+            self.buffer.put(overflow)
+        self.assertFalse(Event.objects.filter(pk=buffered.pk).exists())
+        self.assertTrue(Event.objects.filter(pk=overflow.pk).exists())
+        self.buffer.flush()
+        self.assertTrue(Event.objects.filter(pk=buffered.pk).exists())
+
+    def test_memory_overflow_drop(self):
+        """Test events are dropped when the memory buffer is full"""
+        buffered, overflow = new_event(0), new_event(1)
+        with CONFIG.patch("events.buffer.mode", MODE_MEMORY), CONFIG.patch(
+            "events.buffer.overflow", OVERFLOW_DROP
+        ):
+            self.buffer.put(buffered)
+            self.buffer.put(overflow)
+        self.buffer.flush()
+        self.assertTrue(Event.objects.filter(pk=buffered.pk).exists())
+        self.assertFalse(Event.objects.filter(pk=overflow.pk).exists())
+
+    def test_redis(self):
+        """Test events are written from the redis stream"""
+        self.buffer._size = 10
+        events = [new_event(idx) for idx in range(2)]
+        with CONFIG.patch("events.buffer.mode", MODE_REDIS):
+            for event in events:
+                self.buffer.put(event)
+            client = get_redis_connection()
+            self.assertEqual(client.xlen(STREAM_KEY), 2)
+            self.buffer._flush_redis()
+        self.assertEqual(client.xlen(STREAM_KEY), 0)
+        self.assertEqual(
+            Event.objects.filter(pk__in=[event.pk for event in events]).count(), 2
+        )
+
+    def test_redis_poison(self):
+        """Test entries which can't be unpickled are moved to the dead-letter stream"""
+        client = get_redis_connection()
+        client.xadd(STREAM_KEY, {"event": b"not a pickle"})
+        with CONFIG.patch("events.buffer.mode", MODE_REDIS):
+            self.buffer._flush_redis()
+        self.assertEqual(client.xlen(STREAM_KEY), 0)
+        self.assertEqual(client.xlen(STREAM_DEAD_KEY), 1)
+
+    def test_redis_max_deliveries(self):
+        """Test entries which have been delivered too often are moved to the
+        dead-letter stream"""
+        self.buffer._size = 10
+        client = get_redis_connection()
+        with CONFIG.patch("events.buffer.mode", MODE_REDIS):
+            self.buffer.put(new_event())
+            client.xgroup_create(STREAM_KEY, STREAM_GROUP, id="0")
+            self.buffer._group_created = True
+            # Read by another consumer, which died before acknowledging it
+            client.xreadgroup(STREAM_GROUP, "dead", {STREAM_KEY: ">"})
+            with patch("authentik.events.buffer.STREAM_CLAIM_IDLE", 0), patch(
+                "authentik.events.buffer.STREAM_MAX_DELIVERIES", 1
+            ):
+                self.buffer._flush_redis()
+        self.assertEqual(client.xlen(STREAM_KEY), 0)
+        self.assertEqual(client.xlen(STREAM_DEAD_KEY), 1)
+        self.assertFalse(Event.objects.filter(action="custom_unittest").exists())
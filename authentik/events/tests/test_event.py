@@ -6,6 +6,7 @@ from guardian.shortcuts import get_anonymous_user
 
 from authentik.core.models import Group
 from authentik.events.models import Event
+from authentik.events.utils import cleanse_dict, sanitize_cleanse_dict, sanitize_dict
 from authentik.policies.dummy.models import DummyPolicy
 
 
@@ -42,3 +43,23 @@ class TestEvents(TestCase):
             event.context.get("model").get("app"), model_content_type.app_label
         )
         self.assertEqual(event.context.get("model").get("pk"), temp_model.pk.hex)
+
+    def test_new_app(self):
+        """Test app is set to the calling module"""
+        self.assertEqual(Event.new("unittest").app, __name__)
+
+    def test_sanitize_cleanse(self):
+        """Test single-pass sanitize and cleanse"""
+        group = Group.objects.create(name="test")
+        source = {
+            "password": "foo",
+            "passing": True,
+            "token": {"key": "bar", "nested": group},
+            "user": get_anonymous_user(),
+            "model": group,
+            "uuid": group.pk,
+        }
+        cleaned = sanitize_cleanse_dict(source)
+        self.assertEqual(cleaned, cleanse_dict(sanitize_dict(source)))
+        self.assertNotEqual(cleaned["password"], "foo")
+        self.assertEqual(cleaned["token"]["nested"]["name"], "test")
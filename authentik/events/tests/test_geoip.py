@@ -1,7 +1,10 @@
 """Test GeoIP Wrapper"""
+from time import monotonic
+from unittest.mock import patch
+
 from django.test import TestCase
 
-from authentik.events.geo import GeoIPReader
+from authentik.events.geo import CHECK_INTERVAL, GeoIPReader
 
 
 class TestGeoIP(TestCase):
@@ -24,3 +27,21 @@ class TestGeoIP(TestCase):
                 "long": -1.25,
             },
         )
+
+    def test_cache(self):
+        """Test lookups are cached"""
+        city = self.reader.city("2.125.160.216")
+        with patch.object(self.reader._reader, "city") as city_mock:
+            self.assertEqual(self.reader.city("2.125.160.216"), city)
+            city_mock.assert_not_called()
+
+    def test_reload(self):
+        """Test database is only re-opened when its file has been modified"""
+        with patch("authentik.events.geo.GeoIPReader._open") as open_mock:
+            self.reader._last_check = monotonic() - CHECK_INTERVAL
+            self.reader.city("2.125.160.216")
+            open_mock.assert_not_called()
+            self.reader._last_check = monotonic() - CHECK_INTERVAL
+            self.reader._last_mtime = 0
+            self.reader.city("2.125.160.216")
+            open_mock.assert_called_once()
@@ -0,0 +1,81 @@
+"""rule matcher tests"""
+from unittest.mock import patch
+
+from django.db import DatabaseError
+from django.test import TestCase
+from guardian.shortcuts import get_anonymous_user
+
+from authentik.core.models import Group
+from authentik.events.matcher import RULE_MATCHER
+from authentik.events.models import Event, EventAction, NotificationRule
+from authentik.policies.dummy.models import DummyPolicy
+from authentik.policies.event_matcher.models import EventMatcherPolicy
+from authentik.policies.models import PolicyBinding
+from authentik.policies.types import PolicyRequest
+
+
+class TestRuleMatcher(TestCase):
+    """Test rule matcher"""
+
+    def setUp(self):
+        NotificationRule.objects.all().delete()
+        self.group = Group.objects.create(name="test-group")
+        self.login = NotificationRule.objects.create(name="login", group=self.group)
+        PolicyBinding.objects.create(
+            target=self.login,
+            policy=EventMatcherPolicy.objects.create(
+                name="login", action=EventAction.LOGIN, client_ip="-"
+            ),
+            order=0,
+        )
+
+    def candidates(self, event: Event) -> set[str]:
+        """Names of the rules which might match `event`"""
+        return {rule.name for rule in RULE_MATCHER.get().candidates(event)}
+
+    def test_candidates(self):
+        """Test only rules with matching fields are candidates"""
+        self.assertEqual(self.candidates(Event.new(EventAction.LOGIN)), {"login"})
+        self.assertEqual(self.candidates(Event.new(EventAction.LOGOUT)), set())
+        with self.assertNumQueries(0):
+            RULE_MATCHER.get()
+
+    def test_generic(self):
+        """Test rules with other policies are always candidates"""
+        rule = NotificationRule.objects.create(name="generic", group=self.group)
+        PolicyBinding.objects.create(
+            target=rule,
+            policy=DummyPolicy.objects.create(name="dummy", result=True),
+            order=0,
+        )
+        self.assertEqual(self.candidates(Event.new(EventAction.LOGOUT)), {"generic"})
+
+    def test_no_group(self):
+        """Test rules without group are never candidates"""
+        self.login.group = None
+        self.login.save()
+        self.assertEqual(self.candidates(Event.new(EventAction.LOGIN)), set())
+
+    def test_loop(self):
+        """Test events created by policies bound to rules are detected"""
+        policy = EventMatcherPolicy.objects.create(name="disabled")
+        PolicyBinding.objects.create(
+            target=self.login, policy=policy, order=1, enabled=False
+        )
+        event = Event.new(
+            EventAction.POLICY_EXCEPTION, policy_uuid=policy.policy_uuid.hex
+        )
+        self.assertTrue(RULE_MATCHER.get().causes_loop(event))
+        self.assertFalse(RULE_MATCHER.get().causes_loop(Event.new(EventAction.LOGIN)))
+
+    def test_exception(self):
+        """Test rules whose policies raise an exception don't match"""
+        request = PolicyRequest(get_anonymous_user())
+        request.obj = self.login
+        request.context["event"] = Event.new(EventAction.LOGIN)
+        with patch(
+            "authentik.events.matcher.PolicyProcess.execute",
+            side_effect=DatabaseError("foo"),
+        ):
+            self.assertFalse(RULE_MATCHER.get().passes(self.login, request))
+        self.assertTrue(RULE_MATCHER.get().passes(self.login, request))
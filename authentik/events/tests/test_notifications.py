@@ -1,6 +1,7 @@
 """Notification tests"""
 
-from unittest.mock import MagicMock, patch
+from smtplib import SMTPException
+from unittest.mock import MagicMock, PropertyMock, patch
 
 from django.test import TestCase
 
@@ -11,6 +12,8 @@ from authentik.events.models import (
     Notification,
     NotificationRule,
     NotificationTransport,
+    NotificationTransportError,
+    TransportMode,
 )
 from authentik.policies.event_matcher.models import EventMatcherPolicy
 from authentik.policies.exceptions import PolicyException
@@ -112,3 +115,86 @@ class TestEventsNotifications(TestCase):
         with patch("authentik.events.models.NotificationTransport.send", execute_mock):
             Event.new(EventAction.CUSTOM_PREFIX).save()
         self.assertEqual(Notification.objects.count(), 1)
+
+    def test_transport_email_batch(self):
+        """Test emails to all group members are sent with a single call"""
+        user2 = User.objects.create(name="test2-user", username="test2")
+        self.group.users.add(user2)
+
+        transport = NotificationTransport.objects.create(
+            name="transport", mode=TransportMode.EMAIL
+        )
+        NotificationRule.objects.filter(name__startswith="default").delete()
+        trigger = NotificationRule.objects.create(name="trigger", group=self.group)
+        trigger.transports.add(transport)
+        matcher = EventMatcherPolicy.objects.create(
+            name="matcher", action=EventAction.CUSTOM_PREFIX
+        )
+        PolicyBinding.objects.create(target=trigger, policy=matcher, order=0)
+
+        execute_mock = MagicMock()
+        with patch(
+            "authentik.events.models.NotificationTransport.send_emails", execute_mock
+        ):
+            Event.new(EventAction.CUSTOM_PREFIX).save()
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(execute_mock.call_count, 1)
+        self.assertEqual(len(execute_mock.call_args[0][0]), 2)
+
+    def test_transport_email_retry(self):
+        """Test only emails which haven't been sent are retried"""
+        self.user.email = "test@goauthentik.io"
+        self.user.save()
+        user2 = User.objects.create(
+            name="test2-user", username="test2", email="test2@goauthentik.io"
+        )
+        self.group.users.add(user2)
+
+        transport = NotificationTransport.objects.create(
+            name="transport", mode=TransportMode.EMAIL
+        )
+        NotificationRule.objects.filter(name__startswith="default").delete()
+        trigger = NotificationRule.objects.create(name="trigger", group=self.group)
+        trigger.transports.add(transport)
+        matcher = EventMatcherPolicy.objects.create(
+            name="matcher", action=EventAction.CUSTOM_PREFIX
+        )
+        PolicyBinding.objects.create(target=trigger, policy=matcher, order=0)
+
+        recipients = []
+        failed = []
+
+        def send_messages(messages):
+            # Fail after the first email has been sent
+            if len(recipients) == 1 and not failed:
+                failed.append(True)
+                raise SMTPException()
+            recipients.extend(message.to[0] for message in messages)
+            return len(messages)
+
+        backend = MagicMock()
+        backend.send_messages = MagicMock(side_effect=send_messages)
+        with patch(
+            "authentik.stages.email.models.EmailStage.backend",
+            PropertyMock(return_value=backend),
+        ):
+            Event.new(EventAction.CUSTOM_PREFIX).save()
+        self.assertTrue(failed)
+        self.assertEqual(
+            sorted(recipients), ["test2@goauthentik.io", "test@goauthentik.io"]
+        )
+
+    def test_transport_email_invalid_settings(self):
+        """Test invalid global email settings fail the transport"""
+        transport = NotificationTransport.objects.create(
+            name="transport", mode=TransportMode.EMAIL
+        )
+        notification = Notification.objects.create(
+            severity="notice", body="foo", user=self.user
+        )
+        with patch(
+            "authentik.stages.email.models.EmailStage.backend",
+            PropertyMock(side_effect=ValueError("foo")),
+        ):
+            with self.assertRaises(NotificationTransportError):
+                transport.send(notification)
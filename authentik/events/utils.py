@@ -1,7 +1,8 @@
 """event utilities"""
 import re
 from dataclasses import asdict, is_dataclass
-from typing import Any, Optional
+from functools import lru_cache
+from typing import Any, Callable, Optional
 from uuid import UUID
 
 from django.contrib.auth.models import AnonymousUser
@@ -20,37 +21,57 @@ from authentik.policies.types import PolicyRequest
 ALLOWED_SPECIAL_KEYS = re.compile("passing", flags=re.I)
 
 
+@lru_cache(maxsize=1024)
+def _is_hidden_key(key: Any) -> bool:
+    """Check if the value of `key` should be hidden, memoized as events mostly use
+    the same keys"""
+    try:
+        return bool(
+            SafeExceptionReporterFilter.hidden_settings.search(key)
+        ) and not ALLOWED_SPECIAL_KEYS.search(key)
+    except TypeError:  # pragma: no cover
+        return False
+
+
 def cleanse_dict(source: dict[Any, Any]) -> dict[Any, Any]:
     """Cleanse a dictionary, recursively"""
     final_dict = {}
     for key, value in source.items():
-        try:
-            if SafeExceptionReporterFilter.hidden_settings.search(
-                key
-            ) and not ALLOWED_SPECIAL_KEYS.search(key):
-                final_dict[key] = SafeExceptionReporterFilter.cleansed_substitute
-            else:
-                final_dict[key] = value
-        except TypeError:  # pragma: no cover
+        if _is_hidden_key(key):
+            final_dict[key] = SafeExceptionReporterFilter.cleansed_substitute
+        else:
             final_dict[key] = value
         if isinstance(value, dict):
             final_dict[key] = cleanse_dict(value)
     return final_dict
 
 
-def model_to_dict(model: Model) -> dict[str, Any]:
-    """Convert model to dict"""
-    name = str(model)
-    if hasattr(model, "name"):
-        name = model.name
-    return {
-        "app": model._meta.app_label,
-        "model_name": model._meta.model_name,
+@lru_cache(maxsize=None)
+def _model_serializer(model_class: type[Model]) -> Callable[[Model], dict[str, Any]]:
+    """Build the serializer of `model_class` once, so the attributes of the class don't
+    have to be checked again for every instance"""
+    app = model_class._meta.app_label
+    model_name = model_class._meta.model_name
+    if hasattr(model_class, "name"):
+        return lambda model: {
+            "app": app,
+            "model_name": model_name,
+            "pk": model.pk,
+            "name": model.name,
+        }
+    return lambda model: {
+        "app": app,
+        "model_name": model_name,
         "pk": model.pk,
-        "name": name,
+        "name": str(model),
     }
 
 
+def model_to_dict(model: Model) -> dict[str, Any]:
+    """Convert model to dict"""
+    return _model_serializer(model.__class__)(model)
+
+
 def get_user(user: User, original_user: Optional[User] = None) -> dict[str, Any]:
     """Convert user object to dictionary, optionally including the original user"""
     if isinstance(user, AnonymousUser):
@@ -96,3 +117,29 @@ def sanitize_dict(source: dict[Any, Any]) -> dict[Any, Any]:
         else:
             final_dict[key] = value
     return final_dict
+
+
+def sanitize_cleanse_dict(source: dict[Any, Any]) -> dict[Any, Any]:
+    """Sanitize and cleanse a dictionary in a single pass, equivalent to
+    `cleanse_dict(sanitize_dict(source))`"""
+    final_dict = {}
+    for key, value in source.items():
+        if is_dataclass(value):
+            if isinstance(value, PolicyRequest):
+                value.http_request = None
+            value = asdict(value)
+        if isinstance(value, dict):
+            final_dict[key] = sanitize_cleanse_dict(value)
+        elif isinstance(value, (User, AnonymousUser)):
+            final_dict[key] = sanitize_cleanse_dict(get_user(value))
+        elif isinstance(value, models.Model):
+            final_dict[key] = sanitize_cleanse_dict(model_to_dict(value))
+        elif isinstance(value, (HttpRequest, WSGIRequest)):
+            continue
+        elif _is_hidden_key(key):
+            final_dict[key] = SafeExceptionReporterFilter.cleansed_substitute
+        elif isinstance(value, UUID):
+            final_dict[key] = value.hex
+        else:
+            final_dict[key] = value
+    return final_dict
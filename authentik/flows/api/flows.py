@@ -1,7 +1,6 @@
 """Flow API Views"""
 from dataclasses import dataclass
 
-from django.core.cache import cache
 from django.db.models import Model
 from django.http.response import HttpResponseBadRequest, JsonResponse
 from django.urls import reverse
@@ -10,7 +9,13 @@ from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiResponse, extend_schema, inline_serializer
 from guardian.shortcuts import get_objects_for_user
 from rest_framework.decorators import action
-from rest_framework.fields import BooleanField, FileField, ReadOnlyField
+from rest_framework.fields import (
+    BooleanField,
+    FileField,
+    FloatField,
+    IntegerField,
+    ReadOnlyField,
+)
 from rest_framework.parsers import MultiPartParser
 from rest_framework.request import Request
 from rest_framework.response import Response
@@ -24,14 +29,22 @@ from rest_framework.viewsets import ModelViewSet
 from structlog.stdlib import get_logger
 
 from authentik.api.decorators import permission_required
-from authentik.core.api.utils import CacheSerializer, LinkSerializer
+from authentik.core.api.utils import CacheSerializer, LinkSerializer, PassiveSerializer
 from authentik.flows.exceptions import FlowNonApplicableException
 from authentik.flows.models import Flow
-from authentik.flows.planner import PLAN_CONTEXT_PENDING_USER, FlowPlanner, cache_key
+from authentik.flows.planner import (
+    FLOW_PLAN_COUNTER,
+    PLAN_CONTEXT_PENDING_USER,
+    FlowPlanner,
+    flow_generation,
+    plan_index,
+    plan_stats,
+)
 from authentik.flows.transfer.common import DataclassEncoder
 from authentik.flows.transfer.exporter import FlowExporter
 from authentik.flows.transfer.importer import FlowImporter
 from authentik.flows.views import SESSION_KEY_PLAN
+from authentik.lib.utils.cache import delete_keys
 from authentik.lib.views import bad_request_message
 
 LOGGER = get_logger()
@@ -46,7 +59,7 @@ class FlowSerializer(ModelSerializer):
 
     def get_cache_count(self, flow: Flow) -> int:
         """Get count of cached flows"""
-        return len(cache.keys(f"{cache_key(flow)}*"))
+        return plan_index(flow, flow_generation(flow)).size()
 
     class Meta:
 
@@ -70,6 +83,16 @@ class FlowSerializer(ModelSerializer):
         }
 
 
+class FlowCacheStatsSerializer(PassiveSerializer):
+    """Cache stats of a single flow"""
+
+    generation = IntegerField(read_only=True)
+    count = IntegerField(read_only=True)
+    hits = IntegerField(read_only=True)
+    misses = IntegerField(read_only=True)
+    hit_rate = FloatField(read_only=True)
+
+
 class FlowDiagramSerializer(Serializer):
     """response of the flow's diagram action"""
 
@@ -108,7 +131,29 @@ class FlowViewSet(ModelViewSet):
     @action(detail=False, pagination_class=None, filter_backends=[])
     def cache_info(self, request: Request) -> Response:
         """Info about cached flows"""
-        return Response(data={"count": len(cache.keys("flow_*"))})
+        return Response(data={"count": FLOW_PLAN_COUNTER.count()})
+
+    @permission_required(None, ["authentik_flows.view_flow_cache"])
+    @extend_schema(responses={200: FlowCacheStatsSerializer(many=False)})
+    @action(detail=True, pagination_class=None, filter_backends=[])
+    # pylint: disable=unused-argument
+    def cache_stats(self, request: Request, slug: str) -> Response:
+        """Current generation, cached plans and hit rate of a flow's plan cache"""
+        flow = self.get_object()
+        generation = flow_generation(flow)
+        stats = plan_stats(flow)
+        hits, misses = stats.get()
+        return Response(
+            FlowCacheStatsSerializer(
+                {
+                    "generation": generation,
+                    "count": plan_index(flow, generation).size(),
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                }
+            ).data
+        )
 
     @permission_required(None, ["authentik_flows.clear_flow_cache"])
     @extend_schema(
@@ -121,9 +166,11 @@ class FlowViewSet(ModelViewSet):
     @action(detail=False, methods=["POST"])
     def cache_clear(self, request: Request) -> Response:
         """Clear flow cache"""
-        keys = cache.keys("flow_*")
-        cache.delete_many(keys)
-        LOGGER.debug("Cleared flow cache", keys=len(keys))
+        total = delete_keys("flow_*")
+        # Also delete the per-flow indexes of cached plans
+        delete_keys("index_flow_plans_*")
+        FLOW_PLAN_COUNTER.clear()
+        LOGGER.debug("Cleared flow cache", keys=total)
         return Response(status=204)
 
     @permission_required(
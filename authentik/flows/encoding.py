@@ -0,0 +1,160 @@
+"""Compact encoding of flow plans for the session"""
+from collections import defaultdict
+from dataclasses import fields, is_dataclass
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from django.apps import apps
+from django.db.models import Model
+from structlog.stdlib import get_logger
+
+if TYPE_CHECKING:
+    from authentik.flows.planner import FlowPlan
+
+LOGGER = get_logger()
+# Increment when the encoding changes in an incompatible way
+PLAN_VERSION = 1
+
+
+class ModelRef(NamedTuple):
+    """Reference to a saved model instance"""
+
+    model: str
+    pk: Any
+
+
+class DataclassRef(NamedTuple):
+    """Dataclass instance, stored as its class and encoded attributes"""
+
+    cls: type
+    attrs: dict[str, Any]
+
+
+def encode_value(value: Any) -> Any:
+    """Replace saved model instances within `value` with references. Dictionaries,
+    lists, tuples and dataclass instances are encoded recursively. Everything else,
+    including subclasses of dictionaries, lists and tuples like `OrderedDict` or named
+    tuples, is kept as-is, so model instances within them are pickled in full."""
+    if isinstance(value, Model):
+        # Unsaved instances, like in-memory stages, are kept as they are
+        if value._state.adding or value.pk is None:
+            return value
+        return ModelRef(value._meta.label_lower, value.pk)
+    if type(value) is dict:  # pylint: disable=unidiomatic-typecheck
+        return {key: encode_value(item) for key, item in value.items()}
+    if type(value) is list:  # pylint: disable=unidiomatic-typecheck
+        return [encode_value(item) for item in value]
+    if type(value) is tuple:  # pylint: disable=unidiomatic-typecheck
+        return tuple(encode_value(item) for item in value)
+    if (
+        is_dataclass(value)
+        and not isinstance(value, type)
+        and hasattr(value, "__dict__")
+    ):
+        return DataclassRef(value.__class__, encode_value(vars(value)))
+    return value
+
+
+def encode_plan(plan: "FlowPlan") -> dict[str, Any]:
+    """Encode `plan` with model references. Markers are stored as their class
+    and encoded fields."""
+    return {
+        "version": PLAN_VERSION,
+        "flow_pk": plan.flow_pk,
+        "stages": [encode_value(stage) for stage in plan.stages],
+        "markers": [
+            (
+                marker.__class__,
+                {
+                    field.name: encode_value(getattr(marker, field.name))
+                    for field in fields(marker)
+                },
+            )
+            for marker in plan.markers
+        ],
+        "context": encode_value(plan.context),
+    }
+
+
+class PlanHydrator:
+    """Resolve all model references of an encoded plan, with one query per model"""
+
+    _refs: dict[str, set[Any]]
+    _objects: dict[ModelRef, Model]
+
+    def __init__(self):
+        self._refs = defaultdict(set)
+        self._objects = {}
+
+    def collect(self, value: Any):
+        """Collect model references within `value`"""
+        if isinstance(value, ModelRef):
+            self._refs[value.model].add(value.pk)
+        elif isinstance(value, DataclassRef):
+            self.collect(value.attrs)
+        elif type(value) is dict:  # pylint: disable=unidiomatic-typecheck
+            for item in value.values():
+                self.collect(item)
+        elif type(value) in (list, tuple):
+            for item in value:
+                self.collect(item)
+
+    def load(self):
+        """Load all collected references. Stages are taken from the flow registry."""
+        from authentik.flows.models import Stage
+        from authentik.flows.registry import FLOW_REGISTRY
+
+        for label, pks in self._refs.items():
+            try:
+                model = apps.get_model(label)
+            except LookupError:
+                LOGGER.warning("Model of plan reference does not exist", model=label)
+                continue
+            if issubclass(model, Stage):
+                objects = FLOW_REGISTRY.stages(pks)
+            else:
+                objects = model.objects.in_bulk(list(pks))
+            for obj in objects.values():
+                self._objects[ModelRef(label, obj.pk)] = obj
+        self._refs.clear()
+
+    def decode(self, value: Any) -> Any:
+        """Replace model references within `value` with the loaded instances. Deleted
+        objects are replaced with None."""
+        if isinstance(value, ModelRef):
+            return self._objects.get(value)
+        if isinstance(value, DataclassRef):
+            # Same as unpickling, so __init__ isn't called and frozen instances work
+            obj = value.cls.__new__(value.cls)
+            obj.__dict__.update(self.decode(value.attrs))
+            return obj
+        if type(value) is dict:  # pylint: disable=unidiomatic-typecheck
+            return {key: self.decode(item) for key, item in value.items()}
+        if type(value) is list:  # pylint: disable=unidiomatic-typecheck
+            return [self.decode(item) for item in value]
+        if type(value) is tuple:  # pylint: disable=unidiomatic-typecheck
+            return tuple(self.decode(item) for item in value)
+        return value
+
+
+def decode_plan(plan: "FlowPlan", encoded: dict[str, Any]):
+    """Set stages, markers and context of `plan` from `encoded`"""
+    hydrator = PlanHydrator()
+    hydrator.collect(encoded["stages"])
+    for _, values in encoded["markers"]:
+        hydrator.collect(values)
+    hydrator.collect(encoded["context"])
+    hydrator.load()
+    stages = []
+    markers = []
+    for encoded_stage, (marker_class, values) in zip(
+        encoded["stages"], encoded["markers"]
+    ):
+        stage = hydrator.decode(encoded_stage)
+        if stage is None:
+            LOGGER.warning("Stage of plan does not exist anymore", stage=encoded_stage)
+            continue
+        stages.append(stage)
+        markers.append(marker_class(**hydrator.decode(values)))
+    plan.stages = stages
+    plan.markers = markers
+    plan.context = hydrator.decode(encoded["context"])
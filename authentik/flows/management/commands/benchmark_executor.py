@@ -0,0 +1,481 @@
+"""authentik flow executor benchmark command"""
+from dataclasses import dataclass
+from json import dumps, loads
+from math import ceil
+from multiprocessing import Manager, cpu_count, get_context
+from pickle import HIGHEST_PROTOCOL  # nosec
+from pickle import dumps as pickle_dumps  # nosec
+from sys import stdout
+from time import perf_counter
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from redis.client import Pipeline, Redis
+from structlog.stdlib import get_logger
+
+from authentik import __version__
+from authentik.core.models import Application, User
+from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding
+from authentik.providers.oauth2.models import OAuth2Provider
+from authentik.stages.prompt.models import FieldTypes, Prompt, PromptStage
+from authentik.stages.user_login.models import UserLoginStage
+from authentik.stages.user_write.models import UserWriteStage
+
+LOGGER = get_logger()
+FORK_CTX = get_context("fork")
+PROCESS_CLASS = FORK_CTX.Process
+PASSWORD = "benchmark-password"  # nosec
+REDIRECT_URI = "http://localhost"
+COMPONENT_REDIRECT = "xak-flow-redirect"
+# Requests per flow execution after which it's considered stuck
+MAX_STEPS = 20
+
+
+@dataclass
+class Scenario:
+    """Flow executed by each simulated user"""
+
+    name: str
+    flow: Flow
+    # Responses to challenges by their component, called with the process and a
+    # unique identifier for each execution
+    answers: Callable[["FlowBenchmarkProcess", str], dict[str, dict[str, Any]]]
+    # Called with the process and its client before each execution of the flow
+    prepare: Optional[Callable[["FlowBenchmarkProcess", Client], None]] = None
+
+
+@dataclass
+class Sample:
+    """Measurements of a single request"""
+
+    step: str
+    duration: float
+    queries: int
+    redis_ops: int
+    session_bytes: int
+
+
+@dataclass
+class RedisOpCounter:
+    """Count commands sent to redis by this process, including pipelined commands"""
+
+    count: int = 0
+
+    def install(self):
+        """Wrap redis' command execution, only called in benchmark processes"""
+        execute_command = Redis.execute_command
+        execute_pipeline = Pipeline.execute
+        counter = self
+
+        def counting_execute_command(client, *args, **kwargs):
+            counter.count += 1
+            return execute_command(client, *args, **kwargs)
+
+        def counting_execute_pipeline(pipeline, *args, **kwargs):
+            counter.count += len(pipeline.command_stack)
+            return execute_pipeline(pipeline, *args, **kwargs)
+
+        Redis.execute_command = counting_execute_command
+        Pipeline.execute = counting_execute_pipeline
+
+
+def session_writes(designation: str) -> float:
+    """Sessions written by the flow executor in this process"""
+    return (
+        REGISTRY.get_sample_value(
+            "authentik_flows_session_writes_total",
+            {"flow_designation": designation},
+        )
+        or 0
+    )
+
+
+class FlowBenchmarkProcess(PROCESS_CLASS):  # pragma: no cover
+    """Simulated user, which executes a flow through the flow executor"""
+
+    def __init__(
+        self, index: int, return_dict: dict, scenario: Scenario, iterations: int
+    ) -> None:
+        super().__init__()
+        self.index = index
+        self.return_dict = return_dict
+        self.scenario = scenario
+        self.iterations = iterations
+        self.user = User.objects.get(username=f"benchmark-{index}")
+        self.samples: list[Sample] = []
+        self.redis = RedisOpCounter()
+        self.executor_url = reverse(
+            "authentik_api:flow-executor", kwargs={"flow_slug": scenario.flow.slug}
+        )
+
+    def measure(
+        self, step: str, client: Client, request: Callable[[], HttpResponse]
+    ) -> HttpResponse:
+        """Execute `request` and record its measurements as `step`"""
+        redis_ops = self.redis.count
+        writes = session_writes(self.scenario.flow.designation)
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            response = request()
+            duration = perf_counter() - start
+        sample = Sample(
+            step=step,
+            duration=duration,
+            queries=len(queries),
+            redis_ops=self.redis.count - redis_ops,
+            session_bytes=0,
+        )
+        if session_writes(self.scenario.flow.designation) > writes:
+            # Loaded after the request's redis commands have been counted, and pickled
+            # the same way as by the session's cache backend
+            sample.session_bytes = len(
+                pickle_dumps(dict(client.session.items()), HIGHEST_PROTOCOL)
+            )
+        self.samples.append(sample)
+        return response
+
+    def execute(self, client: Client, identifier: str):
+        """Execute the flow once, answering all challenges"""
+        answers = self.scenario.answers(self, identifier)
+        url = f"{self.executor_url}?query="
+        response = self.measure("GET", client, lambda: client.get(url))
+        for _ in range(MAX_STEPS):
+            component = loads(response.content)["component"]
+            self.samples[-1].step = f"GET {component}"
+            if component == COMPONENT_REDIRECT:
+                return
+            if component not in answers:
+                raise ValueError(f"Unexpected challenge {component}")
+            response = self.measure(
+                f"POST {component}",
+                client,
+                lambda: client.post(url, answers[component]),
+            )
+            if response.status_code == 200:
+                # Challenge was either invalid, or the flow is done
+                if loads(response.content)["component"] != COMPONENT_REDIRECT:
+                    raise ValueError(f"Challenge {component} was not accepted")
+                return
+            response = self.measure("GET", client, lambda: client.get(url))
+        raise ValueError("Flow did not finish")
+
+    def run(self):
+        self.redis.install()
+        errors = 0
+        for _ in range(self.iterations):
+            client = Client()
+            try:
+                if self.scenario.prepare:
+                    self.scenario.prepare(self, client)
+                # Unique across runs, as enrolled users are kept with --keepdb
+                self.execute(client, f"benchmark-{self.index}-{uuid4().hex[:8]}")
+            except Exception as exc:  # pylint: disable=broad-except
+                LOGGER.warning("Flow execution failed", exc=exc)
+                errors += 1
+        self.return_dict[self.index] = (self.samples, errors)
+
+
+def percentile(values: list[float], pct: int) -> float:
+    """Nearest-rank percentile of sorted `values`"""
+    if not values:
+        return 0
+    return values[max(ceil(len(values) * pct / 100) - 1, 0)]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Percentiles, mean and maximum of `values`"""
+    values = sorted(values)
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values) if values else 0,
+        "max": values[-1] if values else 0,
+    }
+
+
+def authentication_scenario() -> Scenario:
+    """Default authentication flow, identification, password and login"""
+    return Scenario(
+        name="authentication",
+        flow=Flow.objects.get(slug="default-authentication-flow"),
+        answers=lambda proc, _: {
+            "ak-stage-identification": {"uid_field": proc.user.username},
+            "ak-stage-password": {"password": PASSWORD},
+        },
+    )
+
+
+def enrollment_scenario() -> Scenario:
+    """Enrollment flow with a single prompt, user write and login stage, modelled
+    after the example enrollment flow"""
+    flow, _ = Flow.objects.update_or_create(
+        slug="benchmark-enrollment",
+        defaults={
+            "name": "benchmark-enrollment",
+            "designation": FlowDesignation.ENROLLMENT,
+        },
+    )
+    prompt_stage, _ = PromptStage.objects.get_or_create(
+        name="benchmark-enrollment-prompt"
+    )
+    prompt_stage.fields.set(
+        [
+            Prompt.objects.get_or_create(
+                field_key=key,
+                defaults={"label": key, "type": field_type, "order": order},
+            )[0]
+            for order, (key, field_type) in enumerate(
+                [
+                    ("username", FieldTypes.USERNAME),
+                    ("password", FieldTypes.PASSWORD),
+                    ("password_repeat", FieldTypes.PASSWORD),
+                    ("name", FieldTypes.TEXT),
+                    ("email", FieldTypes.EMAIL),
+                ]
+            )
+        ]
+    )
+    stages = [
+        prompt_stage,
+        UserWriteStage.objects.get_or_create(name="benchmark-enrollment-write")[0],
+        UserLoginStage.objects.get_or_create(name="benchmark-enrollment-login")[0],
+    ]
+    for order, stage in enumerate(stages):
+        FlowStageBinding.objects.update_or_create(
+            target=flow, stage=stage, defaults={"order": order}
+        )
+    return Scenario(
+        name="enrollment",
+        flow=flow,
+        answers=lambda _, identifier: {
+            "ak-stage-prompt": {
+                "username": identifier,
+                "password": PASSWORD,
+                "password_repeat": PASSWORD,
+                "name": identifier,
+                "email": f"{identifier}@goauthentik.io",
+            },
+        },
+    )
+
+
+def authorization_scenario() -> Scenario:
+    """OAuth2 authorization with the default explicit consent flow, started by the
+    authorize endpoint of a provider"""
+    flow = Flow.objects.get(slug="default-provider-authorization-explicit-consent")
+    provider, _ = OAuth2Provider.objects.update_or_create(
+        client_id="benchmark",
+        defaults={
+            "name": "benchmark",
+            "authorization_flow": flow,
+            "redirect_uris": REDIRECT_URI,
+        },
+    )
+    Application.objects.update_or_create(
+        slug="benchmark", defaults={"name": "benchmark", "provider": provider}
+    )
+
+    def prepare(proc: FlowBenchmarkProcess, client: Client):
+        client.force_login(proc.user)
+        proc.measure(
+            "GET authorize",
+            client,
+            lambda: client.get(
+                reverse("authentik_providers_oauth2:authorize"),
+                data={
+                    "response_type": "code",
+                    "client_id": provider.client_id,
+                    "redirect_uri": REDIRECT_URI,
+                },
+            ),
+        )
+
+    return Scenario(
+        name="authorization",
+        flow=flow,
+        answers=lambda *_: {"ak-stage-consent": {}},
+        prepare=prepare,
+    )
+
+
+SCENARIOS = {
+    "authentication": authentication_scenario,
+    "enrollment": enrollment_scenario,
+    "authorization": authorization_scenario,
+}
+
+
+class Command(BaseCommand):  # pragma: no cover
+    """Benchmark the flow executor with concurrent simulated users, in a separate
+    database"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-p",
+            "--processes",
+            default=cpu_count(),
+            type=int,
+            help="How many simulated users should execute flows concurrently.",
+        )
+        parser.add_argument(
+            "-n",
+            "--iterations",
+            default=20,
+            type=int,
+            help="How often each simulated user executes each flow.",
+        )
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=SCENARIOS.keys(),
+            help="Scenarios to run, defaults to all.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write JSON results to this file instead of stdout.",
+        )
+        parser.add_argument(
+            "--baseline",
+            help=(
+                "JSON results of a previous run. Fails when the p95 latency of a step "
+                "regressed by more than --threshold, it executes more queries, or a "
+                "scenario has more errors."
+            ),
+        )
+        parser.add_argument(
+            "--threshold",
+            default=0.2,
+            type=float,
+            help="Allowed relative p95 latency regression compared to --baseline.",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Keep the benchmark database between runs.",
+        )
+
+    def run_scenario(self, scenario: Scenario, processes: int, iterations: int) -> dict:
+        """Run `scenario` with concurrent processes and aggregate their samples"""
+        manager = Manager()
+        return_dict = manager.dict()
+        jobs = [
+            FlowBenchmarkProcess(i, return_dict, scenario, iterations)
+            for i in range(processes)
+        ]
+        db.connections.close_all()
+        start = perf_counter()
+        for proc in jobs:
+            proc.start()
+        for proc in jobs:
+            proc.join()
+        duration = perf_counter() - start
+
+        steps: dict[str, list[Sample]] = {}
+        # Processes which crashed didn't return their results
+        errors = (processes - len(return_dict)) * iterations
+        for samples, proc_errors in return_dict.values():
+            errors += proc_errors
+            for sample in samples:
+                steps.setdefault(sample.step, []).append(sample)
+        return {
+            "flow": scenario.flow.slug,
+            "executions": processes * iterations,
+            "errors": errors,
+            "duration": duration,
+            "steps": {
+                step: {
+                    "count": len(samples),
+                    "latency_ms": summarize([x.duration * 1000 for x in samples]),
+                    "queries": summarize([x.queries for x in samples]),
+                    "redis_ops": summarize([x.redis_ops for x in samples]),
+                    "session_bytes": summarize([x.session_bytes for x in samples]),
+                }
+                for step, samples in sorted(steps.items())
+            },
+        }
+
+    def compare(self, results: dict, baseline: dict, threshold: float) -> list[str]:
+        """Regressions of `results` compared to `baseline`"""
+        regressions = []
+        for name, scenario in results["scenarios"].items():
+            previous_errors = baseline["scenarios"].get(name, {}).get("errors", 0)
+            if scenario["errors"] > previous_errors:
+                regressions.append(
+                    f"{name}: errors {previous_errors} -> {scenario['errors']}"
+                )
+            baseline_steps = baseline["scenarios"].get(name, {}).get("steps", {})
+            for step, values in scenario["steps"].items():
+                if step not in baseline_steps:
+                    continue
+                previous = baseline_steps[step]
+                if values["latency_ms"]["p95"] > previous["latency_ms"]["p95"] * (
+                    1 + threshold
+                ):
+                    regressions.append(
+                        f"{name} {step}: p95 latency "
+                        f"{previous['latency_ms']['p95']:.2f}ms -> "
+                        f"{values['latency_ms']['p95']:.2f}ms"
+                    )
+                if values["queries"]["max"] > previous["queries"]["max"]:
+                    regressions.append(
+                        f"{name} {step}: queries {previous['queries']['max']} -> "
+                        f"{values['queries']['max']}"
+                    )
+        return regressions
+
+    def handle(self, *args, **options):
+        """Start benchmark"""
+        processes = options["processes"]
+        iterations = options["iterations"]
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            for i in range(processes):
+                user, _ = User.objects.update_or_create(
+                    username=f"benchmark-{i}", defaults={"name": f"benchmark-{i}"}
+                )
+                user.set_password(PASSWORD)
+                user.save()
+            results = {
+                "version": __version__,
+                "processes": processes,
+                "iterations": iterations,
+                "scenarios": {},
+            }
+            for name in options["scenario"] or SCENARIOS.keys():
+                LOGGER.info("Running scenario", scenario=name)
+                results["scenarios"][name] = self.run_scenario(
+                    SCENARIOS[name](), processes, iterations
+                )
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+
+        output = dumps(results, indent=4)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output_file:
+                output_file.write(output)
+        else:
+            stdout.write(output + "\n")
+        failed = [
+            f"{name}: {scenario['errors']} of {scenario['executions']} executions failed"
+            for name, scenario in results["scenarios"].items()
+            if scenario["errors"]
+        ]
+        if failed:
+            raise CommandError("Flow executions failed:\n" + "\n".join(failed))
+        if options["baseline"]:
+            with open(options["baseline"], "r", encoding="utf-8") as baseline_file:
+                baseline = loads(baseline_file.read())
+            regressions = self.compare(results, baseline, options["threshold"])
+            if regressions:
+                raise CommandError("Regressions found:\n" + "\n".join(regressions))
@@ -4,17 +4,18 @@ from typing import Any, Optional
 
 from django.core.cache import cache
 from django.http import HttpRequest
-from prometheus_client import Histogram
-from sentry_sdk.hub import Hub
-from sentry_sdk.tracing import Span
 from structlog.stdlib import BoundLogger, get_logger
 
 from authentik.core.models import User
-from authentik.events.models import cleanse_dict
+from authentik.events.utils import cleanse_dict
+from authentik.flows.encoding import PLAN_VERSION, decode_plan, encode_plan
 from authentik.flows.exceptions import EmptyFlowException, FlowNonApplicableException
 from authentik.flows.markers import ReevaluateMarker, StageMarker
 from authentik.flows.models import Flow, FlowStageBinding, Stage
+from authentik.lib.instrumentation import LABEL_FLOW_DESIGNATION, Timer, histogram, span
+from authentik.lib.utils.cache import HitCounter, KeyCounter, KeyIndex, incr_version
 from authentik.policies.engine import PolicyEngine
+from authentik.policies.models import PolicyBinding
 from authentik.root.monitoring import UpdatingGauge
 
 LOGGER = get_logger()
@@ -23,30 +24,102 @@ PLAN_CONTEXT_SSO = "is_sso"
 PLAN_CONTEXT_REDIRECT = "redirect"
 PLAN_CONTEXT_APPLICATION = "application"
 PLAN_CONTEXT_SOURCE = "source"
+# Cached plans of all flows, counted without walking the keyspace
+FLOW_PLAN_COUNTER = KeyCounter("flow_plans")
 GAUGE_FLOWS_CACHED = UpdatingGauge(
     "authentik_flows_cached",
     "Cached flows",
-    update_func=lambda: len(cache.keys("flow_*") or []),
+    update_func=FLOW_PLAN_COUNTER.count,
 )
-HIST_FLOWS_PLAN_TIME = Histogram(
+HIST_FLOWS_PLAN_TIME = histogram(
     "authentik_flows_plan_time",
     "Duration to build a plan for a flow",
-    ["flow_slug"],
+    (LABEL_FLOW_DESIGNATION,),
 )
 
 
-def cache_key(flow: Flow, user: Optional[User] = None) -> str:
+def cache_key(flow: Flow, user: Optional[User] = None, generation: int = 0) -> str:
     """Generate Cache key for flow"""
-    prefix = f"flow_{flow.pk}"
+    prefix = f"flow_{flow.pk}_{generation}"
     if user:
         prefix += f"#{user.pk}"
     return prefix
 
 
+def template_key(flow: Flow) -> str:
+    """Cache key for the plan template of a flow. Templates are only served for the
+    generation they were built for, so templates which are built while the flow is
+    changed are never served once the change is visible."""
+    return f"flow_template_{flow.pk}"
+
+
+def generation_key(flow: Flow) -> str:
+    """Cache key for the generation of a flow"""
+    return f"generation_flow_{flow.pk}"
+
+
+def flow_generation(flow: Flow) -> int:
+    """Get the current generation of a flow, which is part of the cache key
+    of all its plans"""
+    return cache.get(generation_key(flow), 0)
+
+
+def plan_index(flow: Flow, generation: int) -> KeyIndex:
+    """Index of all cached plans of a flow's generation, used to count them"""
+    return KeyIndex(f"flow_plans_{flow.pk}_{generation}")
+
+
+def plan_stats(flow: Flow) -> HitCounter:
+    """Hits and misses of a flow's cached plans"""
+    return HitCounter(f"flow_plans_{flow.pk}")
+
+
+def invalidate_flow(flow: Flow) -> int:
+    """Increment the flow's generation, making all cached plans and its plan template
+    unreachable, and delete the template. Returns the new generation."""
+    generation = incr_version(generation_key(flow))
+    cache.delete(template_key(flow))
+    return generation
+
+
+@dataclass
+class PlanTemplateEntry:
+    """A stage binding of a plan template"""
+
+    binding: FlowStageBinding
+    # Policies are bound and have to be evaluated for every user while planning
+    dynamic: bool
+
+
+@dataclass
+class PlanTemplate:
+    """User-independent part of a flow's plan, the stage bindings in order with their
+    stages resolved. Cached once per flow, so only bindings whose policies are evaluated
+    while planning have to be looked at for every user."""
+
+    flow_pk: str
+    # Generation of the flow when the template was built, used for the cache key
+    # of plans built from it
+    generation: int
+    # Policies are bound to the flow itself
+    has_policies: bool
+
+    entries: list[PlanTemplateEntry] = field(default_factory=list)
+
+    @property
+    def dynamic(self) -> bool:
+        """Check if the plan depends on the user"""
+        return any(entry.dynamic for entry in self.entries)
+
+
 @dataclass
 class FlowPlan:
     """This data-class is the output of a FlowPlanner. It holds a flat list
-    of all Stages that should be run."""
+    of all Stages that should be run.
+
+    When pickled, for example into the session, model instances are stored as
+    references, see `authentik.flows.encoding`. They are loaded when the plan's
+    stages, markers or context are first accessed."""
 
     flow_pk: str
 
@@ -54,6 +127,54 @@ class FlowPlan:
     context: dict[str, Any] = field(default_factory=dict)
     markers: list[StageMarker] = field(default_factory=list)
 
+    def encoded(self) -> dict[str, Any]:
+        """Encoded state of this plan, as it is stored in the session"""
+        # Plans which haven't been accessed since they were loaded are stored as-is
+        if "_encoded" in self.__dict__:
+            return self.__dict__["_encoded"]
+        return encode_plan(self)
+
+    def changed_since(self, state: dict[str, Any]) -> bool:
+        """Check if this plan has changed since `encoded()` returned `state`. Plans
+        which haven't been accessed since are unchanged without being encoded. The
+        state of a changed plan is kept for when it's pickled, so it's only encoded
+        once; the plan must not be modified after this has been called."""
+        current = self.encoded()
+        if current is state or current == state:
+            return False
+        self.__dict__["_pickled"] = current
+        return True
+
+    def __getstate__(self) -> dict[str, Any]:
+        if "_pickled" in self.__dict__:
+            return self.__dict__.pop("_pickled")
+        return self.encoded()
+
+    def __setstate__(self, state: dict[str, Any]):
+        if "version" not in state:
+            # Plan pickled before plans were encoded
+            self.__dict__.update(state)
+            return
+        if state["version"] != PLAN_VERSION:
+            LOGGER.warning("Discarding plan with unknown version", state=state)
+            # A plan for no flow is cancelled by the executor
+            self.__dict__.update(flow_pk="", stages=[], context={}, markers=[])
+            return
+        self.flow_pk = state["flow_pk"]
+        self.__dict__["_encoded"] = state
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes which aren't set, which are the lazily
+        # loaded fields of a plan that has been unpickled
+        if (
+            name not in ("stages", "markers", "context")
+            or "_encoded" not in self.__dict__
+        ):
+            raise AttributeError(name)
+        encoded = self.__dict__.pop("_encoded")
+        decode_plan(self, encoded)
+        return getattr(self, name)
+
     def append(self, stage: Stage, marker: Optional[StageMarker] = None):
         """Append `stage` to all stages, optionall with stage marker"""
         self.stages.append(stage)
@@ -117,10 +238,10 @@ class FlowPlanner:
     ) -> FlowPlan:
         """Check each of the flows' policies, check policies for each stage with PolicyBinding
         and return ordered list"""
-        with Hub.current.start_span(op="flow.planner.plan") as span:
-            span: Span
-            span.set_data("flow", self.flow)
-            span.set_data("request", request)
+        with span("flow.planner.plan") as plan_span:
+            if plan_span:
+                plan_span.set_data("flow", self.flow)
+                plan_span.set_data("request", request)
 
             self._logger.debug(
                 "f(plan): starting planning process",
@@ -132,92 +253,167 @@ class FlowPlanner:
                 user = default_context[PLAN_CONTEXT_PENDING_USER]
             else:
                 user = request.user
+            if default_context and plan_span:
+                plan_span.set_data("default_context", cleanse_dict(default_context))
+            template, cached = self._get_template()
             # First off, check the flow's direct policy bindings
             # to make sure the user even has access to the flow
-            engine = PolicyEngine(self.flow, user, request)
-            if default_context:
-                span.set_data("default_context", cleanse_dict(default_context))
-                engine.request.context = default_context
-            engine.build()
-            result = engine.result
-            if not result.passing:
-                raise FlowNonApplicableException(",".join(result.messages))
-            # User is passing so far, check if we have a cached plan
-            cached_plan_key = cache_key(self.flow, user)
-            cached_plan = cache.get(cached_plan_key, None)
-            if cached_plan and self.use_cache:
-                self._logger.debug(
-                    "f(plan): taking plan from cache",
-                    key=cached_plan_key,
-                )
-                # Reset the context as this isn't factored into caching
-                cached_plan.context = default_context or {}
-                return cached_plan
-            self._logger.debug(
-                "f(plan): building plan",
-            )
-            plan = self._build_plan(user, request, default_context)
-            cache.set(cache_key(self.flow, user), plan)
-            GAUGE_FLOWS_CACHED.update()
+            if template.has_policies:
+                engine = PolicyEngine(self.flow, user, request)
+                if default_context:
+                    engine.request.context = default_context
+                engine.build()
+                result = engine.result
+                if not result.passing:
+                    raise FlowNonApplicableException(",".join(result.messages))
+            # Without policies to evaluate, the plan is the same for every user
+            skipped: Optional[set[str]] = set()
+            if template.dynamic:
+                # User is passing so far, check if we have a cached plan
+                cached_plan_key = cache_key(self.flow, user, template.generation)
+                skipped = cache.get(cached_plan_key, None) if self.use_cache else None
+                self._count(skipped is not None)
+                if skipped is None:
+                    self._logger.debug(
+                        "f(plan): building plan",
+                    )
+                    skipped = self._evaluate(template, user, request, default_context)
+                    cache.set(cached_plan_key, skipped)
+                    plan_index(self.flow, template.generation).add(
+                        cached_plan_key, timeout=cache.default_timeout
+                    )
+                    FLOW_PLAN_COUNTER.add(cached_plan_key)
+                else:
+                    self._logger.debug(
+                        "f(plan): taking plan from cache",
+                        key=cached_plan_key,
+                    )
+            else:
+                self._count(cached)
+            plan = self._build_plan(template, user, default_context, skipped)
             if not plan.stages and not self.allow_empty_flows:
                 raise EmptyFlowException()
             return plan
 
-    def _build_plan(
+    def _count(self, hit: bool):
+        """Count a hit or miss of the flow's plan cache"""
+        if not self.use_cache:
+            return
+        if hit:
+            plan_stats(self.flow).hit()
+        else:
+            plan_stats(self.flow).miss()
+
+    def _get_template(self) -> tuple[PlanTemplate, bool]:
+        """Get the flow's plan template from the cache, or build it. Also returns
+        whether the template was cached."""
+        # Generation and template are read at once, and the generation before loading
+        # bindings, so changes made while building the template invalidate it
+        key = template_key(self.flow)
+        if self.use_cache:
+            values = cache.get_many([generation_key(self.flow), key])
+            generation = values.get(generation_key(self.flow), 0)
+            template = values.get(key, None)
+            if template and template.generation == generation:
+                return template, True
+        else:
+            generation = flow_generation(self.flow)
+        template = self._build_template(generation)
+        cache.set(key, template)
+        return template, False
+
+    def _build_template(self, generation: int) -> PlanTemplate:
+        """Load the flow's stage bindings with their stages, and check which
+        targets have policies bound"""
+        bindings = list(
+            FlowStageBinding.objects.filter(target__pk=self.flow.pk).order_by("order")
+        )
+        stages = Stage.objects.filter(
+            pk__in=[binding.stage_id for binding in bindings]
+        ).select_subclasses()
+        stages = {stage.pk: stage for stage in stages}
+        bound = set(
+            PolicyBinding.objects.filter(
+                target__in=[self.flow.pbm_uuid] + [x.pbm_uuid for x in bindings],
+                enabled=True,
+            ).values_list("target", flat=True)
+        )
+        template = PlanTemplate(
+            flow_pk=self.flow.pk.hex,
+            generation=generation,
+            has_policies=self.flow.pbm_uuid in bound,
+        )
+        for binding in bindings:
+            binding.stage = stages[binding.stage_id]
+            template.entries.append(
+                PlanTemplateEntry(
+                    binding=binding,
+                    dynamic=binding.evaluate_on_plan and binding.pbm_uuid in bound,
+                )
+            )
+        return template
+
+    def _evaluate(
         self,
+        template: PlanTemplate,
         user: User,
         request: HttpRequest,
         default_context: Optional[dict[str, Any]],
-    ) -> FlowPlan:
-        """Build flow plan by checking each stage in their respective
-        order and checking the applied policies"""
-        with Hub.current.start_span(
-            op="flow.planner.build_plan"
-        ) as span, HIST_FLOWS_PLAN_TIME.labels(flow_slug=self.flow.slug).time():
-            span: Span
-            span.set_data("flow", self.flow)
-            span.set_data("user", user)
-            span.set_data("request", request)
-
-            plan = FlowPlan(flow_pk=self.flow.pk.hex)
-            if default_context:
-                plan.context = default_context
-            # Check Flow policies
-            for binding in FlowStageBinding.objects.filter(
-                target__pk=self.flow.pk
-            ).order_by("order"):
-                binding: FlowStageBinding
-                stage = binding.stage
-                marker = StageMarker()
-                if binding.evaluate_on_plan:
+    ) -> set[str]:
+        """Evaluate the policies of dynamic stage bindings, and return the primary keys
+        of stage bindings which should be skipped. This is what is cached per user."""
+        skipped = set()
+        with span("flow.planner.build_plan") as build_span, Timer(
+            HIST_FLOWS_PLAN_TIME, flow_designation=self.flow.designation
+        ):
+            if build_span:
+                build_span.set_data("flow", self.flow)
+                build_span.set_data("user", user)
+                build_span.set_data("request", request)
+
+            for entry in template.entries:
+                if not entry.dynamic:
+                    continue
+                binding = entry.binding
+                self._logger.debug(
+                    "f(plan): evaluating on plan",
+                    stage=binding.stage,
+                )
+                engine = PolicyEngine(binding, user, request)
+                engine.request.context = default_context or {}
+                engine.build()
+                if engine.passing:
                     self._logger.debug(
-                        "f(plan): evaluating on plan",
+                        "f(plan): stage passing",
                         stage=binding.stage,
                     )
-                    engine = PolicyEngine(binding, user, request)
-                    engine.request.context = plan.context
-                    engine.build()
-                    if engine.passing:
-                        self._logger.debug(
-                            "f(plan): stage passing",
-                            stage=binding.stage,
-                        )
-                    else:
-                        stage = None
                 else:
-                    self._logger.debug(
-                        "f(plan): not evaluating on plan",
-                        stage=binding.stage,
-                    )
-                if binding.re_evaluate_policies and stage:
-                    self._logger.debug(
-                        "f(plan): stage has re-evaluate marker",
-                        stage=binding.stage,
-                    )
-                    marker = ReevaluateMarker(binding=binding, user=user)
-                if stage:
-                    plan.append(stage, marker)
-            HIST_FLOWS_PLAN_TIME.labels(flow_slug=self.flow.slug)
+                    skipped.add(binding.pk.hex)
+        return skipped
+
+    def _build_plan(
+        self,
+        template: PlanTemplate,
+        user: User,
+        default_context: Optional[dict[str, Any]],
+        skipped: set[str],
+    ) -> FlowPlan:
+        """Build flow plan from the template, without the stage bindings in `skipped`"""
+        plan = FlowPlan(flow_pk=self.flow.pk.hex)
+        if default_context:
+            plan.context = default_context
+        for entry in template.entries:
+            binding = entry.binding
+            if binding.pk.hex in skipped:
+                continue
+            marker = StageMarker()
+            if binding.re_evaluate_policies:
+                self._logger.debug(
+                    "f(plan): stage has re-evaluate marker",
+                    stage=binding.stage,
+                )
+                marker = ReevaluateMarker(binding=binding, user=user)
+            plan.append(binding.stage, marker)
         self._logger.debug(
             "f(plan): finished building",
         )
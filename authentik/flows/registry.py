@@ -0,0 +1,133 @@
+"""Process-local registry of flows, stages and source login buttons"""
+from dataclasses import asdict
+from threading import Lock
+from typing import Any, Callable, Iterable, Optional
+from uuid import UUID
+
+from django.core.cache import cache
+from prometheus_client import Counter
+
+from authentik.core.models import Source
+from authentik.flows.models import Flow, Stage
+from authentik.lib.utils.cache import incr_version
+
+CACHE_KEY_VERSION = "flow_registry_version"
+COUNTER_FLOW_REGISTRY = Counter(
+    "authentik_flows_registry",
+    "Lookups in the process-local flow registry",
+    ["result"],
+)
+
+
+class FlowRegistry:
+    """Flows, stages and source login buttons, which are looked up on every flow step.
+
+    Each process keeps its own copy, which is discarded when the version in the cache
+    has changed. The version is incremented whenever a Flow, Stage or Source is saved
+    or deleted, so all processes see changes on their next lookup. Returned instances
+    are shared and must not be modified."""
+
+    _data: dict[str, Any]
+    _stages: dict[UUID, Stage]
+    _version: Optional[int]
+    _lock: Lock
+
+    def __init__(self):
+        self._data = {}
+        self._stages = {}
+        self._version = None
+        self._lock = Lock()
+
+    def _current_version(self) -> int:
+        """Get the current version, and discard everything loaded for older versions"""
+        version = cache.get(CACHE_KEY_VERSION, 0)
+        with self._lock:
+            if version != self._version:
+                self._data = {}
+                self._stages = {}
+                self._version = version
+        return version
+
+    def _get(self, key: str, loader: Callable[[], Any]) -> Any:
+        version = self._current_version()
+        with self._lock:
+            value = self._data.get(key)
+        if value is not None:
+            COUNTER_FLOW_REGISTRY.labels(result="hit").inc()
+            return value
+        COUNTER_FLOW_REGISTRY.labels(result="miss").inc()
+        value = loader()
+        with self._lock:
+            # Don't save values which were loaded while the version changed
+            if version == self._version:
+                self._data[key] = value
+        return value
+
+    def _flows(self) -> dict[str, Flow]:
+        return self._get(
+            "flows", lambda: {flow.slug: flow for flow in Flow.objects.order_by("slug")}
+        )
+
+    def flow(self, slug: str) -> Optional[Flow]:
+        """Get flow by slug"""
+        return self._flows().get(slug)
+
+    def flow_by_pk(self, pk: UUID) -> Optional[Flow]:
+        """Get flow by primary key"""
+        for flow in self._flows().values():
+            if flow.pk == pk:
+                return flow
+        return None
+
+    def flow_for_designation(self, designation: str) -> Optional[Flow]:
+        """Get the first flow with `designation`, ordered by slug"""
+        for flow in self._flows().values():
+            if flow.designation == designation:
+                return flow
+        return None
+
+    def stages(self, pks: Iterable[UUID]) -> dict[UUID, Stage]:
+        """Get stages by their primary key, resolved to their subclass. Missing stages
+        are loaded with a single query."""
+        version = self._current_version()
+        pks = set(pks)
+        with self._lock:
+            found = {pk: self._stages[pk] for pk in pks if pk in self._stages}
+        missing = pks - found.keys()
+        COUNTER_FLOW_REGISTRY.labels(result="hit").inc(len(found))
+        if not missing:
+            return found
+        COUNTER_FLOW_REGISTRY.labels(result="miss").inc(len(missing))
+        loaded = {
+            stage.pk: stage
+            for stage in Stage.objects.filter(pk__in=missing).select_subclasses()
+        }
+        with self._lock:
+            if version == self._version:
+                self._stages.update(loaded)
+        found.update(loaded)
+        return found
+
+    def source_buttons(self, stage: Stage, sources: Iterable[Source]) -> list[dict]:
+        """Get the serialized login buttons of `stage`'s enabled `sources`. `sources`
+        should be a lazy queryset, as it's only evaluated when the buttons of `stage`
+        aren't loaded yet."""
+
+        def load() -> list[dict]:
+            buttons = []
+            for source in sources:
+                ui_login_button = source.ui_login_button
+                if ui_login_button:
+                    button = asdict(ui_login_button)
+                    button["challenge"] = ui_login_button.challenge.data
+                    buttons.append(button)
+            return buttons
+
+        return self._get(f"source_buttons_{stage.pk}", load)
+
+    def invalidate(self):
+        """Increment the version, invalidating the registry of all processes"""
+        incr_version(CACHE_KEY_VERSION)
+
+
+FLOW_REGISTRY = FlowRegistry()
@@ -1,37 +1,88 @@
 """authentik flow signals"""
-from django.core.cache import cache
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
 from structlog.stdlib import get_logger
 
 LOGGER = get_logger()
+# Sent by the flow executor after a stage view handled a request, with the class of the
+# stage view as sender, and its resource usage as `usage`
+stage_executed = Signal()
+
+
+def invalidate_flows(flows: Iterable):
+    """Invalidate cached plans of `flows`"""
+    from authentik.flows.planner import invalidate_flow
+
+    flows = list(flows)
+    for flow in flows:
+        invalidate_flow(flow)
 
+    def on_commit():
+        # Other processes might build a template before the transaction is committed,
+        # so invalidate again once the change is visible to them
+        for flow in flows:
+            invalidate_flow(flow)
 
-def delete_cache_prefix(prefix: str) -> int:
-    """Delete keys prefixed with `prefix` and return count of deleted keys."""
-    keys = cache.keys(prefix)
-    cache.delete_many(keys)
-    return len(keys)
+    transaction.on_commit(on_commit)
+    return len(flows)
 
 
 @receiver(post_save)
+@receiver(post_delete)
 # pylint: disable=unused-argument
 def invalidate_flow_cache(sender, instance, **_):
     """Invalidate flow cache when flow is updated"""
     from authentik.flows.models import Flow, FlowStageBinding, Stage
-    from authentik.flows.planner import cache_key
+    from authentik.policies.models import Policy, PolicyBinding
 
     if isinstance(instance, Flow):
-        total = delete_cache_prefix(f"{cache_key(instance)}*")
-        LOGGER.debug("Invalidating Flow cache", flow=instance, len=total)
+        invalidate_flows([instance])
+        LOGGER.debug("Invalidating Flow cache", flow=instance)
     if isinstance(instance, FlowStageBinding):
-        total = delete_cache_prefix(f"{cache_key(instance.target)}*")
-        LOGGER.debug(
-            "Invalidating Flow cache from FlowStageBinding", binding=instance, len=total
-        )
+        invalidate_flows([instance.target])
+        LOGGER.debug("Invalidating Flow cache from FlowStageBinding", binding=instance)
     if isinstance(instance, Stage):
-        total = 0
-        for binding in FlowStageBinding.objects.filter(stage=instance):
-            prefix = cache_key(binding.target)
-            total += delete_cache_prefix(f"{prefix}*")
+        stage_bindings = FlowStageBinding.objects.filter(stage=instance)
+        total = invalidate_flows(
+            Flow.objects.filter(pk__in=stage_bindings.values("target"))
+        )
         LOGGER.debug("Invalidating Flow cache from Stage", stage=instance, len=total)
+    if isinstance(instance, (Policy, PolicyBinding)):
+        # Plans contain the results of policies bound to their flow's stage bindings,
+        # and templates record which flows and stage bindings have policies bound
+        if isinstance(instance, Policy):
+            targets = PolicyBinding.objects.filter(policy=instance).values("target")
+        else:
+            targets = [instance.target_id]
+        stage_bindings = FlowStageBinding.objects.filter(pbm_uuid__in=targets)
+        total = invalidate_flows(
+            Flow.objects.filter(
+                Q(pbm_uuid__in=targets) | Q(pk__in=stage_bindings.values("target"))
+            )
+        )
+        LOGGER.debug(
+            "Invalidating Flow cache from policy", instance=instance, len=total
+        )
+
+
+@receiver(post_save)
+@receiver(post_delete)
+@receiver(m2m_changed)
+# pylint: disable=unused-argument
+def invalidate_flow_registry(sender, instance, **_):
+    """Invalidate the flow registry of all processes when flows, stages or sources
+    change"""
+    from authentik.core.models import Source
+    from authentik.flows.models import Flow, Stage
+    from authentik.flows.registry import FLOW_REGISTRY
+
+    if not isinstance(instance, (Flow, Stage, Source)):
+        return
+    FLOW_REGISTRY.invalidate()
+    # Other processes might reload their registry before the transaction is
+    # committed, so invalidate again once the change is visible to them
+    transaction.on_commit(FLOW_REGISTRY.invalidate)
@@ -1,10 +1,12 @@
 """API flow tests"""
+from django.test import RequestFactory
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
 from authentik.core.models import User
 from authentik.flows.api.stages import StageSerializer, StageViewSet
 from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding, Stage
+from authentik.flows.planner import FlowPlanner, flow_generation
 from authentik.policies.dummy.models import DummyPolicy
 from authentik.policies.models import PolicyBinding
 from authentik.stages.dummy.models import DummyStage
@@ -91,6 +93,42 @@ class TestFlowsAPI(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertJSONEqual(response.content, {"diagram": DIAGRAM_SHORT_EXPECTED})
 
+    def test_api_cache_stats(self):
+        """Test flow cache stats"""
+        user = User.objects.get(username="akadmin")
+        self.client.force_login(user)
+
+        flow = Flow.objects.create(
+            name="test-cache-stats",
+            slug="test-cache-stats",
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        FlowStageBinding.objects.create(
+            target=flow, stage=DummyStage.objects.create(name="dummy"), order=0
+        )
+        request = RequestFactory().get("/")
+        request.user = user
+        FlowPlanner(flow).plan(request)
+        FlowPlanner(flow).plan(request)
+        generation = flow_generation(flow)
+
+        response = self.client.get(
+            reverse("authentik_api:flow-cache-stats", kwargs={"slug": flow.slug})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(
+            response.content,
+            {
+                "generation": generation,
+                "count": 0,
+                "hits": 1,
+                "misses": 1,
+                "hit_rate": 0.5,
+            },
+        )
+        flow.save()
+        self.assertEqual(flow_generation(flow), generation + 1)
+
     def test_types(self):
         """Test Stage's types endpoint"""
         user = User.objects.get(username="akadmin")
@@ -0,0 +1,30 @@
+"""flow executor benchmark tests"""
+from django.test import Client, TestCase
+
+from authentik.core.models import User
+from authentik.flows.management.commands.benchmark_executor import (
+    PASSWORD,
+    SCENARIOS,
+    FlowBenchmarkProcess,
+)
+
+
+class TestBenchmarkExecutor(TestCase):
+    """flow executor benchmark tests"""
+
+    def setUp(self):
+        user = User.objects.create(username="benchmark-0", name="benchmark-0")
+        user.set_password(PASSWORD)
+        user.save()
+
+    def test_scenarios(self):
+        """Test each scenario is executed once without errors"""
+        for name, scenario_factory in SCENARIOS.items():
+            with self.subTest(scenario=name):
+                scenario = scenario_factory()
+                proc = FlowBenchmarkProcess(0, {}, scenario, 1)
+                client = Client()
+                if scenario.prepare:
+                    scenario.prepare(proc, client)
+                proc.execute(client, f"benchmark-test-{name}")
+                self.assertTrue(proc.samples)
@@ -0,0 +1,136 @@
+"""flow plan encoding tests"""
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from pickle import dumps, loads  # nosec
+from typing import NamedTuple
+from unittest.mock import patch
+
+from django.test import TestCase
+from guardian.shortcuts import get_anonymous_user
+
+from authentik.core.models import User
+from authentik.flows.encoding import ModelRef
+from authentik.flows.markers import ReevaluateMarker, StageMarker
+from authentik.flows.models import (
+    Flow,
+    FlowDesignation,
+    FlowStageBinding,
+    in_memory_stage,
+)
+from authentik.flows.planner import PLAN_CONTEXT_PENDING_USER, FlowPlan
+from authentik.flows.views import FlowExecutorView
+from authentik.stages.dummy.models import DummyStage
+
+
+class Named(NamedTuple):
+    """Named tuple within a plan's context"""
+
+    user: User
+
+
+@dataclass(frozen=True)
+class Params:
+    """Dataclass within a plan's context"""
+
+    user: User
+
+
+class TestPlanEncoding(TestCase):
+    """Test plan encoding"""
+
+    def setUp(self):
+        self.flow = Flow.objects.create(
+            name="test-encoding",
+            slug="test-encoding",
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        self.stage = DummyStage.objects.create(name="dummy")
+        self.binding = FlowStageBinding.objects.create(
+            target=self.flow, stage=self.stage, order=0, re_evaluate_policies=True
+        )
+        self.user = User.objects.create(username="test-encoding")
+
+    def _plan(self) -> FlowPlan:
+        plan = FlowPlan(flow_pk=self.flow.pk.hex)
+        plan.append(self.stage, ReevaluateMarker(binding=self.binding, user=self.user))
+        plan.append(in_memory_stage(FlowExecutorView))
+        plan.context[PLAN_CONTEXT_PENDING_USER] = self.user
+        plan.context["nested"] = {"users": [self.user, get_anonymous_user()]}
+        return plan
+
+    def test_round_trip(self):
+        """Test plans are loaded lazily and with one query per model"""
+        pickled = dumps(self._plan())
+        with self.assertNumQueries(0):
+            plan = loads(pickled)  # nosec
+        self.assertEqual(plan.flow_pk, self.flow.pk.hex)
+        # Stage, stage binding and users
+        with self.assertNumQueries(3):
+            self.assertEqual(plan.stages[0], self.stage)
+        self.assertIsInstance(plan.stages[0], DummyStage)
+        self.assertEqual(plan.stages[1].type, FlowExecutorView)
+        self.assertEqual(plan.markers[0].binding, self.binding)
+        self.assertEqual(plan.markers[0].user, self.user)
+        self.assertIsInstance(plan.markers[1], StageMarker)
+        self.assertEqual(plan.context[PLAN_CONTEXT_PENDING_USER], self.user)
+        self.assertEqual(
+            plan.context["nested"], {"users": [self.user, get_anonymous_user()]}
+        )
+
+    def test_size(self):
+        """Test encoded plans are smaller than pickled instances"""
+        plan = self._plan()
+        self.assertLess(len(dumps(plan)), len(dumps(plan.__dict__)))
+
+    def test_containers(self):
+        """Test container types are kept, and dataclasses are encoded"""
+        plan = self._plan()
+        plan.context["ordered"] = OrderedDict(user=self.user)
+        plan.context["default"] = defaultdict(list, users=[self.user])
+        plan.context["named"] = Named(user=self.user)
+        plan.context["params"] = Params(user=self.user)
+        self.assertIsInstance(
+            plan.encoded()["context"]["params"].attrs["user"], ModelRef
+        )
+        plan = loads(dumps(plan))  # nosec
+        self.assertIsInstance(plan.context["ordered"], OrderedDict)
+        self.assertIsInstance(plan.context["default"], defaultdict)
+        self.assertEqual(plan.context["default"]["users"], [self.user])
+        self.assertEqual(plan.context["named"], Named(user=self.user))
+        self.assertEqual(plan.context["params"], Params(user=self.user))
+
+    def test_deleted_stage(self):
+        """Test stages deleted since the plan was pickled are removed"""
+        pickled = dumps(self._plan())
+        self.stage.delete()
+        plan = loads(pickled)  # nosec
+        self.assertEqual(len(plan.stages), 1)
+        self.assertEqual(len(plan.markers), 1)
+
+    def test_legacy(self):
+        """Test plans pickled before encoding are still loaded"""
+        plan = FlowPlan.__new__(FlowPlan)
+        plan.__setstate__(
+            {"flow_pk": self.flow.pk.hex, "stages": [], "markers": [], "context": {}}
+        )
+        self.assertEqual(plan.flow_pk, self.flow.pk.hex)
+        self.assertEqual(plan.stages, [])
+
+    def test_unknown_version(self):
+        """Test plans with an unknown version are discarded"""
+        plan = FlowPlan.__new__(FlowPlan)
+        plan.__setstate__({"version": 0})
+        self.assertEqual(plan.flow_pk, "")
+        self.assertEqual(plan.stages, [])
+
+    def test_changed_since(self):
+        """Test plans are compared without being encoded again"""
+        plan = loads(dumps(self._plan()))  # nosec
+        state = plan.encoded()
+        with self.assertNumQueries(0):
+            self.assertFalse(plan.changed_since(state))
+        plan.context["foo"] = "bar"
+        self.assertTrue(plan.changed_since(state))
+        with patch("authentik.flows.planner.encode_plan") as encode_plan:
+            self.assertEqual(loads(dumps(plan)).context["foo"], "bar")  # nosec
+        encode_plan.assert_not_called()
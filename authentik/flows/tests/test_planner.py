@@ -12,7 +12,14 @@ from authentik.core.models import User
 from authentik.flows.exceptions import EmptyFlowException, FlowNonApplicableException
 from authentik.flows.markers import ReevaluateMarker, StageMarker
 from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding
-from authentik.flows.planner import PLAN_CONTEXT_PENDING_USER, FlowPlanner, cache_key
+from authentik.flows.planner import (
+    PLAN_CONTEXT_PENDING_USER,
+    FlowPlanner,
+    cache_key,
+    flow_generation,
+    invalidate_flow,
+    template_key,
+)
 from authentik.policies.dummy.models import DummyPolicy
 from authentik.policies.models import PolicyBinding
 from authentik.policies.types import PolicyResult
@@ -62,6 +69,9 @@ class TestFlowPlanner(TestCase):
             slug="test-empty",
             designation=FlowDesignation.AUTHENTICATION,
         )
+        PolicyBinding.objects.create(
+            target=flow, policy=DummyPolicy.objects.create(result=False), order=0
+        )
         request = self.request_factory.get(
             reverse("authentik_api:flow-executor", kwargs={"flow_slug": flow.slug}),
         )
@@ -106,9 +116,14 @@ class TestFlowPlanner(TestCase):
             slug="test-default-context",
             designation=FlowDesignation.AUTHENTICATION,
         )
-        FlowStageBinding.objects.create(
+        binding = FlowStageBinding.objects.create(
             target=flow, stage=DummyStage.objects.create(name="dummy"), order=0
         )
+        PolicyBinding.objects.create(
+            target=binding,
+            policy=DummyPolicy.objects.create(result=True, wait_min=0, wait_max=1),
+            order=0,
+        )
 
         user = User.objects.create(username="test-user")
         request = self.request_factory.get(
@@ -117,9 +132,82 @@ class TestFlowPlanner(TestCase):
         request.user = user
         planner = FlowPlanner(flow)
         planner.plan(request, default_context={PLAN_CONTEXT_PENDING_USER: user})
-        key = cache_key(flow, user)
+        key = cache_key(flow, user, flow_generation(flow))
         self.assertTrue(cache.get(key) is not None)
 
+    def test_planner_generation(self):
+        """Test plans are invalidated when stage bindings or their policies change"""
+        flow = Flow.objects.create(
+            name="test-generation",
+            slug="test-generation",
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        binding = FlowStageBinding.objects.create(
+            target=flow, stage=DummyStage.objects.create(name="dummy"), order=0
+        )
+        policy = DummyPolicy.objects.create(result=True, wait_min=0, wait_max=1)
+        PolicyBinding.objects.create(target=binding, policy=policy, order=0)
+        request = self.request_factory.get(
+            reverse("authentik_api:flow-executor", kwargs={"flow_slug": flow.slug}),
+        )
+        request.user = get_anonymous_user()
+
+        self.assertEqual(len(FlowPlanner(flow).plan(request).stages), 1)
+        generation = flow_generation(flow)
+        self.assertIsNotNone(cache.get(cache_key(flow, request.user, generation)))
+
+        policy.save()
+        self.assertEqual(flow_generation(flow), generation + 1)
+        FlowStageBinding.objects.create(
+            target=flow, stage=DummyStage.objects.create(name="dummy2"), order=1
+        )
+        self.assertEqual(flow_generation(flow), generation + 2)
+        self.assertEqual(len(FlowPlanner(flow).plan(request).stages), 2)
+
+    def test_planner_template_stale(self):
+        """Test templates built while the flow changed aren't served"""
+        flow = Flow.objects.create(
+            name="test-template-stale",
+            slug="test-template-stale",
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        generation = flow_generation(flow)
+        # Built before a change was committed, saved after it has been invalidated
+        stale = FlowPlanner(flow)._build_template(generation)
+        invalidate_flow(flow)
+        cache.set(template_key(flow), stale)
+        template, cached = FlowPlanner(flow)._get_template()
+        self.assertFalse(cached)
+        self.assertEqual(template.generation, generation + 1)
+
+    def test_planner_template(self):
+        """Test plans of flows without policies are built from the template"""
+        flow = Flow.objects.create(
+            name="test-template",
+            slug="test-template",
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        binding = FlowStageBinding.objects.create(
+            target=flow, stage=DummyStage.objects.create(name="dummy"), order=0
+        )
+        request = self.request_factory.get(
+            reverse("authentik_api:flow-executor", kwargs={"flow_slug": flow.slug}),
+        )
+        request.user = get_anonymous_user()
+        FlowPlanner(flow).plan(request)
+
+        request.user = User.objects.create(username="test-template")
+        cache_mock = Mock(wraps=cache)
+        with patch("authentik.flows.planner.cache", cache_mock), patch(
+            "authentik.flows.planner.PolicyEngine"
+        ) as engine, self.assertNumQueries(0):
+            plan = FlowPlanner(flow).plan(request)
+        engine.assert_not_called()
+        # Generation and template are read at once
+        self.assertEqual(cache_mock.get.call_count + cache_mock.get_many.call_count, 1)
+        cache_mock.set.assert_not_called()
+        self.assertEqual(plan.stages, [binding.stage])
+
     def test_planner_marker_reevaluate(self):
         """Test that the planner creates the proper marker"""
         flow = Flow.objects.create(
@@ -0,0 +1,60 @@
+"""flow registry tests"""
+from django.test import TestCase
+
+from authentik.flows.models import Flow, FlowDesignation
+from authentik.flows.registry import FLOW_REGISTRY
+from authentik.sources.oauth.models import OAuthSource
+from authentik.stages.dummy.models import DummyStage
+from authentik.stages.identification.models import IdentificationStage
+
+
+class TestFlowRegistry(TestCase):
+    """Test flow registry"""
+
+    def setUp(self):
+        self.flow = Flow.objects.create(
+            name="test-registry",
+            slug="test-registry",
+            designation=FlowDesignation.RECOVERY,
+        )
+
+    def test_flow(self):
+        """Test flow lookup and invalidation"""
+        self.assertEqual(FLOW_REGISTRY.flow(self.flow.slug), self.flow)
+        with self.assertNumQueries(0):
+            self.assertEqual(FLOW_REGISTRY.flow_by_pk(self.flow.pk), self.flow)
+            self.assertEqual(
+                FLOW_REGISTRY.flow_for_designation(
+                    FlowDesignation.RECOVERY
+                ).designation,
+                FlowDesignation.RECOVERY,
+            )
+        self.flow.slug = "test-registry-renamed"
+        self.flow.save()
+        self.assertIsNone(FLOW_REGISTRY.flow("test-registry"))
+        self.assertEqual(FLOW_REGISTRY.flow(self.flow.slug), self.flow)
+
+    def test_stages(self):
+        """Test stages are resolved to their subclass"""
+        stage = DummyStage.objects.create(name="dummy")
+        self.assertIsInstance(FLOW_REGISTRY.stages([stage.pk])[stage.pk], DummyStage)
+        with self.assertNumQueries(0):
+            FLOW_REGISTRY.stages([stage.pk])
+
+    def test_source_buttons(self):
+        """Test source buttons are invalidated when sources change"""
+        source = OAuthSource.objects.create(name="test", slug="test")
+        stage = IdentificationStage.objects.create(name="identification")
+        stage.sources.set([source])
+
+        def buttons():
+            return FLOW_REGISTRY.source_buttons(
+                stage, stage.sources.filter(enabled=True).select_subclasses()
+            )
+
+        self.assertEqual([button["name"] for button in buttons()], ["test"])
+        with self.assertNumQueries(0):
+            buttons()
+        source.name = "renamed"
+        source.save()
+        self.assertEqual([button["name"] for button in buttons()], ["renamed"])
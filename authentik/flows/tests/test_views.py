@@ -14,7 +14,12 @@ from authentik.flows.markers import ReevaluateMarker, StageMarker
 from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding
 from authentik.flows.planner import FlowPlan, FlowPlanner
 from authentik.flows.stage import PLAN_CONTEXT_PENDING_USER_IDENTIFIER, StageView
-from authentik.flows.views import NEXT_ARG_NAME, SESSION_KEY_PLAN, FlowExecutorView
+from authentik.flows.views import (
+    NEXT_ARG_NAME,
+    SESSION_KEY_GET,
+    SESSION_KEY_PLAN,
+    FlowExecutorView,
+)
 from authentik.lib.config import CONFIG
 from authentik.policies.dummy.models import DummyPolicy
 from authentik.policies.models import PolicyBinding
@@ -170,6 +175,33 @@ class TestFlowExecutor(TestCase):
         plan: FlowPlan = session[SESSION_KEY_PLAN]
         self.assertEqual(len(plan.stages), 1)
 
+    def test_session_write(self):
+        """Test the session is only written when the plan or query string changed"""
+        flow = Flow.objects.create(
+            name="test-session-write",
+            slug="test-session-write",
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        FlowStageBinding.objects.create(
+            target=flow, stage=DummyStage.objects.create(name="dummy"), order=0
+        )
+        exec_url = reverse(
+            "authentik_api:flow-executor", kwargs={"flow_slug": flow.slug}
+        )
+        writes = MagicMock()
+        inc = writes.labels.return_value.inc
+        with patch("authentik.flows.views.COUNTER_FLOWS_SESSION_WRITE", writes):
+            # New plan
+            self.client.get(exec_url, {"query": "foo=bar"})
+            self.assertEqual(inc.call_count, 1)
+            # Challenge re-rendered, nothing changed
+            self.client.get(exec_url, {"query": "foo=bar"})
+            self.assertEqual(inc.call_count, 1)
+            # Query string changed
+            self.client.get(exec_url, {"query": "foo=baz"})
+            self.assertEqual(inc.call_count, 2)
+        self.assertEqual(self.client.session[SESSION_KEY_GET]["foo"], "baz")
+
     @patch(
         "authentik.flows.views.to_stage_response",
         TO_STAGE_RESPONSE_MOCK,
@@ -0,0 +1,42 @@
+"""Flow test helpers"""
+from contextlib import contextmanager
+from typing import Iterator
+
+from django.test import TestCase
+
+from authentik.flows.signals import stage_executed
+from authentik.flows.stage import StageView
+from authentik.lib.instrumentation import Usage
+from authentik.lib.utils.reflection import class_to_path
+
+
+@contextmanager
+def stage_query_budget(
+    test: TestCase, budgets: dict[type[StageView], int]
+) -> Iterator[None]:
+    """Fail `test` when a stage view executed by the flow executor within the block
+    runs more database queries than the budget of its class, or when a stage view
+    with a budget isn't executed at all.
+
+        with stage_query_budget(self, {IdentificationStageView: 3}):
+            self.client.post(...)"""
+    executed: dict[type[StageView], int] = {}
+
+    # pylint: disable=unused-argument
+    def receiver(sender: type[StageView], usage: Usage, **_):
+        executed[sender] = max(executed.get(sender, 0), usage.queries)
+
+    stage_executed.connect(receiver)
+    try:
+        yield
+    finally:
+        stage_executed.disconnect(receiver)
+    for stage_view, budget in budgets.items():
+        path = class_to_path(stage_view)
+        if stage_view not in executed:
+            test.fail(f"{path} was not executed")
+        if executed[stage_view] > budget:
+            test.fail(
+                f"{path} ran {executed[stage_view]} queries, "
+                f"which exceeds its budget of {budget}"
+            )
@@ -1,12 +1,13 @@
 """authentik multi-stage authentication engine"""
+from contextlib import contextmanager
 from traceback import format_tb
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect
 from django.http.request import QueryDict
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import redirect
 from django.template.response import TemplateResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.clickjacking import xframe_options_sameorigin
@@ -24,7 +25,7 @@ from sentry_sdk import capture_exception
 from structlog.stdlib import BoundLogger, get_logger
 
 from authentik.core.models import USER_ATTRIBUTE_DEBUG
-from authentik.events.models import cleanse_dict
+from authentik.events.utils import cleanse_dict
 from authentik.flows.challenge import (
     AccessDeniedChallenge,
     Challenge,
@@ -43,6 +44,17 @@ from authentik.flows.planner import (
     FlowPlan,
     FlowPlanner,
 )
+from authentik.flows.registry import FLOW_REGISTRY
+from authentik.flows.signals import stage_executed
+from authentik.lib.instrumentation import (
+    COUNT_BUCKETS,
+    LABEL_FLOW_DESIGNATION,
+    LABEL_STAGE_TYPE,
+    Usage,
+    counter,
+    histogram,
+    track_usage,
+)
 from authentik.lib.utils.reflection import all_subclasses, class_to_path
 from authentik.lib.utils.urls import is_url_absolute, redirect_with_qs
 from authentik.tenants.models import Tenant
@@ -53,6 +65,32 @@ NEXT_ARG_NAME = "next"
 SESSION_KEY_PLAN = "authentik_flows_plan"
 SESSION_KEY_APPLICATION_PRE = "authentik_flows_application_pre"
 SESSION_KEY_GET = "authentik_flows_get"
+COUNTER_FLOWS_SESSION_WRITE = counter(
+    "authentik_flows_session_writes",
+    "Flow executor requests which wrote the session",
+    (LABEL_FLOW_DESIGNATION,),
+)
+HIST_FLOWS_STAGE_TIME = histogram(
+    "authentik_flows_stage_time",
+    "Duration of stage views handling a request",
+    (LABEL_STAGE_TYPE,),
+)
+HIST_FLOWS_STAGE_QUERIES = histogram(
+    "authentik_flows_stage_queries",
+    "Database queries of stage views handling a request",
+    (LABEL_STAGE_TYPE,),
+    buckets=COUNT_BUCKETS,
+)
+HIST_FLOWS_STAGE_REDIS = histogram(
+    "authentik_flows_stage_redis_commands",
+    "Redis commands of stage views handling a request",
+    (LABEL_STAGE_TYPE,),
+    buckets=COUNT_BUCKETS,
+)
+# Response headers with the resource usage of the stage view, only set in debug mode
+RESPONSE_HEADER_STAGE = "X-authentik-stage"
+RESPONSE_HEADER_STAGE_QUERIES = "X-authentik-stage-queries"
+RESPONSE_HEADER_STAGE_REDIS = "X-authentik-stage-redis"
 
 
 def challenge_types():
@@ -105,10 +143,17 @@ class FlowExecutorView(APIView):
     current_stage_view: View
 
     _logger: BoundLogger
+    # Encoded state of the plan loaded from the session, to detect changes
+    _plan_state: Optional[dict[str, Any]] = None
+    # Resource usage of the current stage view
+    _stage_usage: Optional[Usage] = None
 
     def setup(self, request: HttpRequest, flow_slug: str):
         super().setup(request, flow_slug=flow_slug)
-        self.flow = get_object_or_404(Flow.objects.select_related(), slug=flow_slug)
+        flow = FLOW_REGISTRY.flow(flow_slug)
+        if not flow:
+            raise Http404
+        self.flow = flow
         self._logger = get_logger().bind(flow_slug=flow_slug)
 
     def handle_invalid_flow(self, exc: BaseException) -> HttpResponse:
@@ -122,9 +167,32 @@ class FlowExecutorView(APIView):
 
     # pylint: disable=unused-argument
     def dispatch(self, request: HttpRequest, flow_slug: str) -> HttpResponse:
+        response = self._dispatch(request)
+        self._save_session()
+        return response
+
+    def _save_session(self):
+        """The session is only written when it was modified, which isn't the case
+        when a stage only changes the plan in-place. Compare the plan with its state
+        when it was loaded, so it's only written when it actually changed."""
+        session = self.request.session
+        if (
+            not session.modified
+            and self._plan_state is not None
+            and session.get(SESSION_KEY_PLAN) is self.plan
+            and self.plan.changed_since(self._plan_state)
+        ):
+            session.modified = True
+        if session.modified:
+            COUNTER_FLOWS_SESSION_WRITE.labels(
+                flow_designation=self.flow.designation
+            ).inc()
+
+    def _dispatch(self, request: HttpRequest) -> HttpResponse:
         # Early check if theres an active Plan for the current session
         if SESSION_KEY_PLAN in self.request.session:
             self.plan = self.request.session[SESSION_KEY_PLAN]
+            self._plan_state = self.plan.encoded()
             if self.plan.flow_pk != self.flow.pk.hex:
                 self._logger.warning(
                     "f(exec): Found existing plan for other flow, deleteing plan",
@@ -149,8 +217,11 @@ class FlowExecutorView(APIView):
                 # To match behaviour with loading an empty flow plan from cache,
                 # we don't show an error message here, but rather call _flow_done()
                 return self._flow_done()
-        # Initial flow request, check if we have an upstream query string passed in
-        request.session[SESSION_KEY_GET] = QueryDict(request.GET.get("query", ""))
+        # Initial flow request, check if we have an upstream query string passed in.
+        # Only set it when it changed, as setting it causes the session to be written
+        query = QueryDict(request.GET.get("query", ""))
+        if request.session.get(SESSION_KEY_GET) != query:
+            request.session[SESSION_KEY_GET] = query
         # We don't save the Plan after getting the next stage
         # as it hasn't been successfully passed yet
         next_stage = self.plan.next(self.request)
@@ -201,7 +272,8 @@ class FlowExecutorView(APIView):
             stage=self.current_stage,
         )
         try:
-            stage_response = self.current_stage_view.get(request, *args, **kwargs)
+            with self._track_stage():
+                stage_response = self.current_stage_view.get(request, *args, **kwargs)
             return to_stage_response(request, stage_response)
         except Exception as exc:  # pylint: disable=broad-except
             if settings.DEBUG or settings.TEST:
@@ -242,7 +314,8 @@ class FlowExecutorView(APIView):
             stage=self.current_stage,
         )
         try:
-            stage_response = self.current_stage_view.post(request, *args, **kwargs)
+            with self._track_stage():
+                stage_response = self.current_stage_view.post(request, *args, **kwargs)
             return to_stage_response(request, stage_response)
         except Exception as exc:  # pylint: disable=broad-except
             if settings.DEBUG or settings.TEST:
@@ -251,6 +324,37 @@ class FlowExecutorView(APIView):
             self._logger.warning(exc)
             return to_stage_response(request, FlowErrorResponse(request, exc))
 
+    @contextmanager
+    def _track_stage(self) -> Iterator[None]:
+        """Attribute database queries, redis commands and wall time to the current
+        stage view"""
+        stage_view_cls = self.current_stage_view.__class__
+        stage_type = class_to_path(stage_view_cls)
+        with track_usage() as usage:
+            yield
+        HIST_FLOWS_STAGE_TIME.labels(stage_type=stage_type).observe(usage.duration)
+        HIST_FLOWS_STAGE_QUERIES.labels(stage_type=stage_type).observe(usage.queries)
+        HIST_FLOWS_STAGE_REDIS.labels(stage_type=stage_type).observe(
+            usage.redis_commands
+        )
+        self._stage_usage = usage
+        stage_executed.send(sender=stage_view_cls, usage=usage)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if settings.DEBUG and self._stage_usage:
+            response[RESPONSE_HEADER_STAGE] = class_to_path(
+                self.current_stage_view.__class__
+            )
+            response[RESPONSE_HEADER_STAGE_QUERIES] = str(self._stage_usage.queries)
+            response[RESPONSE_HEADER_STAGE_REDIS] = str(
+                self._stage_usage.redis_commands
+            )
+            response[
+                "Server-Timing"
+            ] = f"stage;dur={self._stage_usage.duration * 1000:.2f}"
+        return response
+
     def _initiate_plan(self) -> FlowPlan:
         planner = FlowPlanner(self.flow)
         plan = planner.plan(self.request)
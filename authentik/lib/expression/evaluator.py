@@ -1,17 +1,80 @@
 """authentik expression policy evaluator"""
+import builtins
 import re
+from collections import OrderedDict
+from hashlib import sha256
 from textwrap import indent
+from threading import Lock
+from types import CodeType, FunctionType
 from typing import Any, Iterable, Optional
 
-from requests import Session
+from prometheus_client import Counter
 from rest_framework.serializers import ValidationError
-from sentry_sdk.hub import Hub
-from sentry_sdk.tracing import Span
 from structlog.stdlib import get_logger
 
 from authentik.core.models import User
+from authentik.lib.instrumentation import span
+from authentik.lib.utils.http import get_http_session
 
 LOGGER = get_logger()
+COUNTER_EXPRESSION_CACHE = Counter(
+    "authentik_expression_compile_cache",
+    "Lookups of compiled expressions",
+    ["result"],
+)
+
+
+class CompiledExpressionCache:
+    """Process-wide, bounded LRU of compiled expression handlers. Entries are keyed by
+    the hash of the expression source, the parameter names and the filename, so a changed
+    expression never uses stale code."""
+
+    max_size: int
+
+    _entries: OrderedDict[tuple[str, tuple[str, ...], str], CodeType]
+    _lock: Lock
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, tuple[str, ...], str]) -> Optional[CodeType]:
+        """Get compiled handler, mark it as recently used"""
+        with self._lock:
+            code = self._entries.get(key, None)
+            if code is None:
+                self.misses += 1
+                COUNTER_EXPRESSION_CACHE.labels(result="miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            COUNTER_EXPRESSION_CACHE.labels(result="hit").inc()
+            return code
+
+    def set(self, key: tuple[str, tuple[str, ...], str], code: CodeType):
+        """Save compiled handler, evicting the least recently used one if full"""
+        with self._lock:
+            self._entries[key] = code
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all compiled handlers. Not needed when an expression is changed, as
+        handlers are keyed by their source and old ones are evicted eventually."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+EXPRESSION_CACHE = CompiledExpressionCache(1024)
 
 
 class BaseEvaluator:
@@ -34,7 +97,7 @@ class BaseEvaluator:
             "ak_is_group_member": BaseEvaluator.expr_func_is_group_member,
             "ak_user_by": BaseEvaluator.expr_func_user_by,
             "ak_logger": get_logger(),
-            "requests": Session(),
+            "requests": get_http_session(),
         }
         self._context = {}
         self._filename = "BaseEvalautor"
@@ -72,31 +135,53 @@ class BaseEvaluator:
         full_expression += f"\nresult = handler({handler_signature})"
         return full_expression
 
+    def compile_handler(
+        self, expression_source: str, params: tuple[str, ...]
+    ) -> CodeType:
+        """Compile expression and return the code object of the wrapped handler.
+        Compiled handlers are cached, so each expression is only compiled once per process."""
+        key = (
+            sha256(expression_source.encode()).hexdigest(),
+            params,
+            self._filename,
+        )
+        code = EXPRESSION_CACHE.get(key)
+        if code:
+            return code
+        module = compile(
+            self.wrap_expression(expression_source, params),
+            self._filename,
+            "exec",
+        )
+        code = next(
+            const
+            for const in module.co_consts
+            if isinstance(const, CodeType) and const.co_name == "handler"
+        )
+        EXPRESSION_CACHE.set(key, code)
+        return code
+
     def evaluate(self, expression_source: str) -> Any:
         """Parse and evaluate expression. If the syntax is incorrect, a SyntaxError is raised.
         If any exception is raised during execution, it is raised.
         The result is returned without any type-checking."""
-        with Hub.current.start_span(op="lib.evaluator.evaluate") as span:
-            span: Span
-            span.set_data("expression", expression_source)
-            param_keys = self._context.keys()
+        with span("lib.evaluator.evaluate", detail=True) as evaluate_span:
+            if evaluate_span:
+                evaluate_span.set_data("expression", expression_source)
+            params = tuple(self._context.keys())
             try:
-                ast_obj = compile(
-                    self.wrap_expression(expression_source, param_keys),
-                    self._filename,
-                    "exec",
-                )
+                code = self.compile_handler(expression_source, params)
             except (SyntaxError, ValueError) as exc:
                 self.handle_error(exc, expression_source)
                 raise exc
+            # exec() used to add this implicitly, functions need it explicitly
+            self._globals.setdefault("__builtins__", builtins.__dict__)
             try:
-                _locals = self._context
-                # Yes this is an exec, yes it is potentially bad. Since we limit what variables are
-                # available here, and these policies can only be edited by admins, this is a risk
-                # we're willing to take.
-                # pylint: disable=exec-used
-                exec(ast_obj, self._globals, _locals)  # nosec # noqa
-                result = _locals["result"]
+                # Yes this runs arbitrary code, yes it is potentially bad. Since we limit what
+                # variables are available here, and these policies can only be edited by admins,
+                # this is a risk we're willing to take.
+                handler = FunctionType(code, self._globals)
+                result = handler(*self._context.values())
             except Exception as exc:
                 # So, this is a bit questionable. Essentially, we are edit the stacktrace
                 # so the user only sees information relevant to them
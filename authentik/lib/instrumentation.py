@@ -0,0 +1,178 @@
+"""Metrics and tracing for hot paths
+
+Metrics created here may only use labels from a fixed vocabulary, whose values are
+bounded by the number of models and choices, never by the number of users, objects or
+clients. Tracing spans are only created when the current trace is sampled, so their data
+is never computed otherwise."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from random import random
+from time import perf_counter
+from typing import Iterator, Optional
+
+from django.db import connection
+from django.db.models import Model
+from prometheus_client import Counter, Gauge, Histogram
+from redis import Redis
+from sentry_sdk import Hub
+from sentry_sdk.tracing import Span
+
+from authentik.lib.config import CONFIG
+
+LABEL_OBJECT_TYPE = "object_type"
+LABEL_POLICY_TYPE = "policy_type"
+LABEL_FLOW_DESIGNATION = "flow_designation"
+LABEL_STAGE_TYPE = "stage_type"
+LABEL_OUTCOME = "outcome"
+LABEL_ACTION = "action"
+LABEL_APP = "app"
+LABEL_OUTPOST = "outpost"
+LABEL_VERSION = "version"
+LABELS = (
+    LABEL_OBJECT_TYPE,
+    LABEL_POLICY_TYPE,
+    LABEL_FLOW_DESIGNATION,
+    LABEL_STAGE_TYPE,
+    LABEL_OUTCOME,
+    LABEL_ACTION,
+    LABEL_APP,
+    LABEL_OUTPOST,
+    LABEL_VERSION,
+)
+
+OUTCOME_PASS = "pass"
+OUTCOME_FAIL = "fail"
+OUTCOME_ERROR = "error"
+
+# Buckets for histograms of counts, like database queries per request
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _check_labels(labels: tuple[str, ...]):
+    for label in labels:
+        if label not in LABELS:
+            raise ValueError(f"Label '{label}' is not allowed, see LABELS")
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labels: tuple[str, ...],
+    buckets: tuple[float, ...] = Histogram.DEFAULT_BUCKETS,
+) -> Histogram:
+    """Create a histogram with bounded labels"""
+    _check_labels(labels)
+    return Histogram(name, documentation, labels, buckets=buckets)
+
+
+def counter(name: str, documentation: str, labels: tuple[str, ...]) -> Counter:
+    """Create a counter with bounded labels"""
+    _check_labels(labels)
+    return Counter(name, documentation, labels)
+
+
+def gauge(name: str, documentation: str, labels: tuple[str, ...]) -> Gauge:
+    """Create a gauge with bounded labels"""
+    _check_labels(labels)
+    return Gauge(name, documentation, labels)
+
+
+def object_type(obj: Optional[Model]) -> str:
+    """Label value for a model instance or class, `app_label.model_name`"""
+    if obj is None:
+        return ""
+    return f"{obj._meta.app_label}.{obj._meta.model_name}"
+
+
+def outcome(passing: bool) -> str:
+    """Label value for a boolean result"""
+    return OUTCOME_PASS if passing else OUTCOME_FAIL
+
+
+class Timer:
+    """Observe the duration of a block. Labels can be completed within the block, for
+    example with the outcome. Blocks which raise an exception get the error outcome."""
+
+    labels: dict[str, str]
+
+    def __init__(self, metric: Histogram, **labels: str):
+        self._metric = metric
+        self._start = 0.0
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        duration = perf_counter() - self._start
+        # pylint: disable=protected-access
+        for label in self._metric._labelnames:
+            if label == LABEL_OUTCOME and exc_type:
+                self.labels[label] = OUTCOME_ERROR
+            self.labels.setdefault(label, "")
+        self._metric.labels(**self.labels).observe(duration)
+
+
+def _detail_sampled() -> bool:
+    return random() < float(CONFIG.y("error_reporting.detail_sample_rate", 0.1))
+
+
+@contextmanager
+def span(op: str, detail: bool = False) -> Iterator[Optional[Span]]:
+    """Start a tracing span, only if the current trace is sampled. High-detail spans,
+    for example for every single policy, are additionally sampled with
+    `error_reporting.detail_sample_rate`. Yields None when no span is recorded, data
+    should only be computed and set when a span is yielded."""
+    parent = Hub.current.scope.span
+    if not parent or not parent.sampled or (detail and not _detail_sampled()):
+        yield None
+        return
+    with parent.start_child(op=op) as child:
+        yield child
+
+
+@dataclass
+class Usage:
+    """Database queries, redis commands and wall time of a block"""
+
+    queries: int = 0
+    redis_commands: int = 0
+    duration: float = 0
+    parent: Optional["Usage"] = None
+
+
+_USAGE: ContextVar[Optional[Usage]] = ContextVar("authentik_usage", default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[Usage]:
+    """Track the database queries, redis commands and wall time of a block. Usage of
+    nested blocks is included in the outer block."""
+    usage = Usage(parent=_USAGE.get())
+    token = _USAGE.set(usage)
+
+    def count_query(execute, sql, params, many, context):
+        usage.queries += 1
+        return execute(sql, params, many, context)
+
+    start = perf_counter()
+    try:
+        with connection.execute_wrapper(count_query):
+            yield usage
+    finally:
+        usage.duration = perf_counter() - start
+        _USAGE.reset(token)
+
+
+class UsageRedis(Redis):
+    """Redis client which counts commands for `track_usage`, configured as django-redis'
+    REDIS_CLIENT_CLASS. Commands sent within pipelines aren't counted."""
+
+    def execute_command(self, *args, **options):
+        usage = _USAGE.get()
+        while usage:
+            usage.redis_commands += 1
+            usage = usage.parent
+        return super().execute_command(*args, **options)
@@ -0,0 +1,44 @@
+"""Test Evaluator base functions"""
+from django.test import TestCase
+
+from authentik.lib.expression.evaluator import EXPRESSION_CACHE, BaseEvaluator
+
+
+class TestEvaluator(TestCase):
+    """Test Evaluator base functions"""
+
+    def setUp(self):
+        EXPRESSION_CACHE.clear()
+
+    def test_evaluate(self):
+        """Test evaluation with context"""
+        evaluator = BaseEvaluator()
+        evaluator._context = {"foo": 1, "bar": 2}
+        self.assertEqual(evaluator.evaluate("return foo + bar"), 3)
+
+    def test_compile_cache(self):
+        """Test that expressions are only compiled once"""
+        hits = EXPRESSION_CACHE.hits
+        for value in range(3):
+            evaluator = BaseEvaluator()
+            evaluator._context = {"foo": value}
+            self.assertEqual(evaluator.evaluate("return foo * 2"), value * 2)
+        self.assertEqual(len(EXPRESSION_CACHE), 1)
+        self.assertEqual(EXPRESSION_CACHE.hits, hits + 2)
+
+    def test_compile_cache_params(self):
+        """Test that different parameters are compiled separately"""
+        evaluator = BaseEvaluator()
+        evaluator._context = {"foo": 1}
+        self.assertEqual(evaluator.evaluate("return 1"), 1)
+        evaluator = BaseEvaluator()
+        evaluator._context = {"foo": 1, "bar": 2}
+        self.assertEqual(evaluator.evaluate("return 1"), 1)
+        self.assertEqual(len(EXPRESSION_CACHE), 2)
+
+    def test_syntax_error(self):
+        """Test that syntax errors are raised and not cached"""
+        evaluator = BaseEvaluator()
+        with self.assertRaises(SyntaxError):
+            evaluator.evaluate("return (")
+        self.assertEqual(len(EXPRESSION_CACHE), 0)
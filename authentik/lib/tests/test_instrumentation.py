@@ -0,0 +1,75 @@
+"""instrumentation tests"""
+from django.core.cache import cache
+from django.test import TestCase
+from prometheus_client import CollectorRegistry, Histogram
+
+from authentik.lib.instrumentation import (
+    LABEL_OBJECT_TYPE,
+    LABEL_OUTCOME,
+    OUTCOME_ERROR,
+    OUTCOME_PASS,
+    Timer,
+    histogram,
+    object_type,
+    span,
+    track_usage,
+)
+from authentik.policies.dummy.models import DummyPolicy
+
+
+class TestInstrumentation(TestCase):
+    """instrumentation tests"""
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.metric = Histogram(
+            "test_instrumentation",
+            "test",
+            (LABEL_OBJECT_TYPE, LABEL_OUTCOME),
+            registry=self.registry,
+        )
+
+    def _count(self, **labels: str) -> float:
+        return self.registry.get_sample_value("test_instrumentation_count", labels)
+
+    def test_unbounded_label(self):
+        """Test labels outside of the vocabulary are rejected"""
+        with self.assertRaises(ValueError):
+            histogram("test_instrumentation_user", "test", ("user",))
+
+    def test_object_type(self):
+        """Test object type label"""
+        self.assertEqual(
+            object_type(DummyPolicy()), "authentik_policies_dummy.dummypolicy"
+        )
+        self.assertEqual(object_type(None), "")
+
+    def test_timer(self):
+        """Test labels completed within the block"""
+        with Timer(self.metric, object_type="foo") as timer:
+            timer.labels[LABEL_OUTCOME] = OUTCOME_PASS
+        self.assertEqual(self._count(object_type="foo", outcome=OUTCOME_PASS), 1)
+
+    def test_timer_error(self):
+        """Test blocks which raise get the error outcome"""
+        with self.assertRaises(ValueError):
+            with Timer(self.metric):
+                raise ValueError()
+        self.assertEqual(self._count(object_type="", outcome=OUTCOME_ERROR), 1)
+
+    def test_span_not_sampled(self):
+        """Test no span is created without a sampled trace"""
+        with span("test") as test_span:
+            self.assertIsNone(test_span)
+
+    def test_track_usage(self):
+        """Test queries and redis commands are counted, including nested blocks"""
+        with track_usage() as outer:
+            DummyPolicy.objects.count()
+            with track_usage() as inner:
+                DummyPolicy.objects.count()
+                cache.get("test_track_usage")
+        self.assertEqual(outer.queries, 2)
+        self.assertEqual(inner.queries, 1)
+        self.assertEqual(outer.redis_commands, 1)
+        self.assertEqual(inner.redis_commands, 1)
@@ -0,0 +1,141 @@
+"""Test cache utils"""
+from base64 import b64encode
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.urls import reverse
+from django_redis import get_redis_connection
+from django_redis.cache import RedisCache
+from rest_framework.test import APITestCase
+
+from authentik.core.models import Application, User
+from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding
+from authentik.flows.planner import (
+    FlowPlanner,
+    flow_generation,
+    plan_index,
+    template_key,
+)
+from authentik.lib.utils.cache import (
+    HitCounter,
+    KeyCounter,
+    KeyIndex,
+    count_keys,
+    delete_keys,
+)
+from authentik.outposts.models import Outpost, OutpostState, OutpostType
+from authentik.policies.dummy.models import DummyPolicy
+from authentik.policies.models import PolicyBinding
+from authentik.providers.oauth2.generators import generate_client_id
+from authentik.stages.dummy.models import DummyStage
+
+
+def keys_used(*args, **kwargs):  # pragma: no cover
+    """Fail the test when KEYS is called"""
+    raise AssertionError("cache.keys() must not be used on request paths")
+
+
+class TestCacheUtils(APITestCase):
+    """Test cache utils"""
+
+    def test_key_index(self):
+        """Test KeyIndex"""
+        index = KeyIndex(generate_client_id())
+        cache.set("test_index_a", "a")
+        cache.set("test_index_b", "b")
+        index.add("test_index_a")
+        index.add("test_index_b")
+        self.assertEqual(index.size(), 2)
+        cache.delete("test_index_b")
+        self.assertEqual(index.get_many(), {"test_index_a": "a"})
+        self.assertEqual(index.members(), {"test_index_a"})
+        self.assertEqual(index.clear(), 1)
+        self.assertIsNone(cache.get("test_index_a"))
+        self.assertEqual(index.size(), 0)
+
+    def test_key_counter(self):
+        """Test KeyCounter"""
+        counter = KeyCounter(generate_client_id())
+        counter.add("test_counter_a", "test_counter_b")
+        counter.add("test_counter_a")
+        self.assertEqual(counter.count(), 2)
+        with patch("authentik.lib.utils.cache.time", return_value=0):
+            counter.add("test_counter_c", timeout=1)
+        self.assertEqual(counter.count(), 2)
+        counter.clear()
+        self.assertEqual(counter.count(), 0)
+
+    def test_hit_counter(self):
+        """Test HitCounter only writes to redis when read or after the interval"""
+        counter = HitCounter(generate_client_id())
+        with patch("authentik.lib.utils.cache.get_redis_connection") as redis:
+            counter.hit()
+            counter.hit()
+            counter.miss()
+        redis.assert_not_called()
+        self.assertEqual(counter.get(), (2, 1))
+        with patch("authentik.lib.utils.cache.HIT_FLUSH_INTERVAL", 0):
+            counter.miss()
+        self.assertEqual(get_redis_connection().hget(counter._key, "misses"), b"2")
+
+    def test_scan(self):
+        """Test SCAN based helpers"""
+        prefix = f"test_scan_{generate_client_id()}_"
+        for idx in range(5):
+            cache.set(f"{prefix}{idx}", idx)
+        self.assertEqual(count_keys(f"{prefix}*"), 5)
+        self.assertEqual(delete_keys(f"{prefix}*"), 5)
+        self.assertEqual(count_keys(f"{prefix}*"), 0)
+
+    @patch.object(RedisCache, "keys", keys_used)
+    def test_request_paths(self):
+        """Test that request paths don't use KEYS"""
+        user = User.objects.get(username="akadmin")
+        self.client.force_login(user)
+        Application.objects.create(name=generate_client_id(), slug=generate_client_id())
+        policy = DummyPolicy.objects.create(
+            name=generate_client_id(), result=True, wait_min=0, wait_max=1
+        )
+
+        response = self.client.get(reverse("authentik_api:application-list"))
+        self.assertEqual(response.status_code, 200)
+
+        flow = Flow.objects.create(
+            name=generate_client_id(),
+            slug=generate_client_id(),
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        # Only plans which depend on the user are cached per user
+        binding = FlowStageBinding.objects.create(
+            target=flow,
+            stage=DummyStage.objects.create(name=generate_client_id()),
+            order=0,
+        )
+        PolicyBinding.objects.create(target=binding, policy=policy, order=0)
+        request = RequestFactory().get("/")
+        request.user = user
+        FlowPlanner(flow).plan(request)
+        self.assertEqual(plan_index(flow, flow_generation(flow)).size(), 1)
+        self.assertIsNotNone(cache.get(template_key(flow)))
+        response = self.client.get(reverse("authentik_api:flow-list"))
+        self.assertEqual(response.status_code, 200)
+        flow.save()
+        self.assertEqual(plan_index(flow, flow_generation(flow)).size(), 0)
+        self.assertIsNone(cache.get(template_key(flow)))
+
+        outpost = Outpost.objects.create(
+            name=generate_client_id(), type=OutpostType.PROXY
+        )
+        state = OutpostState(uid=generate_client_id())
+        # pylint: disable=protected-access
+        state._outpost = outpost
+        state.save()
+        self.assertEqual([x.uid for x in outpost.state], [state.uid])
+        state.delete()
+        self.assertEqual(outpost.state, [])
+
+        creds = "Basic " + b64encode(f"monitor:{settings.SECRET_KEY}".encode()).decode()
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION=creds)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,75 @@
+"""Test outbound HTTP client"""
+from threading import BoundedSemaphore
+from unittest.mock import patch
+
+from django.test import TestCase
+from requests_mock import Mocker
+
+from authentik.lib.config import CONFIG
+from authentik.lib.utils.http import (
+    _OUTBOUND_LIMITS,
+    OutboundConcurrencyLimitError,
+    OutboundSession,
+    _metric_host,
+    get_http_session,
+)
+
+
+class TestOutboundHTTP(TestCase):
+    """Test outbound HTTP client"""
+
+    def tearDown(self):
+        _OUTBOUND_LIMITS.clear()
+
+    def test_default_timeout(self):
+        """Test default timeout is applied"""
+        with Mocker() as mocker, CONFIG.patch("outbound_http.timeout", 3):
+            mocker.get("https://goauthentik.io/", text="foo")
+            response = get_http_session().get("https://goauthentik.io/")
+            self.assertEqual(response.text, "foo")
+            self.assertEqual(mocker.last_request.timeout, 3.0)
+
+    def test_explicit_timeout(self):
+        """Test explicit timeout is kept"""
+        with Mocker() as mocker:
+            mocker.get("https://goauthentik.io/", text="foo")
+            get_http_session().get("https://goauthentik.io/", timeout=1)
+            self.assertEqual(mocker.last_request.timeout, 1)
+
+    def test_concurrency_limit(self):
+        """Test requests fail when too many requests to a host are in flight"""
+        limit = BoundedSemaphore(1)
+        limit.acquire()
+        _OUTBOUND_LIMITS["goauthentik.io"] = limit
+        with Mocker() as mocker:
+            mocker.get("https://goauthentik.io/", text="foo")
+            with self.assertRaises(OutboundConcurrencyLimitError):
+                get_http_session().get("https://goauthentik.io/", timeout=0.1)
+            self.assertFalse(mocker.called)
+
+    def test_adapter(self):
+        """Test the adapter is shared within a process, and not closed with a session"""
+        session = get_http_session()
+        adapter = session.get_adapter("https://goauthentik.io/")
+        self.assertIs(
+            get_http_session().get_adapter("https://goauthentik.io/"), adapter
+        )
+        with patch.object(adapter, "close") as close:
+            session.close()
+        close.assert_not_called()
+        with patch("authentik.lib.utils.http.getpid", return_value=-1):
+            forked = get_http_session().get_adapter("https://goauthentik.io/")
+        self.assertIsNot(forked, adapter)
+
+    def test_limits_bounded(self):
+        """Test only the most recently used hosts' limits are kept"""
+        with patch("authentik.lib.utils.http.LIMIT_HOSTS", 2):
+            for host in ("a", "b", "a", "c"):
+                OutboundSession._host_limit(host)
+        self.assertEqual(list(_OUTBOUND_LIMITS.keys()), ["a", "c"])
+
+    def test_metric_host(self):
+        """Test only configured hosts are labelled by their name"""
+        with CONFIG.patch("outbound_http.metric_hosts", "goauthentik.io"):
+            self.assertEqual(_metric_host("goauthentik.io"), "goauthentik.io")
+            self.assertEqual(_metric_host("example.com"), "other")
@@ -0,0 +1,243 @@
+"""Cache utilities which avoid KEYS"""
+from threading import Lock
+from time import monotonic, time
+from typing import Iterator, Optional
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from structlog.stdlib import get_logger
+
+LOGGER = get_logger()
+# How many keys are fetched per SCAN call and deleted per DEL call
+SCAN_BATCH_SIZE = 1000
+# How often hit counters are written to redis, in seconds
+HIT_FLUSH_INTERVAL = 10
+
+
+def iter_keys(pattern: str) -> Iterator[str]:
+    """Iterate over keys matching `pattern`. Uses SCAN instead of KEYS, so redis
+    isn't blocked while the keyspace is walked. Only use this in admin actions and
+    background tasks, request paths should use a `KeyIndex` or versioned keys."""
+    return cache.iter_keys(pattern, itersize=SCAN_BATCH_SIZE)
+
+
+def count_keys(pattern: str) -> int:
+    """Count keys matching `pattern`"""
+    return sum(1 for _ in iter_keys(pattern))
+
+
+def delete_keys(pattern: str) -> int:
+    """Delete keys matching `pattern` in batches and return count of deleted keys"""
+    total = 0
+    batch = []
+    for key in iter_keys(pattern):
+        batch.append(key)
+        if len(batch) >= SCAN_BATCH_SIZE:
+            cache.delete_many(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        cache.delete_many(batch)
+        total += len(batch)
+    return total
+
+
+def incr_version(key: str) -> int:
+    """Increment a generation counter, used to invalidate all keys derived from it at
+    once without having to find them."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key does not exist yet
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+class KeyIndex:
+    """Redis set which keeps track of cache keys belonging to a group, so they can be
+    listed and deleted without searching the keyspace."""
+
+    name: str
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @property
+    def _key(self) -> str:
+        return cache.make_key(f"index_{self.name}")
+
+    def add(self, member: str, timeout: Optional[int] = None):
+        """Add `member` to the index. When `timeout` is set, the index expires after
+        the last member has been added, matching the lifetime of the members."""
+        try:
+            pipeline = get_redis_connection().pipeline(transaction=False)
+            pipeline.sadd(self._key, member)
+            if timeout:
+                pipeline.expire(self._key, timeout)
+            pipeline.execute()
+        except RedisError as exc:
+            LOGGER.warning("Failed to update cache index", index=self.name, exc=exc)
+
+    def remove(self, *members: str):
+        """Remove `members` from the index"""
+        if not members:
+            return
+        try:
+            get_redis_connection().srem(self._key, *members)
+        except RedisError as exc:
+            LOGGER.warning("Failed to update cache index", index=self.name, exc=exc)
+
+    def members(self) -> set[str]:
+        """Get all members of the index"""
+        try:
+            return {
+                member.decode() for member in get_redis_connection().smembers(self._key)
+            }
+        except RedisError as exc:
+            LOGGER.warning("Failed to read cache index", index=self.name, exc=exc)
+            return set()
+
+    def size(self) -> int:
+        """Count members of the index"""
+        try:
+            return get_redis_connection().scard(self._key)
+        except RedisError as exc:
+            LOGGER.warning("Failed to read cache index", index=self.name, exc=exc)
+            return 0
+
+    def get_many(self) -> dict:
+        """Get the cached values of all members. Members whose values have expired
+        are removed from the index."""
+        members = self.members()
+        values = cache.get_many(members)
+        self.remove(*(members - values.keys()))
+        return values
+
+    def clear(self) -> int:
+        """Delete all members and the index itself, return count of deleted members"""
+        members = self.members()
+        cache.delete_many(members)
+        try:
+            get_redis_connection().delete(self._key)
+        except RedisError as exc:
+            LOGGER.warning("Failed to delete cache index", index=self.name, exc=exc)
+        return len(members)
+
+
+class KeyCounter:
+    """Redis sorted set of cache keys belonging to a group, scored by their expiry
+    time. Counting the keys which haven't expired yet doesn't have to walk the keyspace.
+    Keys which are deleted before they expire are counted until they would have
+    expired, unless they're removed."""
+
+    name: str
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @property
+    def _key(self) -> str:
+        return cache.make_key(f"counter_{self.name}")
+
+    def add(self, *members: str, timeout: Optional[int] = None):
+        """Add `members`, which expire after `timeout` seconds, defaulting to the cache's
+        default timeout. Expired members are removed at the same time."""
+        if not members:
+            return
+        timeout = timeout or cache.default_timeout
+        now = time()
+        try:
+            pipeline = get_redis_connection().pipeline(transaction=False)
+            pipeline.zadd(self._key, {member: now + timeout for member in members})
+            pipeline.zremrangebyscore(self._key, "-inf", now)
+            pipeline.execute()
+        except RedisError as exc:
+            LOGGER.warning("Failed to update key counter", counter=self.name, exc=exc)
+
+    def count(self) -> int:
+        """Count members which haven't expired yet"""
+        try:
+            return get_redis_connection().zcount(self._key, time(), "+inf")
+        except RedisError as exc:
+            LOGGER.warning("Failed to read key counter", counter=self.name, exc=exc)
+            return 0
+
+    def clear(self):
+        """Remove all members"""
+        try:
+            get_redis_connection().delete(self._key)
+        except RedisError as exc:
+            LOGGER.warning("Failed to clear key counter", counter=self.name, exc=exc)
+
+
+class _PendingHits:
+    """Hits and misses of all hit counters of this process which haven't been written
+    to redis yet"""
+
+    def __init__(self):
+        self.counts: dict[str, dict[str, int]] = {}
+        self.lock = Lock()
+        self.last_flush = monotonic()
+
+    def add(self, key: str, field: str):
+        """Count `field` of `key`, and write all counts when the interval has passed"""
+        with self.lock:
+            fields = self.counts.setdefault(key, {})
+            fields[field] = fields.get(field, 0) + 1
+            if monotonic() - self.last_flush < HIT_FLUSH_INTERVAL:
+                return
+        self.flush()
+
+    def flush(self):
+        """Write all counts to redis with a single round-trip"""
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            self.last_flush = monotonic()
+        if not counts:
+            return
+        try:
+            pipeline = get_redis_connection().pipeline(transaction=False)
+            for key, fields in counts.items():
+                for field, value in fields.items():
+                    pipeline.hincrby(key, field, value)
+            pipeline.execute()
+        except RedisError as exc:
+            LOGGER.warning("Failed to update hit counters", exc=exc)
+
+
+_PENDING_HITS = _PendingHits()
+
+
+class HitCounter:
+    """Redis hash counting hits and misses of a group of cache keys. Counts are kept in
+    memory and written at most every `HIT_FLUSH_INTERVAL` seconds, so counting doesn't
+    cost a redis command per lookup. Counts of other processes can lag behind by
+    that interval."""
+
+    name: str
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @property
+    def _key(self) -> str:
+        return cache.make_key(f"hits_{self.name}")
+
+    def hit(self):
+        """Count a cache hit"""
+        _PENDING_HITS.add(self._key, "hits")
+
+    def miss(self):
+        """Count a cache miss"""
+        _PENDING_HITS.add(self._key, "misses")
+
+    def get(self) -> tuple[int, int]:
+        """Get count of hits and misses, including this process' pending counts"""
+        _PENDING_HITS.flush()
+        try:
+            values = get_redis_connection().hgetall(self._key)
+        except RedisError as exc:
+            LOGGER.warning("Failed to read hit counter", counter=self.name, exc=exc)
+            return 0, 0
+        return int(values.get(b"hits", 0)), int(values.get(b"misses", 0))
@@ -1,11 +1,42 @@
 """http helpers"""
-from typing import Any, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getpid
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from typing import Any, Iterator, Optional
+from urllib.parse import urlparse
 
 from django.http import HttpRequest
+from prometheus_client import Counter, Histogram
+from requests import RequestException, Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from authentik import __version__
+from authentik.lib.config import CONFIG
 
 OUTPOST_REMOTE_IP_HEADER = "HTTP_X_AUTHENTIK_REMOTE_IP"
 USER_ATTRIBUTE_CAN_OVERRIDE_IP = "goauthentik.io/user/override-ips"
 DEFAULT_IP = "255.255.255.255"
+# Number of destination hosts concurrency limits are kept for
+LIMIT_HOSTS = 1000
+
+HIST_OUTBOUND_HTTP_DURATION = Histogram(
+    "authentik_outbound_http_duration",
+    "Duration of outbound HTTP requests",
+    ["host"],
+)
+COUNTER_OUTBOUND_HTTP_ERRORS = Counter(
+    "authentik_outbound_http_errors",
+    "Failed outbound HTTP requests",
+    ["host", "error"],
+)
+# Durations of outbound requests made in the current context, see track_outbound_time
+OUTBOUND_HTTP_TIME: ContextVar[Optional[list[float]]] = ContextVar(
+    "outbound_http_time", default=None
+)
 
 
 def _get_client_ip_from_meta(meta: dict[str, Any]) -> str:
@@ -47,3 +78,133 @@ def get_client_ip(request: Optional[HttpRequest]) -> str:
             return override
         return _get_client_ip_from_meta(request.META)
     return DEFAULT_IP
+
+
+class OutboundConcurrencyLimitError(RequestException):
+    """Raised when too many requests to the same host are in flight"""
+
+
+class OutboundHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with keep-alive connection pools per host and retries with backoff for
+    idempotent requests. A single instance is shared by all outbound sessions of a
+    process, see `_get_adapter`."""
+
+    def __init__(self):
+        super().__init__(
+            pool_connections=int(CONFIG.y("outbound_http.pool_hosts", 20)),
+            pool_maxsize=int(CONFIG.y("outbound_http.max_per_host", 10)),
+            max_retries=Retry(
+                total=int(CONFIG.y("outbound_http.retries", 3)),
+                backoff_factor=0.3,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+
+
+def _get_adapter() -> OutboundHTTPAdapter:
+    """Get the adapter of this process. Forked processes, like policy workers, create
+    their own, so they never share a kept-alive connection with their parent."""
+    global _OUTBOUND_ADAPTER, _OUTBOUND_ADAPTER_PID  # pylint: disable=global-statement
+    with _OUTBOUND_ADAPTER_LOCK:
+        if _OUTBOUND_ADAPTER_PID != getpid():
+            _OUTBOUND_ADAPTER = OutboundHTTPAdapter()
+            _OUTBOUND_ADAPTER_PID = getpid()
+        return _OUTBOUND_ADAPTER
+
+
+def _metric_host(host: str) -> str:
+    """Label for `host` in metrics. Expressions can make requests to any host, so only
+    configured hosts are labelled by their name."""
+    if host in CONFIG.y("outbound_http.metric_hosts", "").split(","):
+        return host
+    return "other"
+
+
+class OutboundSession(Session):
+    """requests Session for all outbound HTTP requests. Connection pools are shared between
+    all instances, requests have a default timeout, concurrent requests per host are limited
+    and latency and errors are recorded per destination host.
+
+    Sessions are cheap to create, use `get_http_session` to get a new one instead of sharing
+    it when headers are modified."""
+
+    def __init__(self):
+        super().__init__()
+        adapter = _get_adapter()
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.headers.update({"User-Agent": f"authentik {__version__}"})
+
+    def close(self):
+        """Close adapters mounted on this session only, the connection pools of the
+        shared adapter are kept for other sessions"""
+        for adapter in self.adapters.values():
+            if not isinstance(adapter, OutboundHTTPAdapter):
+                adapter.close()
+
+    @staticmethod
+    def _host_limit(host: str) -> BoundedSemaphore:
+        """Get the concurrency limit of `host`. Only the most recently used hosts are
+        kept, requests which are in flight to an evicted host still release theirs."""
+        with _OUTBOUND_LIMITS_LOCK:
+            if host in _OUTBOUND_LIMITS:
+                _OUTBOUND_LIMITS.move_to_end(host)
+                return _OUTBOUND_LIMITS[host]
+            limit = BoundedSemaphore(int(CONFIG.y("outbound_http.max_per_host", 10)))
+            _OUTBOUND_LIMITS[host] = limit
+            while len(_OUTBOUND_LIMITS) > LIMIT_HOSTS:
+                _OUTBOUND_LIMITS.popitem(last=False)
+            return limit
+
+    def request(self, method: str, url: str, *args, **kwargs) -> Response:
+        default_timeout = float(CONFIG.y("outbound_http.timeout", 10))
+        timeout = kwargs.setdefault("timeout", default_timeout)
+        host = urlparse(url).hostname or ""
+        label = _metric_host(host)
+        limit = self._host_limit(host)
+        # Don't pin our threads when a destination is stuck, fail instead
+        if not isinstance(timeout, (int, float)):
+            timeout = default_timeout
+        if not limit.acquire(timeout=timeout):
+            COUNTER_OUTBOUND_HTTP_ERRORS.labels(host=label, error="concurrency").inc()
+            raise OutboundConcurrencyLimitError(
+                f"Too many concurrent requests to {host}"
+            )
+        start = perf_counter()
+        try:
+            with HIST_OUTBOUND_HTTP_DURATION.labels(host=label).time():
+                return super().request(method, url, *args, **kwargs)
+        except RequestException as exc:
+            COUNTER_OUTBOUND_HTTP_ERRORS.labels(
+                host=label, error=exc.__class__.__name__
+            ).inc()
+            raise exc
+        finally:
+            limit.release()
+            durations = OUTBOUND_HTTP_TIME.get()
+            if durations is not None:
+                durations.append(perf_counter() - start)
+
+
+_OUTBOUND_ADAPTER: Optional[OutboundHTTPAdapter] = None
+_OUTBOUND_ADAPTER_PID = 0
+_OUTBOUND_ADAPTER_LOCK = Lock()
+_OUTBOUND_LIMITS: OrderedDict[str, BoundedSemaphore] = OrderedDict()
+_OUTBOUND_LIMITS_LOCK = Lock()
+
+
+@contextmanager
+def track_outbound_time() -> Iterator[list[float]]:
+    """Record the duration of all outbound requests made within the context"""
+    durations = []
+    token = OUTBOUND_HTTP_TIME.set(durations)
+    try:
+        yield durations
+    finally:
+        OUTBOUND_HTTP_TIME.reset(token)
+
+
+def get_http_session() -> OutboundSession:
+    """Get a new session for outbound HTTP requests"""
+    return OutboundSession()
@@ -8,19 +8,19 @@ from channels.exceptions import DenyConnection
 from dacite import from_dict
 from dacite.data import Data
 from guardian.shortcuts import get_objects_for_user
-from prometheus_client import Gauge
 from structlog.stdlib import get_logger
 
 from authentik.core.channels import AuthJsonConsumer
+from authentik.lib.instrumentation import LABEL_OUTPOST, LABEL_VERSION, gauge
 from authentik.outposts.models import OUTPOST_HELLO_INTERVAL, Outpost, OutpostState
 
-GAUGE_OUTPOSTS_CONNECTED = Gauge(
-    "authentik_outposts_connected", "Currently connected outposts", ["outpost", "uid"]
+GAUGE_OUTPOSTS_CONNECTED = gauge(
+    "authentik_outposts_connected", "Currently connected outposts", (LABEL_OUTPOST,)
 )
-GAUGE_OUTPOSTS_LAST_UPDATE = Gauge(
+GAUGE_OUTPOSTS_LAST_UPDATE = gauge(
     "authentik_outposts_last_update",
     "Last update from any outpost",
-    ["outpost", "uid", "version"],
+    (LABEL_OUTPOST, LABEL_VERSION),
 )
 
 LOGGER = get_logger()
@@ -80,10 +80,7 @@ class OutpostConsumer(AuthJsonConsumer):
             if self.channel_name in state.channel_ids:
                 state.channel_ids.remove(self.channel_name)
                 state.save()
-        GAUGE_OUTPOSTS_CONNECTED.labels(
-            outpost=self.outpost.name,
-            uid=self.last_uid,
-        ).dec()
+        GAUGE_OUTPOSTS_CONNECTED.labels(outpost=self.outpost.name).dec()
         LOGGER.debug(
             "removed outpost instance from cache",
             outpost=self.outpost,
@@ -104,10 +101,7 @@ class OutpostConsumer(AuthJsonConsumer):
         state.last_seen = datetime.now()
 
         if not self.first_msg:
-            GAUGE_OUTPOSTS_CONNECTED.labels(
-                outpost=self.outpost.name,
-                uid=self.last_uid,
-            ).inc()
+            GAUGE_OUTPOSTS_CONNECTED.labels(outpost=self.outpost.name).inc()
             self.first_msg = True
 
         if msg.instruction == WebsocketMessageInstruction.HELLO:
@@ -117,7 +111,6 @@ class OutpostConsumer(AuthJsonConsumer):
             return
         GAUGE_OUTPOSTS_LAST_UPDATE.labels(
             outpost=self.outpost.name,
-            uid=self.last_uid or "",
             version=state.version or "",
         ).set_to_current_time()
         state.save(timeout=OUTPOST_HELLO_INTERVAL * 1.5)
@@ -2,7 +2,7 @@
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from os import environ
-from typing import Iterable, Optional, Union
+from typing import Any, Iterable, Optional, Union
 from uuid import uuid4
 
 from dacite import from_dict
@@ -33,6 +33,7 @@ from authentik.crypto.models import CertificateKeyPair
 from authentik.lib.config import CONFIG
 from authentik.lib.models import InheritanceForeignKey
 from authentik.lib.sentry import SentryIgnoredException
+from authentik.lib.utils.cache import KeyIndex
 from authentik.lib.utils.http import USER_ATTRIBUTE_CAN_OVERRIDE_IP
 from authentik.outposts.controllers.k8s.utils import get_namespace
 from authentik.outposts.docker_tls import DockerInlineTLS
@@ -317,6 +318,11 @@ class Outpost(models.Model):
         """Key by which the outposts status is saved"""
         return f"outpost_{self.uuid.hex}_state"
 
+    @property
+    def state_index(self) -> KeyIndex:
+        """Index of the state keys of all instances of this outpost"""
+        return KeyIndex(self.state_cache_prefix)
+
     @property
     def state(self) -> list["OutpostState"]:
         """Get outpost's health status"""
@@ -437,21 +443,25 @@ class OutpostState:
     @staticmethod
     def for_outpost(outpost: Outpost) -> list["OutpostState"]:
         """Get all states for an outpost"""
-        keys = cache.keys(f"{outpost.state_cache_prefix}_*")
         states = []
-        for key in keys:
+        for key, data in outpost.state_index.get_many().items():
             instance_uid = key.replace(f"{outpost.state_cache_prefix}_", "")
-            states.append(OutpostState.for_instance_uid(outpost, instance_uid))
+            states.append(OutpostState._from_data(outpost, instance_uid, data))
         return states
 
     @staticmethod
     def for_instance_uid(outpost: Outpost, uid: str) -> "OutpostState":
         """Get state for a single instance"""
         key = f"{outpost.state_cache_prefix}_{uid}"
+        return OutpostState._from_data(outpost, uid, cache.get(key))
+
+    @staticmethod
+    def _from_data(outpost: Outpost, uid: str, data: Any) -> "OutpostState":
         default_data = {"uid": uid, "channel_ids": []}
-        data = cache.get(key, default_data)
+        if data is None:
+            data = default_data
         if isinstance(data, str):
-            cache.delete(key)
+            cache.delete(f"{outpost.state_cache_prefix}_{uid}")
             data = default_data
         state = from_dict(OutpostState, data)
         # pylint: disable=protected-access
@@ -461,9 +471,11 @@ class OutpostState:
     def save(self, timeout=OUTPOST_HELLO_INTERVAL):
         """Save current state to cache"""
         full_key = f"{self._outpost.state_cache_prefix}_{self.uid}"
+        self._outpost.state_index.add(full_key)
         return cache.set(full_key, asdict(self), timeout=timeout)
 
     def delete(self):
         """Manually delete from cache, used on channel disconnect"""
         full_key = f"{self._outpost.state_cache_prefix}_{self.uid}"
+        self._outpost.state_index.remove(full_key)
         cache.delete(full_key)
@@ -0,0 +1,77 @@
+"""Batch access check API"""
+from django.shortcuts import get_object_or_404
+from drf_spectacular.utils import OpenApiResponse, extend_schema
+from rest_framework.fields import IntegerField, ListField, UUIDField
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.throttling import UserRateThrottle
+from rest_framework.views import APIView
+
+from authentik.core.api.utils import PassiveSerializer
+from authentik.core.models import Application, User
+from authentik.policies.api.exec import PolicyTestResultSerializer
+from authentik.policies.engine import BatchPolicyEngine
+from authentik.policies.types import PolicyResult
+
+# Maximum number of objects which can be checked with a single request
+MAX_TARGETS = 500
+
+
+class BatchAccessRequestSerializer(PassiveSerializer):
+    """Applications to check access to"""
+
+    targets = ListField(child=UUIDField(), max_length=MAX_TARGETS)
+    for_user = IntegerField(required=False)
+
+
+class BatchAccessResultSerializer(PolicyTestResultSerializer):
+    """Access result for a single application"""
+
+    target = UUIDField()
+
+
+class BatchAccessThrottle(UserRateThrottle):
+    """Limit batch access checks per user, as each one can evaluate many policies"""
+
+    rate = "60/minute"
+
+
+class BatchAccessView(APIView):
+    """Check access to multiple applications at once"""
+
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [BatchAccessThrottle]
+
+    @extend_schema(
+        request=BatchAccessRequestSerializer(),
+        responses={
+            200: BatchAccessResultSerializer(many=True),
+            400: OpenApiResponse(description="Invalid targets"),
+            404: OpenApiResponse(description="for_user user not found"),
+        },
+    )
+    def post(self, request: Request) -> Response:
+        """Check access to multiple applications by their primary key. Targets which
+        don't exist or aren't applications are omitted from the response."""
+        data = BatchAccessRequestSerializer(data=request.data)
+        data.is_valid(raise_exception=True)
+        # If the current user is superuser, they can set `for_user`
+        for_user = request.user
+        if request.user.is_superuser and "for_user" in data.validated_data:
+            for_user = get_object_or_404(User, pk=data.validated_data["for_user"])
+        # Same as check_access, which this replaces for lists of applications. Other
+        # objects' policies can have side effects, like events or outbound requests
+        applications = list(
+            Application.objects.filter(pk__in=data.validated_data["targets"])
+        )
+        engine = BatchPolicyEngine(applications, for_user, request).build()
+        response = []
+        for pk, result in engine.results.items():
+            # Only superusers get to see the messages, same as check_access
+            if not request.user.is_superuser:
+                result = PolicyResult(result.passing)
+            response.append(
+                {"target": pk, "passing": result.passing, "messages": result.messages}
+            )
+        return Response(BatchAccessResultSerializer(response, many=True).data)
@@ -1,5 +1,12 @@
 """Serializer for policy execution"""
-from rest_framework.fields import BooleanField, CharField, JSONField, ListField
+from rest_framework.fields import (
+    BooleanField,
+    CharField,
+    FloatField,
+    IntegerField,
+    JSONField,
+    ListField,
+)
 from rest_framework.relations import PrimaryKeyRelatedField
 
 from authentik.core.api.utils import PassiveSerializer, is_dict
@@ -18,3 +25,21 @@ class PolicyTestResultSerializer(PassiveSerializer):
 
     passing = BooleanField()
     messages = ListField(child=CharField(), read_only=True)
+
+
+class BindingProfileSerializer(PassiveSerializer):
+    """Cost of a single binding's evaluation, durations are in seconds"""
+
+    binding = CharField()
+    source = CharField()
+    passing = BooleanField(allow_null=True)
+    wait = FloatField()
+    execution = FloatField()
+    queries = IntegerField()
+    http = FloatField()
+
+
+class PolicyExplainResultSerializer(PolicyTestResultSerializer):
+    """result of a policy test, with the cost of each binding"""
+
+    profile = BindingProfileSerializer(many=True, read_only=True)
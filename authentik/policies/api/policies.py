@@ -1,5 +1,4 @@
 """policy API Views"""
-from django.core.cache import cache
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiResponse, extend_schema
 from guardian.shortcuts import get_objects_for_user
@@ -13,14 +12,20 @@ from rest_framework.viewsets import GenericViewSet
 from structlog.stdlib import get_logger
 
 from authentik.api.decorators import permission_required
-from authentik.core.api.applications import user_app_cache_key
+from authentik.core.api.applications import invalidate_user_app_cache
 from authentik.core.api.utils import (
     CacheSerializer,
     MetaNameSerializer,
     TypeCreateSerializer,
 )
+from authentik.lib.utils.cache import delete_keys
 from authentik.lib.utils.reflection import all_subclasses
-from authentik.policies.api.exec import PolicyTestResultSerializer, PolicyTestSerializer
+from authentik.policies.api.exec import (
+    PolicyExplainResultSerializer,
+    PolicyTestResultSerializer,
+    PolicyTestSerializer,
+)
+from authentik.policies.engine import POLICY_CACHE_COUNTER
 from authentik.policies.models import Policy, PolicyBinding
 from authentik.policies.process import PolicyProcess
 from authentik.policies.types import PolicyRequest
@@ -119,7 +124,7 @@ class PolicyViewSet(
     @action(detail=False, pagination_class=None, filter_backends=[])
     def cache_info(self, request: Request) -> Response:
         """Info about cached policies"""
-        return Response(data={"count": len(cache.keys("policy_*"))})
+        return Response(data={"count": POLICY_CACHE_COUNTER.count()})
 
     @permission_required(None, ["authentik_policies.clear_policy_cache"])
     @extend_schema(
@@ -132,26 +137,15 @@ class PolicyViewSet(
     @action(detail=False, methods=["POST"])
     def cache_clear(self, request: Request) -> Response:
         """Clear policy cache"""
-        keys = cache.keys("policy_*")
-        cache.delete_many(keys)
-        LOGGER.debug("Cleared Policy cache", keys=len(keys))
+        total = delete_keys("policy_*")
+        POLICY_CACHE_COUNTER.clear()
+        LOGGER.debug("Cleared Policy cache", keys=total)
         # Also delete user application cache
-        keys = cache.keys(user_app_cache_key("*"))
-        cache.delete_many(keys)
+        invalidate_user_app_cache()
         return Response(status=204)
 
-    @permission_required("authentik_policies.view_policy")
-    @extend_schema(
-        request=PolicyTestSerializer(),
-        responses={
-            200: PolicyTestResultSerializer(),
-            400: OpenApiResponse(description="Invalid parameters"),
-        },
-    )
-    @action(detail=True, pagination_class=None, filter_backends=[], methods=["POST"])
-    # pylint: disable=unused-argument, invalid-name
-    def test(self, request: Request, pk: str) -> Response:
-        """Test policy"""
+    def _test(self, request: Request, profile: bool) -> Response:
+        """Execute policy for a user with context, optionally profiled"""
         policy = self.get_object()
         test_params = PolicyTestSerializer(data=request.data)
         if not test_params.is_valid():
@@ -166,10 +160,48 @@ class PolicyViewSet(
 
         p_request = PolicyRequest(users.first())
         p_request.debug = True
+        p_request.profile = profile
         p_request.set_http_request(self.request)
         p_request.context = test_params.validated_data.get("context", {})
 
         proc = PolicyProcess(PolicyBinding(policy=policy), p_request, None)
         result = proc.execute()
-        response = PolicyTestResultSerializer(result)
+        if profile:
+            response = PolicyExplainResultSerializer(
+                {
+                    "passing": result.passing,
+                    "messages": result.messages,
+                    "profile": [result.profile],
+                }
+            )
+        else:
+            response = PolicyTestResultSerializer(result)
         return Response(response.data)
+
+    @permission_required("authentik_policies.view_policy")
+    @extend_schema(
+        request=PolicyTestSerializer(),
+        responses={
+            200: PolicyTestResultSerializer(),
+            400: OpenApiResponse(description="Invalid parameters"),
+        },
+    )
+    @action(detail=True, pagination_class=None, filter_backends=[], methods=["POST"])
+    # pylint: disable=unused-argument, invalid-name
+    def test(self, request: Request, pk: str) -> Response:
+        """Test policy"""
+        return self._test(request, False)
+
+    @permission_required("authentik_policies.view_policy")
+    @extend_schema(
+        request=PolicyTestSerializer(),
+        responses={
+            200: PolicyExplainResultSerializer(),
+            400: OpenApiResponse(description="Invalid parameters"),
+        },
+    )
+    @action(detail=True, pagination_class=None, filter_backends=[], methods=["POST"])
+    # pylint: disable=unused-argument, invalid-name
+    def explain(self, request: Request, pk: str) -> Response:
+        """Test policy, and return the cost of its execution"""
+        return self._test(request, True)
@@ -1,36 +1,60 @@
 """authentik policy engine"""
+from dataclasses import asdict
 from multiprocessing import Pipe, current_process
-from multiprocessing.connection import Connection
-from typing import Iterator, Optional
+from multiprocessing.connection import Connection, wait
+from time import perf_counter
+from typing import Iterator, Optional, Union
+from uuid import UUID
 
 from django.core.cache import cache
 from django.http import HttpRequest
-from prometheus_client import Histogram
-from sentry_sdk.hub import Hub
-from sentry_sdk.tracing import Span
 from structlog.stdlib import BoundLogger, get_logger
 
 from authentik.core.models import User
+from authentik.lib.config import CONFIG
+from authentik.lib.instrumentation import (
+    LABEL_OBJECT_TYPE,
+    LABEL_OUTCOME,
+    Timer,
+    histogram,
+    object_type,
+    outcome,
+    span,
+)
+from authentik.lib.utils.cache import KeyCounter
+from authentik.policies.index import BINDING_INDEX
+from authentik.policies.memo import MemoKey, PolicyMemo, context_fingerprint
 from authentik.policies.models import (
     Policy,
     PolicyBinding,
     PolicyBindingModel,
     PolicyEngineMode,
 )
+from authentik.policies.pool import EXECUTOR_POOL, POLICY_POOL, PolicyTask, get_executor
 from authentik.policies.process import PolicyProcess, cache_key
+from authentik.policies.profiler import (
+    SOURCE_CACHE,
+    SOURCE_EVALUATED,
+    SOURCE_MEMO,
+    BindingProfile,
+    binding_label,
+    should_profile,
+)
 from authentik.policies.types import PolicyRequest, PolicyResult
 from authentik.root.monitoring import UpdatingGauge
 
 CURRENT_PROCESS = current_process()
+# Cached policy results, counted without walking the keyspace
+POLICY_CACHE_COUNTER = KeyCounter("policies")
 GAUGE_POLICIES_CACHED = UpdatingGauge(
     "authentik_policies_cached",
     "Cached Policies",
-    update_func=lambda: len(cache.keys("policy_*") or []),
+    update_func=POLICY_CACHE_COUNTER.count,
 )
-HIST_POLICIES_BUILD_TIME = Histogram(
+HIST_POLICIES_BUILD_TIME = histogram(
     "authentik_policies_build_time",
     "Execution times complete policy result to an object",
-    ["object_name", "object_type", "user"],
+    (LABEL_OBJECT_TYPE, LABEL_OUTCOME),
 )
 
 
@@ -41,6 +65,8 @@ class PolicyProcessInfo:
     connection: Connection
     result: Optional[PolicyResult]
     binding: PolicyBinding
+    # Set when the binding couldn't be evaluated, these results are not cached
+    failed: bool
 
     def __init__(
         self, process: PolicyProcess, connection: Connection, binding: PolicyBinding
@@ -49,6 +75,7 @@ class PolicyProcessInfo:
         self.connection = connection
         self.binding = binding
         self.result = None
+        self.failed = False
 
 
 class PolicyEngine:
@@ -57,6 +84,18 @@ class PolicyEngine:
     use_cache: bool
     request: PolicyRequest
 
+    # Stop evaluating as soon as one result decides the outcome
+    short_circuit: bool
+    # Evaluate cheap bindings (users, groups) before expensive policies
+    cheap_first: bool
+
+    # Bindings loaded by the caller, otherwise they're queried for the target
+    bindings: Optional[list[PolicyBinding]]
+    # Results shared between engines, defaults to the HTTP request's memo
+    memo: Optional[PolicyMemo]
+    # Cost of each binding, only recorded when request.profile is set
+    profile: list[BindingProfile]
+
     logger: BoundLogger
     mode: PolicyEngineMode
     # Allow objects with no policies attached to pass
@@ -65,8 +104,13 @@ class PolicyEngine:
     __pbm: PolicyBindingModel
     __cached_policies: list[PolicyResult]
     __processes: list[PolicyProcessInfo]
+    __pool_tasks: list[PolicyTask]
+    __memo_keys: dict[UUID, Optional[MemoKey]]
+    __profiles: dict[UUID, BindingProfile]
+    __dispatched: dict[UUID, float]
 
     __expected_result_count: int
+    __decided: bool
 
     def __init__(
         self, pbm: PolicyBindingModel, user: User, request: HttpRequest = None
@@ -83,18 +127,25 @@ class PolicyEngine:
         self.request.obj = pbm
         if request:
             self.request.set_http_request(request)
+            self.request.profile = should_profile(request)
         self.__cached_policies = []
         self.__processes = []
+        self.__pool_tasks = []
+        self.bindings = None
+        self.memo = None
+        self.__memo_keys = {}
+        self.profile = []
+        self.__profiles = {}
+        self.__dispatched = {}
         self.use_cache = True
+        self.short_circuit = True
+        self.cheap_first = CONFIG.y_bool("policies.cheap_first", False)
         self.__expected_result_count = 0
+        self.__decided = False
 
     def _iter_bindings(self) -> Iterator[PolicyBinding]:
         """Make sure all Policies are their respective classes"""
-        return (
-            PolicyBinding.objects.filter(target=self.__pbm, enabled=True)
-            .order_by("order")
-            .iterator()
-        )
+        return iter(BINDING_INDEX.get(self.__pbm))
 
     def _check_policy_type(self, policy: Policy):
         """Check policy type, make sure it's not the root class as that has no logic implemented"""
@@ -102,25 +153,157 @@ class PolicyEngine:
         if policy.__class__ == Policy:
             raise TypeError(f"Policy '{policy}' is root type")
 
+    def _use_pool(self) -> bool:
+        """Check if bindings should be sent to the policy worker pool. Daemonic processes
+        (for example celery workers) can't have child processes, so they always
+        evaluate bindings in-process."""
+        if CURRENT_PROCESS._config.get("daemon"):
+            return False
+        return get_executor() == EXECUTOR_POOL
+
+    def _submit_pool(self, binding: PolicyBinding) -> bool:
+        """Send binding to the worker pool, returns False if the pool can't take it.
+        When no worker is idle, the binding is evaluated in a forked process instead of
+        waiting for one."""
+        # Don't hold more workers than the pool has, otherwise we'd wait for ourselves
+        pending = [task for task in self.__pool_tasks if not task.done]
+        if len(pending) >= POLICY_POOL.size:
+            pending[0].result()
+        task = POLICY_POOL.submit(binding, self.request, 0)
+        if not task:
+            return False
+        self.__pool_tasks.append(task)
+        return True
+
+    def _is_decisive(self, result: PolicyResult) -> bool:
+        """Check if a single result already decides the outcome, in which case the
+        remaining bindings don't have to be evaluated"""
+        if not self.short_circuit:
+            return False
+        if self.mode == PolicyEngineMode.MODE_ANY:
+            return result.passing
+        if self.mode == PolicyEngineMode.MODE_ALL:
+            return not result.passing
+        return False
+
+    def _ordered_bindings(self) -> list[PolicyBinding]:
+        """Get all bindings, optionally with the cheapest bindings first"""
+        if self.bindings is not None:
+            bindings = list(self.bindings)
+        else:
+            bindings = list(self._iter_bindings())
+        if self.cheap_first:
+            # sort is stable, so bindings with the same cost keep their order
+            bindings.sort(key=lambda binding: binding.evaluation_cost)
+        return bindings
+
+    def _collect(self):
+        """Receive results from processes and pool tasks as they finish. As soon as a result
+        decides the outcome, outstanding evaluations are cancelled instead of waited for."""
+        pending: dict[Connection, Union[PolicyProcessInfo, PolicyTask]] = {}
+        deadlines: dict[Connection, float] = {}
+        for proc_info in self.__processes:
+            if proc_info.result is None:
+                pending[proc_info.connection] = proc_info
+                deadlines[proc_info.connection] = (
+                    perf_counter() + proc_info.binding.timeout
+                )
+        for task in self.__pool_tasks:
+            if not task.done:
+                pending[task.connection] = task
+                deadlines[task.connection] = task.deadline
+        while pending and not self.__decided:
+            timeout = max(min(deadlines.values()) - perf_counter(), 0)
+            for conn in wait(list(pending.keys()), timeout):
+                item = pending.pop(conn)
+                deadlines.pop(conn)
+                if isinstance(item, PolicyTask):
+                    result = item.result()
+                else:
+                    try:
+                        item.result = conn.recv()
+                    except EOFError:
+                        item.failed = True
+                        item.result = PolicyResult(False, "Policy process died")
+                        item.result.failed = True
+                        item.result.source_binding = item.binding
+                    result = item.result
+                if self._is_decisive(result):
+                    self.__decided = True
+                    break
+            # Processes which exceeded their binding's timeout are killed
+            for conn, deadline in list(deadlines.items()):
+                if deadline > perf_counter():
+                    continue
+                item = pending.pop(conn)
+                deadlines.pop(conn)
+                if isinstance(item, PolicyTask):
+                    result = item.result(0)
+                else:
+                    self.logger.warning("P_ENG: Policy timed out", binding=item.binding)
+                    item.process.terminate()
+                    item.failed = True
+                    item.result = PolicyResult(False, "Policy execution timed out")
+                    item.result.failed = True
+                    item.result.source_binding = item.binding
+                    result = item.result
+                if self._is_decisive(result):
+                    self.__decided = True
+        for item in pending.values():
+            self.logger.debug("P_ENG: Cancelling evaluation", binding=item.binding)
+            if isinstance(item, PolicyTask):
+                item.cancel()
+            else:
+                item.process.terminate()
+
     def build(self) -> "PolicyEngine":
         """Build wrapper which monitors performance"""
-        with Hub.current.start_span(
-            op="policy.engine.build"
-        ) as span, HIST_POLICIES_BUILD_TIME.labels(
-            object_name=self.__pbm,
-            object_type=f"{self.__pbm._meta.app_label}.{self.__pbm._meta.model_name}",
-            user=self.request.user,
-        ).time():
-            span: Span
-            span.set_data("pbm", self.__pbm)
-            span.set_data("request", self.request)
-            for binding in self._iter_bindings():
+        with span("policy.engine.build") as build_span, Timer(
+            HIST_POLICIES_BUILD_TIME, object_type=object_type(self.__pbm)
+        ) as timer:
+            if build_span:
+                build_span.set_data("pbm", self.__pbm)
+                build_span.set_data("request", self.request)
+            use_pool = self._use_pool()
+            bindings = self._ordered_bindings()
+            for binding in bindings:
+                self._check_policy_type(binding.policy)
+            # Fetch all cached results with a single round-trip
+            keys = {
+                binding.policy_binding_uuid: cache_key(binding, self.request)
+                for binding in bindings
+            }
+            cached_results = {}
+            if self.use_cache and keys:
+                cached_results = cache.get_many(keys.values())
+            # Results of identical evaluations earlier in this request
+            if not self.use_cache:
+                self.memo = None
+            elif not self.memo:
+                self.memo = PolicyMemo.for_request(self.request)
+            fingerprint = context_fingerprint(self.request.context) if self.memo else ""
+            for binding in bindings:
                 self.__expected_result_count += 1
 
-                self._check_policy_type(binding.policy)
-                key = cache_key(binding, self.request)
-                cached_policy = cache.get(key, None)
-                if cached_policy and self.use_cache:
+                memo_key = None
+                if self.memo:
+                    memo_key = PolicyMemo.key(binding, self.request, fingerprint)
+                    self.__memo_keys[binding.policy_binding_uuid] = memo_key
+                memoized = self.memo.get(memo_key, binding) if memo_key else None
+                if memoized:
+                    self.logger.debug(
+                        "P_ENG: Taking result from request memo", binding=binding
+                    )
+                    self.__cached_policies.append(memoized)
+                    self._profile_cached(binding, memoized, SOURCE_MEMO)
+                    if self._is_decisive(memoized):
+                        self.__decided = True
+                        break
+                    continue
+
+                key = keys[binding.policy_binding_uuid]
+                cached_policy = cached_results.get(key, None)
+                if cached_policy:
                     self.logger.debug(
                         "P_ENG: Taking result from cache",
                         binding=binding,
@@ -128,40 +311,125 @@ class PolicyEngine:
                         request=self.request,
                     )
                     self.__cached_policies.append(cached_policy)
+                    self._profile_cached(binding, cached_policy, SOURCE_CACHE)
+                    if memo_key:
+                        self.memo.set(memo_key, binding, cached_policy)
+                    if self._is_decisive(cached_policy):
+                        self.__decided = True
+                        break
                     continue
                 self.logger.debug(
                     "P_ENG: Evaluating policy", binding=binding, request=self.request
                 )
+                if self.request.profile:
+                    self.__dispatched[binding.policy_binding_uuid] = perf_counter()
+                if use_pool and self._submit_pool(binding):
+                    continue
                 our_end, task_end = Pipe(False)
                 task = PolicyProcess(binding, self.request, task_end)
                 task.daemon = False
                 self.logger.debug(
                     "P_ENG: Starting Process", binding=binding, request=self.request
                 )
+                proc_info = PolicyProcessInfo(
+                    process=task, connection=our_end, binding=binding
+                )
+                self.__processes.append(proc_info)
                 if not CURRENT_PROCESS._config.get("daemon"):
                     task.run()
+                    # The process ran in-line, so the result is already available
+                    proc_info.result = our_end.recv()
+                    if self._is_decisive(proc_info.result):
+                        self.__decided = True
+                        break
                 else:
                     task.start()
-                self.__processes.append(
-                    PolicyProcessInfo(process=task, connection=our_end, binding=binding)
-                )
-            # If all policies are cached, we have an empty list here.
-            for proc_info in self.__processes:
-                if proc_info.process.is_alive():
-                    proc_info.process.join(proc_info.binding.timeout)
-                # Only call .recv() if no result is saved, otherwise we just deadlock here
-                if not proc_info.result:
-                    proc_info.result = proc_info.connection.recv()
+            # If all policies are cached, there's nothing left to collect
+            self._collect()
+            self._cache_results()
+            if self.request.profile:
+                self._build_profile(bindings)
+            timer.labels[LABEL_OUTCOME] = outcome(self.result.passing)
             return self
 
+    def _profile_cached(
+        self, binding: PolicyBinding, result: PolicyResult, source: str
+    ):
+        if not self.request.profile:
+            return
+        self.__profiles[binding.policy_binding_uuid] = BindingProfile(
+            binding_label(binding), source, passing=result.passing
+        )
+
+    def _build_profile(self, bindings: list[PolicyBinding]):
+        """Collect the cost of all bindings which have been evaluated or taken from
+        the cache, in the order of the bindings"""
+        results: dict[UUID, PolicyResult] = {
+            x.binding.policy_binding_uuid: x.result
+            for x in self.__processes
+            if x.result
+        }
+        for task in self.__pool_tasks:
+            if task.done:
+                results[task.binding.policy_binding_uuid] = task.result()
+        for binding in bindings:
+            uuid = binding.policy_binding_uuid
+            profile = self.__profiles.get(uuid)
+            if not profile and uuid in results:
+                result = results[uuid]
+                # Results of bindings which timed out don't have a profile
+                profile = getattr(result, "profile", None) or BindingProfile(
+                    binding_label(binding), SOURCE_EVALUATED, passing=result.passing
+                )
+                if profile.started and uuid in self.__dispatched:
+                    profile.wait = max(profile.started - self.__dispatched[uuid], 0)
+            if profile:
+                self.profile.append(profile)
+        self.logger.info(
+            "P_ENG: Profile",
+            pbm=self.__pbm,
+            profile=[asdict(profile) for profile in self.profile],
+        )
+
+    def _evaluated_results(self) -> Iterator[tuple[PolicyBinding, PolicyResult]]:
+        """Freshly evaluated results which completed without timing out or crashing"""
+        for proc_info in self.__processes:
+            if (
+                proc_info.result
+                and not proc_info.failed
+                and not proc_info.result.failed
+            ):
+                yield proc_info.binding, proc_info.result
+        for task in self.__pool_tasks:
+            if task.done and not task.failed and not task.result().failed:
+                yield task.binding, task.result()
+
+    def _cache_results(self):
+        """Write all freshly evaluated results to the request memo, and to the cache
+        with a single round-trip"""
+        if self.request.debug:
+            return
+        results = {}
+        for binding, result in self._evaluated_results():
+            results[cache_key(binding, self.request)] = result
+            memo_key = self.__memo_keys.get(binding.policy_binding_uuid)
+            if memo_key:
+                self.memo.set(memo_key, binding, result)
+        if not results:
+            return
+        cache.set_many(results)
+        POLICY_CACHE_COUNTER.add(*results.keys())
+
     @property
     def result(self) -> PolicyResult:
         """Get policy-checking result"""
         process_results: list[PolicyResult] = [
             x.result for x in self.__processes if x.result
-        ]
+        ] + [x.result() for x in self.__pool_tasks if x.done]
         all_results = list(process_results + self.__cached_policies)
-        if len(all_results) < self.__expected_result_count:  # pragma: no cover
+        if (
+            len(all_results) < self.__expected_result_count and not self.__decided
+        ):  # pragma: no cover
             raise AssertionError("Got less results than polices")
         # No results, no policies attached -> passing
         if len(all_results) == 0:
@@ -180,3 +448,70 @@ class PolicyEngine:
     def passing(self) -> bool:
         """Only get true/false if user passes"""
         return self.result.passing
+
+
+class BatchPolicyEngine:
+    """Evaluate a user's access to multiple objects at once.
+
+    Bindings of all targets are loaded with a single query. Policies which are bound to
+    multiple targets are evaluated once, concurrently, before the targets are
+    evaluated with their results shared through a PolicyMemo."""
+
+    user: User
+    results: dict[UUID, PolicyResult]
+
+    __pbms: list[PolicyBindingModel]
+    __http_request: Optional[HttpRequest]
+
+    def __init__(
+        self,
+        pbms: list[PolicyBindingModel],
+        user: User,
+        request: HttpRequest = None,
+    ):
+        self.user = user
+        self.results = {}
+        self.__pbms = pbms
+        self.__http_request = request
+
+    def _load_bindings(self) -> dict[UUID, list[PolicyBinding]]:
+        """Load bindings of all targets, with their policies resolved to subclasses"""
+        return BINDING_INDEX.get_many(self.__pbms)
+
+    def _engine(self, pbm: PolicyBindingModel, memo: Optional[PolicyMemo]):
+        engine = PolicyEngine(pbm, self.user, self.__http_request)
+        engine.memo = memo
+        return engine
+
+    def build(self) -> "BatchPolicyEngine":
+        """Evaluate all targets, results are saved in `results` by the target's
+        `pbm_uuid`"""
+        if not self.__pbms:
+            return self
+        bindings = self._load_bindings()
+        # Every policy which can be shared between targets is evaluated once,
+        # all of them at the same time
+        shared: dict[UUID, PolicyBinding] = {}
+        for target_bindings in bindings.values():
+            for binding in target_bindings:
+                policy = binding.policy
+                if (
+                    policy
+                    and policy.target_independent
+                    and not policy.execution_logging
+                ):
+                    shared.setdefault(policy.pk, binding)
+        prefetch = self._engine(self.__pbms[0], None)
+        # Share results with other engines in the same HTTP request, if there is one
+        memo = PolicyMemo.for_request(prefetch.request) or PolicyMemo()
+        if shared:
+            prefetch.memo = memo
+            prefetch.bindings = list(shared.values())
+            prefetch.short_circuit = False
+            prefetch.build()
+        for pbm in self.__pbms:
+            engine = self._engine(pbm, memo)
+            engine.bindings = bindings[pbm.pbm_uuid]
+            engine.build()
+            self.results[pbm.pbm_uuid] = engine.result
+        return self
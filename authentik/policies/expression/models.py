@@ -1,4 +1,7 @@
 """authentik expression Policy Models"""
+import ast
+from functools import lru_cache
+
 from django.db import models
 from django.utils.translation import gettext as _
 from rest_framework.serializers import BaseSerializer
@@ -7,12 +10,48 @@ from authentik.policies.expression.evaluator import PolicyEvaluator
 from authentik.policies.models import Policy
 from authentik.policies.types import PolicyRequest, PolicyResult
 
+# Builtins which can access attributes by a computed name
+DYNAMIC_ACCESS = {"getattr", "vars", "eval", "exec", "compile", "globals", "locals"}
+
+
+@lru_cache(maxsize=1024)
+def is_target_independent(expression: str) -> bool:
+    """Check if `expression` can't read the checked object. The object is only
+    reachable through `request`, so expressions may only use attributes of `request`
+    other than `obj`, and mustn't access attributes by a computed name. Expressions
+    which can't be parsed are treated as dependent."""
+    try:
+        tree = ast.parse(expression)
+    except (SyntaxError, ValueError):
+        return False
+    # `request` is allowed as the value of an attribute access
+    allowed = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute):
+            if node.attr == "obj" or node.attr.startswith("__"):
+                return False
+            allowed.add(id(node.value))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id in ("obj", *DYNAMIC_ACCESS):
+                return False
+            if node.id == "request" and id(node) not in allowed:
+                return False
+    return True
+
 
 class ExpressionPolicy(Policy):
     """Execute arbitrary Python code to implement custom checks and validation."""
 
     expression = models.TextField()
 
+    evaluation_cost = 50
+
+    @property
+    def target_independent(self) -> bool:
+        # Expressions which can't read the checked object can be shared
+        return is_target_independent(self.expression)
+
     @property
     def serializer(self) -> BaseSerializer:
         from authentik.policies.expression.api import ExpressionPolicySerializer
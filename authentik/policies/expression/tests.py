@@ -4,10 +4,11 @@ from guardian.shortcuts import get_anonymous_user
 from rest_framework.serializers import ValidationError
 from rest_framework.test import APITestCase
 
+from authentik.lib.expression.evaluator import EXPRESSION_CACHE
 from authentik.policies.exceptions import PolicyException
 from authentik.policies.expression.api import ExpressionPolicySerializer
 from authentik.policies.expression.evaluator import PolicyEvaluator
-from authentik.policies.expression.models import ExpressionPolicy
+from authentik.policies.expression.models import ExpressionPolicy, is_target_independent
 from authentik.policies.types import PolicyRequest
 
 
@@ -25,6 +26,26 @@ class TestEvaluator(TestCase):
         result = policy.passes(request)
         self.assertTrue(result.passing)
 
+    def test_changed(self):
+        """Test changed expressions are evaluated without clearing compiled ones"""
+        policy = ExpressionPolicy.objects.create(name="test", expression="return True")
+        request = PolicyRequest(get_anonymous_user())
+        self.assertTrue(policy.passes(request).passing)
+        cached = len(EXPRESSION_CACHE)
+        policy.expression = "return False"
+        policy.save()
+        self.assertEqual(len(EXPRESSION_CACHE), cached)
+        self.assertFalse(policy.passes(request).passing)
+
+    def test_target_independent(self):
+        """Test expressions which can read the checked object aren't shared"""
+        self.assertTrue(is_target_independent("return request.user.is_superuser"))
+        self.assertFalse(is_target_independent("return request.obj is not None"))
+        self.assertFalse(is_target_independent("return getattr(request, 'o' + 'bj')"))
+        self.assertFalse(is_target_independent("return helper(request)"))
+        self.assertFalse(is_target_independent("return request.__dict__['obj']"))
+        self.assertFalse(is_target_independent("return ("))
+
     def test_valid(self):
         """test simple value expression"""
         template = "return True"
@@ -0,0 +1,92 @@
+"""HaveIBeenPwned offline index"""
+from mmap import ACCESS_READ, mmap
+from os import stat
+from struct import Struct
+from threading import Lock
+from typing import IO, Iterable, Optional
+
+from structlog.stdlib import get_logger
+
+LOGGER = get_logger()
+
+# Each record is the binary SHA1 hash followed by the count as unsigned 32-bit integer.
+# Records are sorted by hash, so lookups are a binary search over the memory-mapped file.
+RECORD = Struct(">20sI")
+
+
+class HIBPIndex:
+    """Memory-mapped, sorted index of SHA1 hashes built from the downloadable HIBP dump"""
+
+    path: str
+
+    _file: IO[bytes]
+    _map: mmap
+    _records: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")  # pylint: disable=consider-using-with
+        self._map = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+        self._records = len(self._map) // RECORD.size
+
+    def count(self, sha1_hex: str) -> int:
+        """Get how often a password with the hash `sha1_hex` has been seen, 0 if never"""
+        needle = bytes.fromhex(sha1_hex)
+        low, high = 0, self._records
+        while low < high:
+            middle = (low + high) // 2
+            digest, count = RECORD.unpack_from(self._map, middle * RECORD.size)
+            if digest == needle:
+                return count
+            if digest < needle:
+                low = middle + 1
+            else:
+                high = middle
+        return 0
+
+    def close(self):
+        """Unmap and close the index file"""
+        self._map.close()
+        self._file.close()
+
+
+def build_index(lines: Iterable[str], output: IO[bytes]) -> int:
+    """Convert lines of `HASH:COUNT` (the "ordered by hash" SHA1 dump) into the binary index.
+    Returns the number of records written. Raises ValueError when the input isn't sorted."""
+    last = b""
+    written = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        full_hash, _, count = line.partition(":")
+        digest = bytes.fromhex(full_hash)
+        if digest <= last:
+            raise ValueError(
+                f"Input is not sorted by hash at line {written + 1}, "
+                "use the dump ordered by hash"
+            )
+        output.write(RECORD.pack(digest, int(count or 0)))
+        last = digest
+        written += 1
+    return written
+
+
+_INDEX: Optional[HIBPIndex] = None
+_INDEX_MTIME = 0.0
+_INDEX_LOCK = Lock()
+
+
+def get_index(path: str) -> HIBPIndex:
+    """Get the process-wide index for `path`, re-opened when the file is replaced.
+    Raises OSError when the file can't be opened."""
+    global _INDEX, _INDEX_MTIME  # pylint: disable=global-statement
+    mtime = stat(path).st_mtime
+    with _INDEX_LOCK:
+        if not _INDEX or _INDEX.path != path or _INDEX_MTIME != mtime:
+            # The previous index isn't closed, as other threads might still be reading
+            # it. It's unmapped when it's garbage collected.
+            _INDEX = HIBPIndex(path)
+            _INDEX_MTIME = mtime
+            LOGGER.info("Loaded HIBP index", path=path)
+        return _INDEX
@@ -0,0 +1,26 @@
+"""Build HaveIBeenPwned offline index"""
+from django.core.management.base import BaseCommand, CommandError
+
+from authentik.policies.hibp.index import build_index
+
+
+class Command(BaseCommand):  # pragma: no cover
+    """Build the offline index for HaveIBeenPwned policies from the SHA1 dump
+    (the version ordered by hash), available at https://haveibeenpwned.com/Passwords"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source", type=str, help="Extracted SHA1 dump, ordered by hash"
+        )
+        parser.add_argument("output", type=str, help="Path to write the index to")
+
+    def handle(self, *args, **options):
+        """Build HaveIBeenPwned offline index"""
+        with open(options["source"], "r", encoding="utf-8-sig") as source, open(
+            options["output"], "wb"
+        ) as output:
+            try:
+                written = build_index(source, output)
+            except ValueError as exc:
+                raise CommandError(str(exc)) from exc
+        self.stdout.write(f"Wrote {written} hashes to {options['output']}")
@@ -1,16 +1,22 @@
 """authentik HIBP Models"""
 from hashlib import sha1
 
+from django.core.cache import cache
 from django.db import models
 from django.utils.translation import gettext as _
-from requests import get
+from requests import RequestException
 from rest_framework.serializers import BaseSerializer
 from structlog.stdlib import get_logger
 
+from authentik.lib.config import CONFIG
+from authentik.lib.utils.http import get_http_session
+from authentik.policies.exceptions import PolicyException
+from authentik.policies.hibp.index import get_index
 from authentik.policies.models import Policy, PolicyResult
 from authentik.policies.types import PolicyRequest
 
 LOGGER = get_logger()
+CACHE_KEY_PREFIX = "hibp_range_"
 
 
 class HaveIBeenPwendPolicy(Policy):
@@ -26,6 +32,9 @@ class HaveIBeenPwendPolicy(Policy):
 
     allowed_count = models.IntegerField(default=0)
 
+    # Makes a request to the HIBP API when the range isn't cached
+    evaluation_cost = 100
+
     @property
     def serializer(self) -> BaseSerializer:
         from authentik.policies.hibp.api import HaveIBeenPwendPolicySerializer
@@ -36,6 +45,30 @@ class HaveIBeenPwendPolicy(Policy):
     def component(self) -> str:
         return "ak-policy-hibp-form"
 
+    @staticmethod
+    def get_range(prefix: str) -> dict[str, int]:
+        """Get all hash suffixes and their counts for the 5-character `prefix` from the HIBP
+        range API. Ranges are cached, so repeated prefixes don't cause a request."""
+        key = f"{CACHE_KEY_PREFIX}{prefix}"
+        suffixes = cache.get(key, None)
+        if suffixes is not None:
+            return suffixes
+        try:
+            response = get_http_session().get(
+                f"https://api.pwnedpasswords.com/range/{prefix}"
+            )
+            response.raise_for_status()
+        except RequestException as exc:
+            raise PolicyException(exc) from exc
+        suffixes = {}
+        for line in response.text.splitlines():
+            suffix, _, count = line.partition(":")
+            if not count:
+                continue
+            suffixes[suffix.lower()] = int(count)
+        cache.set(key, suffixes, int(CONFIG.y("policies.hibp.cache_timeout", 86400)))
+        return suffixes
+
     def passes(self, request: PolicyRequest) -> PolicyResult:
         """Check if password is in HIBP DB. Hashes given Password with SHA1, uses the first 5
         characters of Password in request and checks if full hash is in response. Returns 0
@@ -50,13 +83,14 @@ class HaveIBeenPwendPolicy(Policy):
         password = request.context[self.password_field]
 
         pw_hash = sha1(password.encode("utf-8")).hexdigest()  # nosec
-        url = f"https://api.pwnedpasswords.com/range/{pw_hash[:5]}"
-        result = get(url).text
-        final_count = 0
-        for line in result.split("\r\n"):
-            full_hash, count = line.split(":")
-            if pw_hash[5:] == full_hash.lower():
-                final_count = int(count)
+        offline_index = CONFIG.y("policies.hibp.offline_index", "")
+        if offline_index:
+            try:
+                final_count = get_index(offline_index).count(pw_hash)
+            except (OSError, ValueError) as exc:
+                raise PolicyException(exc) from exc
+        else:
+            final_count = self.get_range(pw_hash[:5]).get(pw_hash[5:], 0)
         LOGGER.debug("got hibp result", count=final_count, hash=pw_hash[:5])
         if final_count > self.allowed_count:
             message = _(
@@ -1,8 +1,17 @@
 """HIBP Policy tests"""
+from hashlib import sha1
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+
+from django.core.cache import cache
 from django.test import TestCase
 from guardian.shortcuts import get_anonymous_user
+from requests_mock import Mocker
 
-from authentik.policies.hibp.models import HaveIBeenPwendPolicy
+from authentik.lib.config import CONFIG
+from authentik.policies.exceptions import PolicyException
+from authentik.policies.hibp.index import build_index
+from authentik.policies.hibp.models import CACHE_KEY_PREFIX, HaveIBeenPwendPolicy
 from authentik.policies.types import PolicyRequest, PolicyResult
 from authentik.providers.oauth2.generators import generate_client_secret
 
@@ -41,3 +50,64 @@ class TestHIBPPolicy(TestCase):
         result: PolicyResult = policy.passes(request)
         self.assertTrue(result.passing)
         self.assertEqual(result.messages, tuple())
+
+    def test_range_cache(self):
+        """Test range responses are cached"""
+        policy = HaveIBeenPwendPolicy.objects.create(
+            name="test_range_cache",
+        )
+        pw_hash = sha1("password".encode("utf-8")).hexdigest().upper()  # nosec
+        cache.delete(f"{CACHE_KEY_PREFIX}{pw_hash[:5].lower()}")
+        request = PolicyRequest(get_anonymous_user())
+        request.context["password"] = "password"
+        with Mocker() as mocker:
+            mocker.get(
+                f"https://api.pwnedpasswords.com/range/{pw_hash[:5].lower()}",
+                text=f"0018A45C4D1DEF81644B54AB7F969B88D65:1\r\n{pw_hash[5:]}:3",
+            )
+            self.assertFalse(policy.passes(request).passing)
+            self.assertFalse(policy.passes(request).passing)
+            self.assertEqual(mocker.call_count, 1)
+
+    def test_offline(self):
+        """Test offline index"""
+        policy = HaveIBeenPwendPolicy.objects.create(
+            name="test_offline",
+        )
+        hashes = sorted(
+            sha1(password.encode("utf-8")).hexdigest().upper()  # nosec
+            for password in ["password", "foo", "bar", "baz"]
+        )
+        with NamedTemporaryFile() as index:
+            build_index([f"{pw_hash}:2" for pw_hash in hashes], index)
+            index.flush()
+            with CONFIG.patch("policies.hibp.offline_index", index.name):
+                request = PolicyRequest(get_anonymous_user())
+                request.context["password"] = "password"
+                result: PolicyResult = policy.passes(request)
+                self.assertFalse(result.passing)
+                self.assertEqual(
+                    result.messages[0], "Password exists on 2 online lists."
+                )
+                request.context["password"] = generate_client_secret()
+                self.assertTrue(policy.passes(request).passing)
+
+    def test_offline_missing(self):
+        """Test offline index which doesn't exist"""
+        policy = HaveIBeenPwendPolicy.objects.create(
+            name="test_offline_missing",
+        )
+        request = PolicyRequest(get_anonymous_user())
+        request.context["password"] = "password"
+        with CONFIG.patch("policies.hibp.offline_index", "/non-existent/hibp.bin"):
+            with self.assertRaises(PolicyException):
+                policy.passes(request)
+
+    def test_offline_unsorted(self):
+        """Test building an index from unsorted input"""
+        hashes = sorted(
+            sha1(password.encode("utf-8")).hexdigest()  # nosec
+            for password in ["foo", "bar"]
+        )
+        with self.assertRaises(ValueError):
+            build_index([f"{pw_hash}:1" for pw_hash in reversed(hashes)], BytesIO())
@@ -0,0 +1,79 @@
+"""Process-local index of policy bindings"""
+from threading import Lock
+from typing import Iterable, Optional
+from uuid import UUID
+
+from django.core.cache import cache
+from prometheus_client import Counter
+
+from authentik.lib.utils.cache import incr_version
+from authentik.policies.models import PolicyBinding, PolicyBindingModel
+
+CACHE_KEY_VERSION = "binding_index_version"
+COUNTER_BINDING_INDEX = Counter(
+    "authentik_policies_binding_index",
+    "Lookups of bindings in the process-local binding index",
+    ["result"],
+)
+
+
+class BindingIndex:
+    """Enabled bindings per target, ordered and with policies resolved to their subclass.
+
+    Each process keeps its own copy, which is discarded when the version in the cache
+    has changed. The version is incremented whenever a Policy or PolicyBinding is saved
+    or deleted, so all processes see changes on their next lookup."""
+
+    _bindings: dict[UUID, list[PolicyBinding]]
+    _version: Optional[int]
+    _lock: Lock
+
+    def __init__(self):
+        self._bindings = {}
+        self._version = None
+        self._lock = Lock()
+
+    def get(self, pbm: PolicyBindingModel) -> list[PolicyBinding]:
+        """Get enabled bindings of `pbm`, ordered by their order"""
+        return self.get_many([pbm])[pbm.pbm_uuid]
+
+    def get_many(
+        self, pbms: Iterable[PolicyBindingModel]
+    ) -> dict[UUID, list[PolicyBinding]]:
+        """Get enabled bindings of multiple targets by their `pbm_uuid`, missing targets
+        are loaded with a single query"""
+        version = cache.get(CACHE_KEY_VERSION, 0)
+        with self._lock:
+            if version != self._version:
+                self._bindings = {}
+                self._version = version
+            # Subclasses like Flow have their own primary key, bindings reference
+            # the PolicyBindingModel's
+            found = {pbm.pbm_uuid: self._bindings.get(pbm.pbm_uuid) for pbm in pbms}
+        missing = [pk for pk, bindings in found.items() if bindings is None]
+        COUNTER_BINDING_INDEX.labels(result="hit").inc(len(found) - len(missing))
+        if not missing:
+            return found
+        COUNTER_BINDING_INDEX.labels(result="miss").inc(len(missing))
+        loaded: dict[UUID, list[PolicyBinding]] = {pk: [] for pk in missing}
+        for binding in (
+            PolicyBinding.objects.filter(target__in=missing, enabled=True)
+            .order_by("order")
+            .select_related("group", "user")
+            # Uses the InheritanceForeignKey's queryset, which selects subclasses
+            .prefetch_related("policy")
+        ):
+            loaded[binding.target_id].append(binding)
+        with self._lock:
+            # Don't save bindings which were loaded while the version changed
+            if version == self._version:
+                self._bindings.update(loaded)
+        found.update(loaded)
+        return found
+
+    def invalidate(self):
+        """Increment the version, invalidating the index of all processes"""
+        incr_version(CACHE_KEY_VERSION)
+
+
+BINDING_INDEX = BindingIndex()
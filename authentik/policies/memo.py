@@ -0,0 +1,107 @@
+"""Request-scoped policy result memoization"""
+from hashlib import sha256
+from typing import Any, Optional
+from uuid import UUID
+
+from django.db.models import Model
+from prometheus_client import Counter
+
+from authentik.policies.models import PolicyBinding
+from authentik.policies.types import PolicyRequest, PolicyResult
+
+COUNTER_POLICIES_MEMO = Counter(
+    "authentik_policies_memo",
+    "Policy evaluations answered from the request-scoped memo",
+    ["result"],
+)
+MEMO_ATTRIBUTE = "_authentik_policy_memo"
+
+MemoKey = tuple[str, Any, Any, str]
+
+
+def _fingerprint_value(value: Any) -> Any:
+    """Unambiguous representation of `value`. Saved models are represented by their
+    label and primary key, other objects by their identity, as different objects can
+    have the same `repr`. Objects of the context live as long as the request, so their
+    identities aren't reused."""
+    if value is None or isinstance(value, (str, int, float, bool, bytes, UUID)):
+        return value
+    if isinstance(value, Model) and value.pk is not None:
+        return (value._meta.label_lower, value.pk)
+    if isinstance(value, dict):
+        return tuple(
+            (_fingerprint_value(key), _fingerprint_value(item))
+            for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_fingerprint_value(item) for item in value))
+    return (type(value).__qualname__, id(value))
+
+
+def context_fingerprint(context: dict[str, Any]) -> str:
+    """Fingerprint of a policy request's context. Objects without a stable representation
+    only reduce how often results are shared, they don't cause false matches."""
+    return sha256(repr(_fingerprint_value(context)).encode()).hexdigest()
+
+
+class PolicyMemo:
+    """Results of policies evaluated during a single HTTP request.
+
+    The same policy is often bound to many objects, for example to every application
+    when listing applications, or to multiple stages of a flow. Identical evaluations
+    within one request are only executed once. Results are stored before `negate`
+    is applied, so every binding still applies its own."""
+
+    _results: dict[MemoKey, PolicyResult]
+
+    def __init__(self):
+        self._results = {}
+
+    @staticmethod
+    def for_request(request: PolicyRequest) -> Optional["PolicyMemo"]:
+        """Get the memo of the HTTP request `request` belongs to, if any"""
+        if not request.http_request or request.debug:
+            return None
+        # Unwrap rest_framework's Request, so the memo is shared with plain views
+        http_request = getattr(request.http_request, "_request", request.http_request)
+        memo = getattr(http_request, MEMO_ATTRIBUTE, None)
+        if memo is None:
+            memo = PolicyMemo()
+            setattr(http_request, MEMO_ATTRIBUTE, memo)
+        return memo
+
+    @staticmethod
+    def key(
+        binding: PolicyBinding, request: PolicyRequest, fingerprint: str
+    ) -> Optional[MemoKey]:
+        """Key for a binding's evaluation, None if the result can't be shared"""
+        policy = binding.policy
+        if not policy:
+            return None
+        # Every execution of these policies should show up in the event log
+        if policy.execution_logging:
+            return None
+        obj = None
+        if not policy.target_independent and request.obj:
+            obj = request.obj.pk
+        return (policy.pk.hex, request.user.pk, obj, fingerprint)
+
+    def get(self, key: MemoKey, binding: PolicyBinding) -> Optional[PolicyResult]:
+        """Get a copy of the memoized result, with `binding`'s negate applied"""
+        memoized = self._results.get(key)
+        if not memoized:
+            COUNTER_POLICIES_MEMO.labels(result="miss").inc()
+            return None
+        COUNTER_POLICIES_MEMO.labels(result="hit").inc()
+        result = PolicyResult(memoized.passing, *memoized.messages)
+        if binding.negate:
+            result.passing = not result.passing
+        result.source_binding = binding
+        return result
+
+    def set(self, key: MemoKey, binding: PolicyBinding, result: PolicyResult):
+        """Save `binding`'s result, undoing its negate"""
+        memoized = PolicyResult(result.passing, *result.messages)
+        if binding.negate:
+            memoized.passing = not memoized.passing
+        self._results[key] = memoized
@@ -111,6 +111,16 @@ class PolicyBinding(SerializerModel):
 
         return PolicyBindingSerializer
 
+    @property
+    def evaluation_cost(self) -> int:
+        """Rough relative cost of evaluating this binding, used to evaluate cheap
+        bindings first"""
+        if self.policy:
+            return self.policy.evaluation_cost
+        if self.group:
+            return 1
+        return 0
+
     @property
     def target_type(self) -> str:
         """Get the target type this binding is applied to"""
@@ -167,6 +177,12 @@ class Policy(SerializerModel, CreatedUpdatedModel):
 
     objects = InheritanceAutoManager()
 
+    # Rough relative cost of evaluating this policy, see PolicyBinding.evaluation_cost
+    evaluation_cost = 10
+    # Set to False when the result can depend on the object being checked (request.obj),
+    # otherwise results are shared between bindings within a request, see PolicyMemo
+    target_independent = True
+
     @property
     def component(self) -> str:
         """Return component used to edit this object"""
@@ -0,0 +1,295 @@
+"""authentik policy worker pool"""
+from multiprocessing.connection import Connection
+from os import close, getpid
+from pickle import PicklingError  # nosec
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Optional
+
+from django.db import connections
+from django.http import HttpRequest
+from prometheus_client import Gauge, Histogram
+from structlog.stdlib import get_logger
+
+from authentik.lib.config import CONFIG
+from authentik.policies.models import PolicyBinding
+from authentik.policies.process import FORK_CTX, PROCESS_CLASS, PolicyProcess
+from authentik.policies.types import PolicyRequest, PolicyResult
+
+LOGGER = get_logger()
+
+EXECUTOR_FORK = "fork"
+EXECUTOR_POOL = "pool"
+
+GAUGE_POLICIES_POOL_WORKERS = Gauge(
+    "authentik_policies_pool_workers",
+    "Number of policy worker processes in the pool",
+)
+GAUGE_POLICIES_POOL_BUSY = Gauge(
+    "authentik_policies_pool_busy",
+    "Number of policy worker processes currently evaluating a binding",
+)
+HIST_POLICIES_POOL_QUEUE_WAIT = Histogram(
+    "authentik_policies_pool_queue_wait",
+    "Time spent waiting for a free policy worker",
+)
+
+
+class PolicySession(dict):
+    """Picklable stand-in for a session, only keeps the data and the session key"""
+
+    session_key: Optional[str]
+
+    def __init__(self, session_key: Optional[str], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session_key = session_key
+
+
+def snapshot_http_request(request: HttpRequest) -> HttpRequest:
+    """Create a picklable copy of an HttpRequest, containing all attributes
+    policies have access to in the fork executor."""
+    snapshot = HttpRequest()
+    snapshot.method = request.method
+    snapshot.path = request.path
+    snapshot.path_info = request.path_info
+    snapshot.META = {
+        key: value
+        for key, value in request.META.items()
+        if isinstance(value, (str, int, float, bool))
+    }
+    snapshot.GET = request.GET.copy()
+    snapshot.COOKIES = dict(request.COOKIES)
+    if hasattr(request, "user"):
+        snapshot.user = request.user
+    if hasattr(request, "session"):
+        snapshot.session = PolicySession(
+            request.session.session_key, dict(request.session.items())
+        )
+    if hasattr(request, "tenant"):
+        snapshot.tenant = request.tenant
+    return snapshot
+
+
+def _worker_main(connection: Connection):  # pragma: no cover
+    """Main loop of a pool worker, receive bindings and requests and
+    send back the result"""
+    # The database connections have been inherited from the parent process.
+    # Closing them regularly would also terminate them for the parent, so
+    # only close the file descriptor here and let django re-connect
+    for conn in connections.all():
+        if conn.connection:
+            try:
+                close(conn.connection.fileno())
+            except (AttributeError, OSError):
+                pass
+        conn.close()
+    while True:
+        try:
+            binding, request = connection.recv()
+        except EOFError:
+            return
+        connection.send(PolicyProcess(binding, request, None).execute_instrumented())
+
+
+class PolicyWorker:
+    """A single long-lived worker process and the parent's end of its pipe"""
+
+    process: PROCESS_CLASS
+    connection: Connection
+
+    def __init__(self):
+        self.connection, child_end = FORK_CTX.Pipe()
+        self.process = FORK_CTX.Process(
+            target=_worker_main, args=(child_end,), daemon=True
+        )
+        self.process.start()
+        child_end.close()
+
+    def terminate(self):
+        """Kill the worker process, used when a binding exceeds its timeout"""
+        self.connection.close()
+        self.process.kill()
+        self.process.join()
+
+
+class PolicyTask:
+    """Handle for a binding which has been sent to a pool worker"""
+
+    binding: PolicyBinding
+    request: PolicyRequest
+    # Set when the worker timed out or died, these results are not cached
+    failed: bool
+    # perf_counter() value at which the binding's timeout is exceeded, counted from
+    # when the binding was sent to the worker
+    deadline: float
+
+    _pool: "PolicyWorkerPool"
+    _worker: PolicyWorker
+    _result: Optional[PolicyResult]
+
+    def __init__(
+        self,
+        pool: "PolicyWorkerPool",
+        worker: PolicyWorker,
+        binding: PolicyBinding,
+        request: PolicyRequest,
+    ):
+        self._pool = pool
+        self._worker = worker
+        self._result = None
+        self.failed = False
+        self.binding = binding
+        self.request = request
+        self.deadline = perf_counter() + binding.timeout
+
+    @property
+    def done(self) -> bool:
+        """Check if the result has already been received"""
+        return self._result is not None
+
+    @property
+    def connection(self) -> Connection:
+        """Connection to the worker, can be used to wait for the result"""
+        return self._worker.connection
+
+    def cancel(self):
+        """Stop waiting for the result. The worker is returned to the pool once it has
+        finished, or replaced if it exceeds the binding's timeout."""
+        Thread(target=self._drain, daemon=True).start()
+
+    def _remaining(self) -> float:
+        return max(self.deadline - perf_counter(), 0)
+
+    def _drain(self):
+        if self._worker.connection.poll(self._remaining()):
+            try:
+                self._worker.connection.recv()
+                self._pool.release(self._worker)
+                return
+            except EOFError:
+                pass
+        self._pool.replace(self._worker)
+
+    def result(self, timeout: Optional[float] = None) -> PolicyResult:
+        """Wait for the worker to return the result. When the timeout (defaults to what's
+        left of the binding's timeout) is exceeded or the worker died, the worker is
+        replaced and a failing result is returned."""
+        if self._result is not None:
+            return self._result
+        if timeout is None:
+            timeout = self._remaining()
+        if self._worker.connection.poll(timeout):
+            try:
+                self._result = self._worker.connection.recv()
+                self._pool.release(self._worker)
+                return self._result
+            except EOFError:
+                LOGGER.warning("P_ENG(pool): Worker died", binding=self.binding)
+                message = "Policy worker died"
+        else:
+            LOGGER.warning(
+                "P_ENG(pool): Policy timed out, replacing worker",
+                binding=self.binding,
+                timeout=self.binding.timeout,
+            )
+            message = "Policy execution timed out"
+        self._pool.replace(self._worker)
+        self.failed = True
+        self._result = PolicyResult(False, message)
+        self._result.failed = True
+        self._result.source_binding = self.binding
+        return self._result
+
+
+class PolicyWorkerPool:
+    """Pool of pre-forked worker processes which evaluate policies. Workers keep their
+    database and cache connections, so a binding only costs an IPC round-trip instead
+    of a fork and fresh connections."""
+
+    size: int
+
+    _idle: Queue
+    _workers: list[PolicyWorker]
+    _lock: Lock
+    _pid: int
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle = Queue()
+        self._workers = []
+        self._lock = Lock()
+        self._pid = 0
+
+    def _ensure_started(self):
+        """Start workers on first use. The pool is process-local, so when we've been forked
+        (for example into a gunicorn worker) we start our own set of workers."""
+        if self._pid == getpid():
+            return
+        with self._lock:
+            if self._pid == getpid():
+                return
+            self._idle = Queue()
+            self._workers = []
+            for _ in range(self.size):
+                self._spawn()
+            self._pid = getpid()
+            LOGGER.debug("P_ENG(pool): Started workers", size=self.size)
+
+    def _spawn(self):
+        worker = PolicyWorker()
+        self._workers.append(worker)
+        self._idle.put(worker)
+        GAUGE_POLICIES_POOL_WORKERS.set(len(self._workers))
+
+    def submit(
+        self, binding: PolicyBinding, request: PolicyRequest, timeout: Optional[float]
+    ) -> Optional[PolicyTask]:
+        """Send binding and request to an idle worker. Returns None if no worker
+        became available within `timeout` or the request could not be sent to the worker,
+        in which case the caller should evaluate the binding itself."""
+        self._ensure_started()
+        start = perf_counter()
+        try:
+            worker: PolicyWorker = self._idle.get(timeout=timeout)
+        except Empty:
+            return None
+        finally:
+            HIST_POLICIES_POOL_QUEUE_WAIT.observe(perf_counter() - start)
+        GAUGE_POLICIES_POOL_BUSY.inc()
+        ipc_request = PolicyRequest(request.user)
+        ipc_request.obj = request.obj
+        ipc_request.context = request.context
+        ipc_request.debug = request.debug
+        ipc_request.profile = request.profile
+        if request.http_request:
+            ipc_request.http_request = snapshot_http_request(request.http_request)
+        try:
+            worker.connection.send((binding, ipc_request))
+        except (PicklingError, TypeError, AttributeError) as exc:
+            LOGGER.debug("P_ENG(pool): Failed to send request to worker", exc=exc)
+            self.release(worker)
+            return None
+        return PolicyTask(self, worker, binding, request)
+
+    def release(self, worker: PolicyWorker):
+        """Return a worker to the pool after its result has been received"""
+        GAUGE_POLICIES_POOL_BUSY.dec()
+        self._idle.put(worker)
+
+    def replace(self, worker: PolicyWorker):
+        """Terminate a hanging or dead worker and start a replacement"""
+        GAUGE_POLICIES_POOL_BUSY.dec()
+        worker.terminate()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self._spawn()
+
+
+POLICY_POOL = PolicyWorkerPool(int(CONFIG.y("policies.pool_workers", 4)))
+
+
+def get_executor() -> str:
+    """Get the configured policy executor, either `fork` or `pool`"""
+    return CONFIG.y("policies.executor", EXECUTOR_FORK)
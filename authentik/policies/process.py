@@ -4,15 +4,28 @@ from multiprocessing.connection import Connection
 from traceback import format_tb
 from typing import Optional
 
-from django.core.cache import cache
-from prometheus_client import Histogram
-from sentry_sdk.hub import Hub
-from sentry_sdk.tracing import Span
 from structlog.stdlib import get_logger
 
 from authentik.events.models import Event, EventAction
+from authentik.lib.instrumentation import (
+    LABEL_OBJECT_TYPE,
+    LABEL_OUTCOME,
+    LABEL_POLICY_TYPE,
+    OUTCOME_ERROR,
+    Timer,
+    histogram,
+    object_type,
+    outcome,
+    span,
+)
 from authentik.policies.exceptions import PolicyException
 from authentik.policies.models import PolicyBinding
+from authentik.policies.profiler import (
+    SOURCE_EVALUATED,
+    BindingProfile,
+    binding_label,
+    profile_execution,
+)
 from authentik.policies.types import PolicyRequest, PolicyResult
 
 LOGGER = get_logger()
@@ -20,17 +33,10 @@ TRACEBACK_HEADER = "Traceback (most recent call last):\n"
 
 FORK_CTX = get_context("fork")
 PROCESS_CLASS = FORK_CTX.Process
-HIST_POLICIES_EXECUTION_TIME = Histogram(
+HIST_POLICIES_EXECUTION_TIME = histogram(
     "authentik_policies_execution_time",
     "Execution times for single policies",
-    [
-        "binding_order",
-        "binding_target_type",
-        "binding_target_name",
-        "object_name",
-        "object_type",
-        "user",
-    ],
+    (LABEL_POLICY_TYPE, LABEL_OBJECT_TYPE, LABEL_OUTCOME),
 )
 
 
@@ -85,6 +91,16 @@ class PolicyProcess(PROCESS_CLASS):
 
     def execute(self) -> PolicyResult:
         """Run actual policy, returns result"""
+        if not self.request.profile:
+            return self._execute()
+        profile = BindingProfile(binding_label(self.binding), SOURCE_EVALUATED)
+        with profile_execution(profile):
+            policy_result = self._execute()
+        profile.passing = policy_result.passing
+        policy_result.profile = profile
+        return policy_result
+
+    def _execute(self) -> PolicyResult:
         LOGGER.debug(
             "P_ENG(proc): Running policy",
             policy=self.binding.policy,
@@ -117,11 +133,8 @@ class PolicyProcess(PROCESS_CLASS):
             LOGGER.debug("P_ENG(proc): error", exc=src_exc)
             policy_result = PolicyResult(False, str(src_exc))
         policy_result.source_binding = self.binding
-        if not self.request.debug:
-            key = cache_key(self.binding, self.request)
-            cache.set(key, policy_result)
         LOGGER.debug(
-            "P_ENG(proc): finished and cached ",
+            "P_ENG(proc): finished",
             policy=self.binding.policy,
             result=policy_result,
             process="PolicyProcess",
@@ -130,23 +143,30 @@ class PolicyProcess(PROCESS_CLASS):
         )
         return policy_result
 
-    def run(self):  # pragma: no cover
-        """Task wrapper to run policy checking"""
-        with Hub.current.start_span(
-            op="policy.process.execute",
-        ) as span, HIST_POLICIES_EXECUTION_TIME.labels(
-            binding_order=self.binding.order,
-            binding_target_type=self.binding.target_type,
-            binding_target_name=self.binding.target_name,
-            object_name=self.request.obj,
-            object_type=f"{self.request.obj._meta.app_label}.{self.request.obj._meta.model_name}",
-            user=str(self.request.user),
-        ).time():
-            span: Span
-            span.set_data("policy", self.binding.policy)
-            span.set_data("request", self.request)
+    def execute_instrumented(self) -> PolicyResult:
+        """Run policy with its execution time recorded and within a tracing span.
+        Unexpected exceptions are turned into a failed result."""
+        policy_type = self.binding.target_type
+        if self.binding.policy:
+            policy_type = object_type(self.binding.policy)
+        with span("policy.process.execute", detail=True) as execute_span, Timer(
+            HIST_POLICIES_EXECUTION_TIME,
+            policy_type=policy_type,
+            object_type=object_type(self.request.obj),
+        ) as timer:
+            if execute_span:
+                execute_span.set_data("policy", self.binding.policy)
+                execute_span.set_data("request", self.request)
             try:
-                self.connection.send(self.execute())
+                result = self.execute()
             except Exception as exc:  # pylint: disable=broad-except
                 LOGGER.warning(str(exc))
-                self.connection.send(PolicyResult(False, str(exc)))
+                result = PolicyResult(False, str(exc))
+                result.failed = True
+                timer.labels[LABEL_OUTCOME] = OUTCOME_ERROR
+            timer.labels.setdefault(LABEL_OUTCOME, outcome(result.passing))
+            return result
+
+    def run(self):  # pragma: no cover
+        """Task wrapper to run policy checking"""
+        self.connection.send(self.execute_instrumented())
@@ -0,0 +1,88 @@
+"""Policy execution profiling"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from django.db import connection
+from django.http import HttpRequest
+
+from authentik.core.models import USER_ATTRIBUTE_DEBUG
+from authentik.lib.utils.http import track_outbound_time
+
+if TYPE_CHECKING:
+    from authentik.policies.models import PolicyBinding
+
+# Header with which superusers can profile a single request
+PROFILE_HEADER = "HTTP_X_AUTHENTIK_PROFILE"
+
+SOURCE_CACHE = "cache"
+SOURCE_MEMO = "memo"
+SOURCE_EVALUATED = "evaluated"
+
+
+@dataclass
+class BindingProfile:
+    """Cost of a single binding's evaluation. Durations are in seconds."""
+
+    binding: str
+    # Where the result came from, cache, memo or evaluated
+    source: str
+    passing: Optional[bool] = field(default=None)
+    # Time between the binding being dispatched and starting execution,
+    # spent forking or waiting for a pool worker
+    wait: float = field(default=0)
+    execution: float = field(default=0)
+    queries: int = field(default=0)
+    http: float = field(default=0)
+    # perf_counter() when execution started, used to calculate the wait time.
+    # perf_counter uses a system-wide clock, so it's comparable between processes
+    started: float = field(default=0)
+
+
+def binding_label(binding: "PolicyBinding") -> str:
+    """Describe a binding without loading its target"""
+    label = f"{binding.target_type.title()} {binding.target_name}"
+    if binding.order is not None:
+        label += f" #{binding.order}"
+    return label
+
+
+def should_profile(request: Optional[HttpRequest]) -> bool:
+    """Check if policy executions in this request should be profiled, either for
+    a superuser sending the profile header or a user with debugging enabled"""
+    if not request or not hasattr(request, "user"):
+        return False
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    if user.attributes.get(USER_ATTRIBUTE_DEBUG, False):
+        return True
+    return user.is_superuser and PROFILE_HEADER in request.META
+
+
+class QueryCounter:
+    """Database execute wrapper which counts queries"""
+
+    count: int
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def profile_execution(profile: BindingProfile) -> Iterator[BindingProfile]:
+    """Measure execution time, database queries and outbound HTTP time"""
+    counter = QueryCounter()
+    profile.started = perf_counter()
+    with connection.execute_wrapper(counter), track_outbound_time() as durations:
+        try:
+            yield profile
+        finally:
+            profile.execution = perf_counter() - profile.started
+            profile.queries = counter.count
+            profile.http = sum(durations)
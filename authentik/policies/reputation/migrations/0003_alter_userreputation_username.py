@@ -0,0 +1,31 @@
+from django.apps.registry import Apps
+from django.db import migrations, models
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+
+
+def remove_duplicates(apps: Apps, schema_editor: BaseDatabaseSchemaEditor):
+    db_alias = schema_editor.connection.alias
+
+    UserReputation = apps.get_model("authentik_policies_reputation", "userreputation")
+    seen = set()
+    for rep in UserReputation.objects.using(db_alias).order_by("-updated"):
+        if rep.username in seen:
+            rep.delete()
+            continue
+        seen.add(rep.username)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentik_policies_reputation", "0002_auto_20210529_2046"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="userreputation",
+            name="username",
+            field=models.TextField(unique=True),
+        ),
+    ]
@@ -31,13 +31,20 @@ class ReputationPolicy(Policy):
 
     def passes(self, request: PolicyRequest) -> PolicyResult:
         remote_ip = get_client_ip(request.http_request)
+        ip_key = CACHE_KEY_IP_PREFIX + remote_ip
+        user_key = CACHE_KEY_USER_PREFIX + request.user.username
+        keys = []
+        if self.check_ip:
+            keys.append(ip_key)
+        if self.check_username:
+            keys.append(user_key)
+        # Fetch both scores with a single round-trip
+        scores = cache.get_many(keys) if keys else {}
         passing = True
         if self.check_ip:
-            score = cache.get_or_set(CACHE_KEY_IP_PREFIX + remote_ip, 0)
-            passing = passing and score <= self.threshold
+            passing = passing and scores.get(ip_key, 0) <= self.threshold
         if self.check_username:
-            score = cache.get_or_set(CACHE_KEY_USER_PREFIX + request.user.username, 0)
-            passing = passing and score <= self.threshold
+            passing = passing and scores.get(user_key, 0) <= self.threshold
         return PolicyResult(passing)
 
     class Meta:
@@ -60,7 +67,7 @@ class IPReputation(models.Model):
 class UserReputation(models.Model):
     """Store score attempting to log in as the same username"""
 
-    username = models.TextField()
+    username = models.TextField(unique=True)
     score = models.IntegerField(default=0)
     updated = models.DateTimeField(auto_now=True)
 
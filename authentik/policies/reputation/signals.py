@@ -3,8 +3,11 @@ from django.contrib.auth.signals import user_logged_in, user_login_failed
 from django.core.cache import cache
 from django.dispatch import receiver
 from django.http import HttpRequest
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
 from structlog.stdlib import get_logger
 
+from authentik.lib.config import CONFIG
 from authentik.lib.utils.http import get_client_ip
 from authentik.policies.reputation.models import (
     CACHE_KEY_IP_PREFIX,
@@ -18,13 +21,21 @@ LOGGER = get_logger()
 def update_score(request: HttpRequest, username: str, amount: int):
     """Update score for IP and User"""
     remote_ip = get_client_ip(request)
-
-    # We only update the cache here, as its faster than writing to the DB
-    cache.get_or_set(CACHE_KEY_IP_PREFIX + remote_ip, 0)
-    cache.incr(CACHE_KEY_IP_PREFIX + remote_ip, amount)
-
-    cache.get_or_set(CACHE_KEY_USER_PREFIX + username, 0)
-    cache.incr(CACHE_KEY_USER_PREFIX + username, amount)
+    timeout = int(CONFIG.y("policies.reputation.expiry", 86400))
+
+    # We only update the cache here, as its faster than writing to the DB.
+    # INCRBY is atomic and creates missing keys, so concurrent updates aren't lost.
+    # Scores expire when there haven't been any updates within the timeout.
+    try:
+        pipeline = get_redis_connection().pipeline(transaction=False)
+        for key in [CACHE_KEY_IP_PREFIX + remote_ip, CACHE_KEY_USER_PREFIX + username]:
+            redis_key = cache.make_key(key)
+            pipeline.incrby(redis_key, amount)
+            pipeline.expire(redis_key, timeout)
+        pipeline.execute()
+    except RedisError as exc:
+        LOGGER.warning("Failed to update score", exc=exc)
+        return
 
     LOGGER.debug("Updated score", amount=amount, for_user=username, for_ip=remote_ip)
 
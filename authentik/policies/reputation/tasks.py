@@ -1,5 +1,9 @@
 """Reputation tasks"""
+from typing import Iterator
+
 from django.core.cache import cache
+from django.db import connection
+from django.db.models import Model
 from structlog.stdlib import get_logger
 
 from authentik.events.monitored_tasks import MonitoredTask, TaskResult, TaskResultStatus
@@ -11,18 +15,52 @@ from authentik.policies.reputation.signals import (
 from authentik.root.celery import CELERY_APP
 
 LOGGER = get_logger()
+# How many scores are read from the cache and written to the database at once
+BATCH_SIZE = 1000
+
+
+def iter_scores(prefix: str) -> Iterator[dict[str, int]]:
+    """Iterate over all cached scores with `prefix` in batches. Keys are found with SCAN,
+    so redis isn't blocked, and values are fetched with one round-trip per batch."""
+    batch = []
+    for key in cache.iter_keys(prefix + "*", itersize=BATCH_SIZE):
+        batch.append(key)
+        if len(batch) >= BATCH_SIZE:
+            yield {
+                key.replace(prefix, "", 1): score
+                for key, score in cache.get_many(batch).items()
+            }
+            batch = []
+    if batch:
+        yield {
+            key.replace(prefix, "", 1): score
+            for key, score in cache.get_many(batch).items()
+        }
+
+
+def upsert_scores(model: type[Model], field: str, scores: dict[str, int]):
+    """Insert or update `scores`, keyed by the unique `field` of `model`, in a single
+    statement. Django 3.2's bulk_create can't update conflicting rows, so rows which are
+    created concurrently would otherwise either fail the flush or lose their score."""
+    if not scores:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(field)
+    values = ", ".join(["(%s, %s, now())"] * len(scores))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({column}, score, updated) VALUES {values} "  # nosec
+            f"ON CONFLICT ({column}) DO UPDATE "
+            "SET score = EXCLUDED.score, updated = EXCLUDED.updated",
+            [value for item in scores.items() for value in item],
+        )
 
 
 @CELERY_APP.task(bind=True, base=MonitoredTask)
 def save_ip_reputation(self: MonitoredTask):
     """Save currently cached reputation to database"""
-    objects_to_update = []
-    for key, score in cache.get_many(cache.keys(CACHE_KEY_IP_PREFIX + "*")).items():
-        remote_ip = key.replace(CACHE_KEY_IP_PREFIX, "")
-        rep, _ = IPReputation.objects.get_or_create(ip=remote_ip)
-        rep.score = score
-        objects_to_update.append(rep)
-    IPReputation.objects.bulk_update(objects_to_update, ["score"])
+    for scores in iter_scores(CACHE_KEY_IP_PREFIX):
+        upsert_scores(IPReputation, "ip", scores)
     self.set_status(
         TaskResult(TaskResultStatus.SUCCESSFUL, ["Successfully updated IP Reputation"])
     )
@@ -31,13 +69,8 @@ def save_ip_reputation(self: MonitoredTask):
 @CELERY_APP.task(bind=True, base=MonitoredTask)
 def save_user_reputation(self: MonitoredTask):
     """Save currently cached reputation to database"""
-    objects_to_update = []
-    for key, score in cache.get_many(cache.keys(CACHE_KEY_USER_PREFIX + "*")).items():
-        username = key.replace(CACHE_KEY_USER_PREFIX, "")
-        rep, _ = UserReputation.objects.get_or_create(username=username)
-        rep.score = score
-        objects_to_update.append(rep)
-    UserReputation.objects.bulk_update(objects_to_update, ["score"])
+    for scores in iter_scores(CACHE_KEY_USER_PREFIX):
+        upsert_scores(UserReputation, "username", scores)
     self.set_status(
         TaskResult(
             TaskResultStatus.SUCCESSFUL, ["Successfully updated User Reputation"]
@@ -48,6 +48,26 @@ class TestReputationPolicy(TestCase):
             UserReputation.objects.get(username=self.test_username).score, -1
         )
 
+    def test_reputation_update(self):
+        """test updates are accumulated and existing database entries are updated"""
+        IPReputation.objects.create(ip=self.test_ip, score=5)
+        authenticate(None, username=self.test_username, password=self.test_username)
+        authenticate(None, username=self.test_username, password=self.test_username)
+        self.assertEqual(cache.get(CACHE_KEY_IP_PREFIX + self.test_ip), -2)
+        self.assertIsNotNone(cache.ttl(CACHE_KEY_IP_PREFIX + self.test_ip))
+        save_ip_reputation.delay().get()
+        self.assertEqual(IPReputation.objects.get(ip=self.test_ip).score, -2)
+
+    def test_user_reputation_update(self):
+        """test existing user reputation is updated"""
+        UserReputation.objects.create(username=self.test_username, score=5)
+        authenticate(None, username=self.test_username, password=self.test_username)
+        save_user_reputation.delay().get()
+        save_user_reputation.delay().get()
+        self.assertEqual(
+            UserReputation.objects.get(username=self.test_username).score, -1
+        )
+
     def test_policy(self):
         """Test Policy"""
         request = PolicyRequest(user=self.user)
@@ -55,3 +75,15 @@ class TestReputationPolicy(TestCase):
             name="reputation-test", threshold=0
         )
         self.assertTrue(policy.passes(request).passing)
+
+    def test_policy_threshold(self):
+        """Test Policy with cached scores"""
+        request = PolicyRequest(user=self.user)
+        cache.set(CACHE_KEY_IP_PREFIX + self.test_ip, -10)
+        cache.set(CACHE_KEY_USER_PREFIX + self.test_username, 10)
+        policy: ReputationPolicy = ReputationPolicy.objects.create(
+            name="reputation-test", threshold=0, check_username=False
+        )
+        self.assertTrue(policy.passes(request).passing)
+        policy.check_username = True
+        self.assertFalse(policy.passes(request).passing)
@@ -1,10 +1,11 @@
 """authentik policy signals"""
-from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from structlog.stdlib import get_logger
 
-from authentik.core.api.applications import user_app_cache_key
+from authentik.core.api.applications import invalidate_user_app_cache
+from authentik.lib.utils.cache import delete_keys
 
 LOGGER = get_logger()
 
@@ -21,10 +22,23 @@ def invalidate_policy_cache(sender, instance, **_):
             prefix = (
                 f"policy_{binding.policy_binding_uuid.hex}_{binding.policy.pk.hex}*"
             )
-            keys = cache.keys(prefix)
-            total += len(keys)
-            cache.delete_many(keys)
+            total += delete_keys(prefix)
         LOGGER.debug("Invalidating policy cache", policy=instance, keys=total)
     # Also delete user application cache
-    keys = cache.keys(user_app_cache_key("*")) or []
-    cache.delete_many(keys)
+    invalidate_user_app_cache()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+# pylint: disable=unused-argument
+def invalidate_binding_index(sender, instance, **_):
+    """Invalidate the binding index of all processes when bindings or policies change"""
+    from authentik.policies.index import BINDING_INDEX
+    from authentik.policies.models import Policy, PolicyBinding
+
+    if not isinstance(instance, (Policy, PolicyBinding)):
+        return
+    BINDING_INDEX.invalidate()
+    # Other processes might rebuild their index before the transaction is committed,
+    # so invalidate again once the change is visible to them
+    transaction.on_commit(BINDING_INDEX.invalidate)
@@ -1,11 +1,18 @@
 """policy engine tests"""
+from unittest.mock import MagicMock, patch
+
 from django.core.cache import cache
-from django.test import TestCase
+from django.db import DatabaseError
+from django.test import RequestFactory, TestCase
 
 from authentik.core.models import User
+from authentik.flows.models import Flow, FlowDesignation
+from authentik.lib.config import CONFIG
 from authentik.policies.dummy.models import DummyPolicy
-from authentik.policies.engine import PolicyEngine
+from authentik.policies.engine import BatchPolicyEngine, PolicyEngine
 from authentik.policies.expression.models import ExpressionPolicy
+from authentik.policies.index import BINDING_INDEX
+from authentik.policies.memo import context_fingerprint
 from authentik.policies.models import (
     Policy,
     PolicyBinding,
@@ -13,6 +20,7 @@ from authentik.policies.models import (
     PolicyEngineMode,
 )
 from authentik.policies.tests.test_process import clear_policy_cache
+from authentik.policies.types import PolicyResult
 
 
 class TestPolicyEngine(TestCase):
@@ -59,6 +67,20 @@ class TestPolicyEngine(TestCase):
         engine = PolicyEngine(pbm, self.user)
         result = engine.build().result
         self.assertEqual(result.passing, False)
+        # The first failing policy decides the result, so the second isn't evaluated
+        self.assertEqual(result.messages, ("dummy",))
+
+    def test_engine_mode_all_no_short_circuit(self):
+        """Ensure all policies are evaluated when short-circuiting is disabled"""
+        pbm = PolicyBindingModel.objects.create(
+            policy_engine_mode=PolicyEngineMode.MODE_ALL
+        )
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_false, order=0)
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_true, order=1)
+        engine = PolicyEngine(pbm, self.user)
+        engine.short_circuit = False
+        result = engine.build().result
+        self.assertEqual(result.passing, False)
         self.assertEqual(
             result.messages,
             (
@@ -85,6 +107,31 @@ class TestPolicyEngine(TestCase):
             ),
         )
 
+    def test_engine_mode_any_short_circuit(self):
+        """Ensure the first passing policy stops evaluation with OR mode"""
+        pbm = PolicyBindingModel.objects.create(
+            policy_engine_mode=PolicyEngineMode.MODE_ANY
+        )
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_true, order=0)
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_false, order=1)
+        engine = PolicyEngine(pbm, self.user)
+        result = engine.build().result
+        self.assertEqual(result.passing, True)
+        self.assertEqual(len(result.source_results), 1)
+
+    def test_engine_cheap_first(self):
+        """Ensure user bindings are evaluated before expensive policies"""
+        pbm = PolicyBindingModel.objects.create(
+            policy_engine_mode=PolicyEngineMode.MODE_ANY
+        )
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_true, order=0)
+        PolicyBinding.objects.create(target=pbm, user=self.user, order=1)
+        engine = PolicyEngine(pbm, self.user)
+        engine.cheap_first = True
+        result = engine.build().result
+        self.assertEqual(result.passing, True)
+        self.assertEqual(result.messages, ())
+
     def test_engine_negate(self):
         """Test negate flag"""
         pbm = PolicyBindingModel.objects.create()
@@ -105,6 +152,19 @@ class TestPolicyEngine(TestCase):
         self.assertEqual(result.passing, False)
         self.assertEqual(result.messages, ("division by zero",))
 
+    def test_engine_crash(self):
+        """Test results of policies which crashed aren't cached"""
+        pbm = PolicyBindingModel.objects.create()
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_true, order=0)
+        with patch(
+            "authentik.policies.process.PolicyProcess.execute",
+            side_effect=DatabaseError("foo"),
+        ):
+            result = PolicyEngine(pbm, self.user).build().result
+        self.assertEqual(result.passing, False)
+        self.assertEqual(result.messages, ("foo",))
+        self.assertEqual(PolicyEngine(pbm, self.user).build().result.passing, True)
+
     def test_engine_policy_type(self):
         """Test invalid policy type"""
         pbm = PolicyBindingModel.objects.create()
@@ -131,3 +191,152 @@ class TestPolicyEngine(TestCase):
         self.assertEqual(
             len(cache.keys(f"policy_{binding.policy_binding_uuid.hex}*")), 1
         )
+
+    def test_engine_pool(self):
+        """Test policy evaluation in the worker pool"""
+        pbm = PolicyBindingModel.objects.create(
+            policy_engine_mode=PolicyEngineMode.MODE_ALL
+        )
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_false, order=0)
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_true, order=1)
+        with CONFIG.patch("policies.executor", "pool"):
+            engine = PolicyEngine(pbm, self.user)
+            result = engine.build().result
+        self.assertEqual(result.passing, False)
+        self.assertEqual(
+            result.messages,
+            (
+                "dummy",
+                "dummy",
+            ),
+        )
+
+    def test_engine_pool_timeout(self):
+        """Test worker pool replacing a worker when a binding times out"""
+        pbm = PolicyBindingModel.objects.create()
+        policy_slow = DummyPolicy.objects.create(result=True, wait_min=3, wait_max=4)
+        PolicyBinding.objects.create(target=pbm, policy=policy_slow, order=0, timeout=1)
+        with CONFIG.patch("policies.executor", "pool"):
+            engine = PolicyEngine(pbm, self.user)
+            result = engine.build().result
+        self.assertEqual(result.passing, False)
+        self.assertEqual(result.messages, ("Policy execution timed out",))
+
+    def test_engine_pool_died(self):
+        """Test worker pool replacing a worker which died"""
+        pbm = PolicyBindingModel.objects.create()
+        policy_exit = ExpressionPolicy.objects.create(
+            name="exit", expression="__import__('os')._exit(1)"
+        )
+        PolicyBinding.objects.create(target=pbm, policy=policy_exit, order=0)
+        with CONFIG.patch("policies.executor", "pool"):
+            engine = PolicyEngine(pbm, self.user)
+            result = engine.build().result
+        self.assertEqual(result.passing, False)
+        self.assertEqual(result.messages, ("Policy worker died",))
+
+    def test_engine_memo(self):
+        """Test policy results being shared between targets within a request"""
+        request = RequestFactory().get("/")
+        request.user = self.user
+        pbm_a = PolicyBindingModel.objects.create()
+        pbm_b = PolicyBindingModel.objects.create()
+        PolicyBinding.objects.create(target=pbm_a, policy=self.policy_true, order=0)
+        PolicyBinding.objects.create(
+            target=pbm_b, policy=self.policy_true, order=0, negate=True
+        )
+        passes = MagicMock(side_effect=lambda _: PolicyResult(True, "dummy"))
+        with patch("authentik.policies.dummy.models.DummyPolicy.passes", passes):
+            self.assertTrue(PolicyEngine(pbm_a, self.user, request).build().passing)
+            self.assertFalse(PolicyEngine(pbm_b, self.user, request).build().passing)
+            # A different request evaluates the policy again
+            other = RequestFactory().get("/")
+            other.user = self.user
+            self.assertFalse(PolicyEngine(pbm_b, self.user, other).build().passing)
+        self.assertEqual(passes.call_count, 2)
+
+    def test_context_fingerprint(self):
+        """Test objects with the same repr have different fingerprints"""
+
+        class Same:
+            """Object with a constant repr"""
+
+            def __repr__(self):
+                return "same"
+
+        first, second = Same(), Same()
+        self.assertNotEqual(
+            context_fingerprint({"foo": first}), context_fingerprint({"foo": second})
+        )
+        self.assertEqual(
+            context_fingerprint({"user": self.user}),
+            context_fingerprint({"user": User.objects.get(pk=self.user.pk)}),
+        )
+
+    def test_engine_memo_target(self):
+        """Test expressions referencing the checked object aren't shared"""
+        request = RequestFactory().get("/")
+        request.user = self.user
+        policy = ExpressionPolicy.objects.create(
+            name="obj", expression="return request.obj is not None"
+        )
+        self.assertFalse(policy.target_independent)
+        pbm_a = PolicyBindingModel.objects.create()
+        pbm_b = PolicyBindingModel.objects.create()
+        PolicyBinding.objects.create(target=pbm_a, policy=policy, order=0)
+        PolicyBinding.objects.create(target=pbm_b, policy=policy, order=0)
+        passes = MagicMock(side_effect=lambda _: PolicyResult(True))
+        with patch(
+            "authentik.policies.expression.models.ExpressionPolicy.passes", passes
+        ):
+            PolicyEngine(pbm_a, self.user, request).build()
+            PolicyEngine(pbm_b, self.user, request).build()
+        self.assertEqual(passes.call_count, 2)
+
+    def test_engine_batch(self):
+        """Test evaluating multiple targets, with shared policies evaluated once"""
+        pbm_a = PolicyBindingModel.objects.create()
+        pbm_b = PolicyBindingModel.objects.create(
+            policy_engine_mode=PolicyEngineMode.MODE_ALL
+        )
+        pbm_empty = PolicyBindingModel.objects.create()
+        PolicyBinding.objects.create(target=pbm_a, policy=self.policy_true, order=0)
+        PolicyBinding.objects.create(target=pbm_b, policy=self.policy_true, order=0)
+        PolicyBinding.objects.create(target=pbm_b, user=self.user, order=1, negate=True)
+        passes = MagicMock(side_effect=lambda _: PolicyResult(True, "dummy"))
+        with patch("authentik.policies.dummy.models.DummyPolicy.passes", passes):
+            engine = BatchPolicyEngine([pbm_a, pbm_b, pbm_empty], self.user).build()
+        self.assertEqual(passes.call_count, 1)
+        self.assertTrue(engine.results[pbm_a.pk].passing)
+        self.assertFalse(engine.results[pbm_b.pk].passing)
+        self.assertTrue(engine.results[pbm_empty.pk].passing)
+
+    def test_binding_index(self):
+        """Test binding index being invalidated when bindings change"""
+        pbm = PolicyBindingModel.objects.create()
+        PolicyBinding.objects.create(target=pbm, policy=self.policy_true, order=1)
+        self.assertEqual(len(BINDING_INDEX.get(pbm)), 1)
+        with self.assertNumQueries(0):
+            bindings = BINDING_INDEX.get(pbm)
+            self.assertIsInstance(bindings[0].policy, DummyPolicy)
+        binding = PolicyBinding.objects.create(
+            target=pbm, policy=self.policy_false, order=0
+        )
+        self.assertEqual(
+            [x.pk for x in BINDING_INDEX.get(pbm)],
+            [binding.pk, bindings[0].pk],
+        )
+        binding.delete()
+        self.assertEqual(len(BINDING_INDEX.get(pbm)), 1)
+
+    def test_binding_index_subclass(self):
+        """Test binding index with targets that have their own primary key"""
+        flow = Flow.objects.create(
+            name="test-binding-index",
+            slug="test-binding-index",
+            designation=FlowDesignation.AUTHENTICATION,
+        )
+        PolicyBinding.objects.create(target=flow, policy=self.policy_false, order=0)
+        self.assertEqual(len(BINDING_INDEX.get(flow)), 1)
+        engine = PolicyEngine(flow, self.user)
+        self.assertFalse(engine.build().passing)
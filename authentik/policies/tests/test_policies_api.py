@@ -2,8 +2,9 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
-from authentik.core.models import User
+from authentik.core.models import Application, User
 from authentik.policies.dummy.models import DummyPolicy
+from authentik.policies.models import PolicyBinding, PolicyBindingModel
 
 
 class TestPoliciesAPI(APITestCase):
@@ -27,9 +28,42 @@ class TestPoliciesAPI(APITestCase):
             response.content.decode(), {"passing": True, "messages": ["dummy"]}
         )
 
+    def test_explain(self):
+        """Test Policy's explain endpoint"""
+        response = self.client.post(
+            reverse("authentik_api:policy-explain", kwargs={"pk": self.policy.pk}),
+            data={
+                "user": self.user.pk,
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(body["passing"])
+        self.assertEqual(len(body["profile"]), 1)
+        self.assertEqual(body["profile"][0]["source"], "evaluated")
+
     def test_types(self):
         """Test Policy's types endpoint"""
         response = self.client.get(
             reverse("authentik_api:policy-types"),
         )
         self.assertEqual(response.status_code, 200)
+
+    def test_access_batch(self):
+        """Test batch access check"""
+        allowed = Application.objects.create(name="allowed", slug="allowed")
+        denied = Application.objects.create(name="denied", slug="denied")
+        other = PolicyBindingModel.objects.create()
+        PolicyBinding.objects.create(target=allowed, policy=self.policy, order=0)
+        PolicyBinding.objects.create(
+            target=denied, policy=self.policy, order=0, negate=True
+        )
+        PolicyBinding.objects.create(target=other, policy=self.policy, order=0)
+        response = self.client.post(
+            reverse("authentik_api:policies_access_batch"),
+            data={"targets": [str(allowed.pk), str(denied.pk), str(other.pk)]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        results = {x["target"]: x["passing"] for x in response.json()}
+        self.assertEqual(results, {str(allowed.pk): True, str(denied.pk): False})
@@ -1,4 +1,6 @@
 """policy process tests"""
+from unittest.mock import patch
+
 from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
 from django.test import RequestFactory, TestCase
@@ -27,6 +29,23 @@ class TestPolicyProcess(TestCase):
         self.factory = RequestFactory()
         self.user = User.objects.create_user(username="policyuser")
 
+    def test_instrumented(self):
+        """Test execution time is recorded and unexpected exceptions fail the result"""
+        binding = PolicyBinding(
+            policy=DummyPolicy.objects.create(result=True, wait_min=0, wait_max=1)
+        )
+        request = PolicyRequest(self.user)
+        with patch("authentik.policies.process.HIST_POLICIES_EXECUTION_TIME") as hist:
+            self.assertTrue(
+                PolicyProcess(binding, request, None).execute_instrumented().passing
+            )
+            hist.labels.return_value.observe.assert_called_once()
+            with patch.object(PolicyProcess, "execute", side_effect=ValueError("foo")):
+                result = PolicyProcess(binding, request, None).execute_instrumented()
+        self.assertFalse(result.passing)
+        self.assertTrue(result.failed)
+        self.assertEqual(result.messages, ("foo",))
+
     def test_group_passing(self):
         """Test binding to group"""
         group = Group.objects.create(name="test-group")
@@ -14,6 +14,7 @@ from authentik.lib.utils.http import get_client_ip
 if TYPE_CHECKING:
     from authentik.core.models import User
     from authentik.policies.models import PolicyBinding
+    from authentik.policies.profiler import BindingProfile
 
 LOGGER = get_logger()
 
@@ -27,6 +28,8 @@ class PolicyRequest:
     obj: Optional[Model]
     context: dict[str, Any]
     debug: bool = False
+    # Record the cost of each binding, see authentik.policies.profiler
+    profile: bool = False
 
     def __init__(self, user: User):
         super().__init__()
@@ -60,16 +63,22 @@ class PolicyResult:
 
     passing: bool
     messages: tuple[str, ...]
+    # Set when the policy couldn't be evaluated, because it raised an unexpected
+    # exception, timed out or its process died. These results are not cached.
+    failed: bool
 
     source_binding: Optional["PolicyBinding"]
     source_results: Optional[list["PolicyResult"]]
+    profile: Optional["BindingProfile"]
 
     def __init__(self, passing: bool, *messages: str):
         super().__init__()
         self.passing = passing
         self.messages = messages
+        self.failed = False
         self.source_binding = None
         self.source_results = []
+        self.profile = None
 
     def __repr__(self):
         return self.__str__()
@@ -2,9 +2,10 @@
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from django.contrib.messages.storage.base import BaseStorage, Message
-from django.core.cache import cache
 from django.http.request import HttpRequest
 
+from authentik.root.messages.consumer import session_channels
+
 
 class ChannelsStorage(BaseStorage):
     """Send contrib.messages over websocket"""
@@ -18,10 +19,7 @@ class ChannelsStorage(BaseStorage):
         return [], True
 
     def _store(self, messages: list[Message], response, *args, **kwargs):
-        prefix = f"user_{self.request.session.session_key}_messages_"
-        keys = cache.keys(f"{prefix}*")
-        for key in keys:
-            uid = key.replace(prefix, "")
+        for uid in session_channels(self.request.session.session_key).members():
             for message in messages:
                 async_to_sync(self.channel.send)(
                     uid,
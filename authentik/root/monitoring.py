@@ -20,12 +20,13 @@ from authentik.root.celery import CELERY_APP
 class UpdatingGauge(Gauge):
     """Gauge which fetches its own value from an update function.
 
-    Update function is called on instantiate"""
+    Update function is called when metrics are collected, so it doesn't
+    run on every request that changes the value"""
 
     def __init__(self, *args, update_func: Callable, **kwargs):
         super().__init__(*args, **kwargs)
         self._update_func = update_func
-        self.update()
+        self.set_function(lambda: self._update_func() or 0)
 
     def update(self):
         """Set value from update function"""
@@ -15,6 +15,7 @@ class PytestTestRunner:  # pragma: no cover
         settings.CELERY_TASK_ALWAYS_EAGER = True
         CONFIG.y_set("authentik.avatars", "none")
         CONFIG.y_set("authentik.geoip", "tests/GeoLite2-City-Test.mmdb")
+        CONFIG.y_set("events.buffer.mode", "sync")
 
     def run_tests(self, test_labels):
         """Run pytest and return the exitcode.
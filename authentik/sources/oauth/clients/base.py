@@ -3,13 +3,13 @@ from typing import Any, Optional
 from urllib.parse import urlencode
 
 from django.http import HttpRequest
-from requests import Session
 from requests.exceptions import RequestException
 from requests.models import Response
 from structlog.stdlib import get_logger
 
 from authentik import __version__
 from authentik.events.models import Event, EventAction
+from authentik.lib.utils.http import OutboundSession, get_http_session
 from authentik.sources.oauth.models import OAuthSource
 
 LOGGER = get_logger()
@@ -18,7 +18,7 @@ LOGGER = get_logger()
 class BaseOAuthClient:
     """Base OAuth Client"""
 
-    session: Session
+    session: OutboundSession
 
     source: OAuthSource
     request: HttpRequest
@@ -29,7 +29,7 @@ class BaseOAuthClient:
         self, source: OAuthSource, request: HttpRequest, callback: Optional[str] = None
     ):
         self.source = source
-        self.session = Session()
+        self.session = get_http_session()
         self.request = request
         self.callback = callback
         self.session.headers.update({"User-Agent": f"authentik {__version__}"})
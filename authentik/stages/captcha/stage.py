@@ -1,7 +1,7 @@
 """authentik captcha stage"""
 
 from django.http.response import HttpResponse
-from requests import RequestException, post
+from requests import RequestException
 from rest_framework.fields import CharField
 from rest_framework.serializers import ValidationError
 
@@ -13,7 +13,7 @@ from authentik.flows.challenge import (
     WithUserInfoChallenge,
 )
 from authentik.flows.stage import ChallengeStageView
-from authentik.lib.utils.http import get_client_ip
+from authentik.lib.utils.http import get_client_ip, get_http_session
 from authentik.stages.captcha.models import CaptchaStage
 
 
@@ -34,7 +34,7 @@ class CaptchaChallengeResponse(ChallengeResponse):
         """Validate captcha token"""
         stage: CaptchaStage = self.stage.executor.current_stage
         try:
-            response = post(
+            response = get_http_session().post(
                 "https://www.google.com/recaptcha/api/siteverify",
                 headers={
                     "Content-type": "application/x-www-form-urlencoded",
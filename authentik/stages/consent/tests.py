@@ -11,8 +11,10 @@ from authentik.flows.challenge import ChallengeTypes
 from authentik.flows.markers import StageMarker
 from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding
 from authentik.flows.planner import PLAN_CONTEXT_APPLICATION, FlowPlan
+from authentik.flows.tests.utils import stage_query_budget
 from authentik.flows.views import SESSION_KEY_PLAN
 from authentik.stages.consent.models import ConsentMode, ConsentStage, UserConsent
+from authentik.stages.consent.stage import ConsentStageView
 
 
 class TestConsentStage(TestCase):
@@ -45,10 +47,11 @@ class TestConsentStage(TestCase):
         session = self.client.session
         session[SESSION_KEY_PLAN] = plan
         session.save()
-        response = self.client.post(
-            reverse("authentik_api:flow-executor", kwargs={"flow_slug": flow.slug}),
-            {},
-        )
+        with stage_query_budget(self, {ConsentStageView: 1}):
+            response = self.client.post(
+                reverse("authentik_api:flow-executor", kwargs={"flow_slug": flow.slug}),
+                {},
+            )
         self.assertEqual(response.status_code, 200)
         self.assertJSONEqual(
             force_str(response.content),
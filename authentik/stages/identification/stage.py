@@ -1,5 +1,4 @@
 """Identification stage logic"""
-from dataclasses import asdict
 from time import sleep
 from typing import Any, Optional
 
@@ -12,10 +11,11 @@ from rest_framework.fields import BooleanField, CharField, ListField
 from rest_framework.serializers import ValidationError
 from structlog.stdlib import get_logger
 
-from authentik.core.models import Application, Source, User
+from authentik.core.models import Application, User
 from authentik.core.types import UILoginButtonSerializer
 from authentik.flows.challenge import Challenge, ChallengeResponse, ChallengeTypes
 from authentik.flows.planner import PLAN_CONTEXT_PENDING_USER
+from authentik.flows.registry import FLOW_REGISTRY
 from authentik.flows.stage import (
     PLAN_CONTEXT_PENDING_USER_IDENTIFIER,
     ChallengeStageView,
@@ -116,7 +116,7 @@ class IdentificationStageView(ChallengeStageView):
                 "primary_action": _("Log in"),
                 "component": "ak-stage-identification",
                 "user_fields": current_stage.user_fields,
-                "password_fields": bool(current_stage.password_stage),
+                "password_fields": current_stage.password_stage_id is not None,
             }
         )
         # If the user has been redirected to us whilst trying to access an
@@ -126,31 +126,26 @@ class IdentificationStageView(ChallengeStageView):
                 SESSION_KEY_APPLICATION_PRE, Application()
             ).name
         # Check for related enrollment and recovery flow, add URL to view
-        if current_stage.enrollment_flow:
+        enrollment_flow = FLOW_REGISTRY.flow_by_pk(current_stage.enrollment_flow_id)
+        if enrollment_flow:
             challenge.initial_data["enroll_url"] = reverse(
                 "authentik_core:if-flow",
-                kwargs={"flow_slug": current_stage.enrollment_flow.slug},
+                kwargs={"flow_slug": enrollment_flow.slug},
             )
-        if current_stage.recovery_flow:
+        recovery_flow = FLOW_REGISTRY.flow_by_pk(current_stage.recovery_flow_id)
+        if recovery_flow:
             challenge.initial_data["recovery_url"] = reverse(
                 "authentik_core:if-flow",
-                kwargs={"flow_slug": current_stage.recovery_flow.slug},
+                kwargs={"flow_slug": recovery_flow.slug},
             )
 
         # Check all enabled source, add them if they have a UI Login button.
-        ui_sources = []
-        sources: list[Source] = (
+        challenge.initial_data["sources"] = FLOW_REGISTRY.source_buttons(
+            current_stage,
             current_stage.sources.filter(enabled=True)
             .order_by("name")
-            .select_subclasses()
+            .select_subclasses(),
         )
-        for source in sources:
-            ui_login_button = source.ui_login_button
-            if ui_login_button:
-                button = asdict(ui_login_button)
-                button["challenge"] = ui_login_button.challenge.data
-                ui_sources.append(button)
-        challenge.initial_data["sources"] = ui_sources
         return challenge
 
     def challenge_valid(
@@ -6,9 +6,11 @@ from django.utils.encoding import force_str
 from authentik.core.models import User
 from authentik.flows.challenge import ChallengeTypes
 from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding
+from authentik.flows.tests.utils import stage_query_budget
 from authentik.providers.oauth2.generators import generate_client_secret
 from authentik.sources.oauth.models import OAuthSource
 from authentik.stages.identification.models import IdentificationStage, UserFields
+from authentik.stages.identification.stage import IdentificationStageView
 from authentik.stages.password.models import PasswordStage
 
 
@@ -45,9 +47,12 @@ class TestIdentificationStage(TestCase):
 
     def test_valid_render(self):
         """Test that View renders correctly"""
-        response = self.client.get(
-            reverse("authentik_api:flow-executor", kwargs={"flow_slug": self.flow.slug})
-        )
+        with stage_query_budget(self, {IdentificationStageView: 3}):
+            response = self.client.get(
+                reverse(
+                    "authentik_api:flow-executor", kwargs={"flow_slug": self.flow.slug}
+                )
+            )
         self.assertEqual(response.status_code, 200)
 
     def test_valid_with_email(self):
@@ -56,7 +61,8 @@ class TestIdentificationStage(TestCase):
         url = reverse(
             "authentik_api:flow-executor", kwargs={"flow_slug": self.flow.slug}
         )
-        response = self.client.post(url, form_data)
+        with stage_query_budget(self, {IdentificationStageView: 3}):
+            response = self.client.post(url, form_data)
         self.assertEqual(response.status_code, 200)
         self.assertJSONEqual(
             force_str(response.content),
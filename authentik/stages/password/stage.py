@@ -19,8 +19,9 @@ from authentik.flows.challenge import (
     ChallengeTypes,
     WithUserInfoChallenge,
 )
-from authentik.flows.models import Flow, FlowDesignation
+from authentik.flows.models import FlowDesignation
 from authentik.flows.planner import PLAN_CONTEXT_PENDING_USER
+from authentik.flows.registry import FLOW_REGISTRY
 from authentik.flows.stage import ChallengeStageView
 from authentik.lib.utils.reflection import path_to_class
 from authentik.stages.password.models import PasswordStage
@@ -85,11 +86,11 @@ class PasswordStageView(ChallengeStageView):
                 "type": ChallengeTypes.NATIVE.value,
             }
         )
-        recovery_flow = Flow.objects.filter(designation=FlowDesignation.RECOVERY)
-        if recovery_flow.exists():
+        recovery_flow = FLOW_REGISTRY.flow_for_designation(FlowDesignation.RECOVERY)
+        if recovery_flow:
             recover_url = reverse(
                 "authentik_core:if-flow",
-                kwargs={"flow_slug": recovery_flow.first().slug},
+                kwargs={"flow_slug": recovery_flow.slug},
             )
             challenge.initial_data["recovery_url"] = self.request.build_absolute_uri(
                 recover_url
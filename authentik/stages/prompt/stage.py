@@ -148,6 +148,8 @@ class ListPolicyEngine(PolicyEngine):
         super().__init__(PolicyBindingModel(), user, request)
         self.__list = policies
         self.use_cache = False
+        # Show all validation errors, not just the first one
+        self.short_circuit = False
 
     def _iter_bindings(self) -> Iterator[PolicyBinding]:
         for policy in self.__list:
@@ -10,10 +10,15 @@ from authentik.flows.challenge import ChallengeTypes
 from authentik.flows.markers import StageMarker
 from authentik.flows.models import Flow, FlowDesignation, FlowStageBinding
 from authentik.flows.planner import FlowPlan
+from authentik.flows.tests.utils import stage_query_budget
 from authentik.flows.views import SESSION_KEY_PLAN
 from authentik.policies.expression.models import ExpressionPolicy
 from authentik.stages.prompt.models import FieldTypes, Prompt, PromptStage
-from authentik.stages.prompt.stage import PLAN_CONTEXT_PROMPT, PromptChallengeResponse
+from authentik.stages.prompt.stage import (
+    PLAN_CONTEXT_PROMPT,
+    PromptChallengeResponse,
+    PromptStageView,
+)
 
 
 class TestPromptStage(TestCase):
@@ -103,9 +108,13 @@ class TestPromptStage(TestCase):
         session[SESSION_KEY_PLAN] = plan
         session.save()
 
-        response = self.client.get(
-            reverse("authentik_api:flow-executor", kwargs={"flow_slug": self.flow.slug})
-        )
+        # Fields are loaded with a single query, regardless of their number
+        with stage_query_budget(self, {PromptStageView: 2}):
+            response = self.client.get(
+                reverse(
+                    "authentik_api:flow-executor", kwargs={"flow_slug": self.flow.slug}
+                )
+            )
         self.assertEqual(response.status_code, 200)
         for prompt in self.stage.fields.all():
             self.assertIn(prompt.field_key, force_str(response.content))